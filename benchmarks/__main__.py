@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import json
+import sys
+from protocol import CODECS, JSON
+from .lib import LoadGenerator, LoadResult, ServerProcess, ServerUsage, percentiles
+
+PORT = 8005
+
+
+def report(result: LoadResult, before: ServerUsage, after: ServerUsage) -> dict:
+    latency = percentiles(result.latencies_ms)
+
+    return {
+        "connections": result.connections,
+        "connections_per_second": round(result.connections_per_second, 1),
+        "messages_published": result.published,
+        "messages_published_per_second": round(result.published_per_second, 1),
+        "messages_delivered": result.delivered,
+        "messages_missing": result.expected_deliveries - result.delivered,
+        "messages_delivered_per_second": round(result.delivered_per_second, 1),
+        "server_errors": result.errors,
+        "latency_ms_p50": round(latency[50], 3),
+        "latency_ms_p99": round(latency[99], 3),
+        "latency_ms_p999": round(latency[99.9], 3),
+        "server_cpu_seconds": round(after.cpu_seconds - before.cpu_seconds, 2),
+        "server_rss_mib": round(after.rss_bytes / 2**20, 1),
+        "server_peak_rss_mib": round(after.peak_rss_bytes / 2**20, 1),
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure the chat server's throughput with synthetic clients."
+    )
+    parser.add_argument("--clients", type=int, default=1_000)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument(
+        "--senders", type=int, default=5, help="Clients sending messages per room."
+    )
+    parser.add_argument(
+        "--messages", type=int, default=100, help="Messages sent by each sender."
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Messages per second per sender, 0 to send as fast as possible.",
+    )
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument(
+        "--codecs",
+        nargs="+",
+        choices=list(CODECS),
+        default=[JSON.name],
+        help="Run the benchmark once for each of these codecs, against a fresh server each time, "
+        "and report them side by side.",
+    )
+    parser.add_argument(
+        "--broker",
+        choices=["redis", "memory"],
+        default="redis",
+        help="The server's broker. The memory broker needs no Redis.",
+    )
+    parser.add_argument(
+        "--fake-redis",
+        action="store_true",
+        help="Run the server against fakeredis instead of Redis on localhost:6379.",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    return parser.parse_args(argv)
+
+
+def run(args: argparse.Namespace, codec: str) -> dict:
+    load = LoadGenerator(
+        f"ws://localhost:{PORT}",
+        clients=args.clients,
+        rooms=args.rooms,
+        senders=args.senders,
+        messages=args.messages,
+        rate=args.rate,
+        timeout=args.timeout,
+        codec=CODECS[codec],
+    )
+
+    with ServerProcess(PORT, fake_redis=args.fake_redis, broker=args.broker) as server:
+        before = server.usage()
+        result = asyncio.run(load.run())
+        after = server.usage()
+
+    return report(result, before, after)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+
+    summaries = {codec: run(args, codec) for codec in args.codecs}
+
+    if args.json:
+        json.dump(summaries, sys.stdout, indent=2)
+        print()
+    else:
+        # One column per codec
+        keys = next(iter(summaries.values())).keys()
+        width = max(len(key) for key in keys)
+        columns = {
+            codec: max(len(codec), *(len(str(v)) for v in summary.values()))
+            for codec, summary in summaries.items()
+        }
+
+        print(
+            f"{'codec':<{width}}", *(f"{c:>{columns[c]}}" for c in summaries), sep="  "
+        )
+        for key in keys:
+            print(
+                f"{key:<{width}}",
+                *(f"{summaries[c][key]:>{columns[c]}}" for c in summaries),
+                sep="  ",
+            )
+
+
+if __name__ == "__main__":
+    main()
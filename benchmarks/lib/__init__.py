@@ -0,0 +1,3 @@
+from .load_generator import LoadGenerator, LoadResult
+from .server_process import ServerProcess, ServerUsage
+from .stats import percentiles
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from typing import List
+import websockets
+from websockets import WebSocketClientProtocol
+from protocol import JSON, Chat, Codec, Error, Join, ServerMessage, decode, encode
+
+
+class LoadResult:
+    def __init__(self) -> None:
+        self.connections = 0
+        self.connect_seconds = 0.0
+
+        self.published = 0
+        self.expected_deliveries = 0
+        self.delivered = 0
+        self.run_seconds = 0.0
+
+        # Errors the server sent instead of publishing a message, such as being rate limited
+        self.errors = 0
+
+        # Time from a message being sent to it being received by each member of the room.
+        self.latencies_ms: List[float] = []
+
+    @property
+    def connections_per_second(self) -> float:
+        return self.connections / self.connect_seconds if self.connect_seconds else 0.0
+
+    @property
+    def published_per_second(self) -> float:
+        return self.published / self.run_seconds if self.run_seconds else 0.0
+
+    @property
+    def delivered_per_second(self) -> float:
+        return self.delivered / self.run_seconds if self.run_seconds else 0.0
+
+
+class SyntheticClient:
+    """A chat client that speaks the same join and chat protocol as ``client.client.Client``."""
+
+    def __init__(self, username: str, roomid: str, codec: Codec = JSON) -> None:
+        self.username = username
+        self.roomid = roomid
+        self.codec = codec
+        self.websocket: WebSocketClientProtocol | None = None
+
+    async def connect(self, uri: str) -> None:
+        self.websocket = await websockets.connect(uri)
+
+        codecs = () if self.codec is JSON else (self.codec.name,)
+        join = Join(username=self.username, roomid=self.roomid, codecs=codecs)
+        await self.websocket.send(encode(join))
+
+        reply = decode(await self.websocket.recv())
+        assert isinstance(reply, ServerMessage)
+        assert (reply.codec or JSON.name) == self.codec.name
+
+    async def send_messages(self, count: int, rate: float) -> int:
+        interval = 1 / rate if rate else 0
+
+        for seq in range(count):
+            # Each message carries its send time so that recipients can measure fan-out latency.
+            message = f"{seq}:{time.perf_counter_ns()}"
+            chat = Chat(message=message, user=self.username)
+            await self.websocket.send(encode(chat, self.codec))
+            await asyncio.sleep(interval)
+
+        return count
+
+    async def receive_messages(self, result: LoadResult, done: asyncio.Event) -> None:
+        async for frame in self.websocket:
+            received_ns = time.perf_counter_ns()
+            chat = decode(frame, codec=self.codec)
+
+            if isinstance(chat, Error):
+                result.errors += 1
+                continue
+
+            # History, say, from a server that keeps it, holds no messages from this run
+            if not isinstance(chat, Chat):
+                continue
+
+            sent_ns = int(chat.message.rpartition(":")[2])
+
+            result.latencies_ms.append((received_ns - sent_ns) / 1e6)
+            result.delivered += 1
+
+            if result.delivered >= result.expected_deliveries:
+                done.set()
+
+
+class LoadGenerator:
+    """Drives synthetic clients against a running server.
+
+    `clients` connections are spread evenly over `rooms` rooms. In each room, `senders` clients send
+    `messages` chat messages each, and every member of the room is expected to receive all of them.
+    Every client asks the server to use `codec`.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        clients: int,
+        rooms: int,
+        senders: int,
+        messages: int,
+        rate: float = 0,
+        connect_concurrency: int = 200,
+        timeout: float = 60,
+        codec: Codec = JSON,
+    ) -> None:
+        self.uri = uri
+        self.rate = rate
+        self.messages = messages
+        self.connect_concurrency = connect_concurrency
+        self.timeout = timeout
+
+        self.clients = [
+            SyntheticClient(f"bench-user-{i}", f"bench-room-{i % rooms}", codec)
+            for i in range(clients)
+        ]
+
+        # The first `senders` clients to join each room are the ones that talk.
+        self.senders = self.clients[: senders * rooms]
+
+        room_sizes = {}
+        for client in self.clients:
+            room_sizes[client.roomid] = room_sizes.get(client.roomid, 0) + 1
+
+        self.expected_deliveries = sum(
+            room_sizes[sender.roomid] * messages for sender in self.senders
+        )
+
+    async def run(self) -> LoadResult:
+        result = LoadResult()
+        result.expected_deliveries = self.expected_deliveries
+
+        await self._connect_all(result)
+
+        done = asyncio.Event()
+        receivers = [
+            asyncio.create_task(client.receive_messages(result, done))
+            for client in self.clients
+        ]
+
+        start = time.perf_counter()
+        sent = await asyncio.gather(
+            *(sender.send_messages(self.messages, self.rate) for sender in self.senders)
+        )
+        result.published = sum(sent)
+
+        try:
+            await asyncio.wait_for(done.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        result.run_seconds = time.perf_counter() - start
+
+        for receiver in receivers:
+            receiver.cancel()
+
+        await asyncio.gather(*(client.websocket.close() for client in self.clients))
+
+        return result
+
+    async def _connect_all(self, result: LoadResult) -> None:
+        semaphore = asyncio.Semaphore(self.connect_concurrency)
+
+        async def connect(client: SyntheticClient) -> None:
+            async with semaphore:
+                await client.connect(self.uri)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(connect(client) for client in self.clients))
+
+        result.connect_seconds = time.perf_counter() - start
+        result.connections = len(self.clients)
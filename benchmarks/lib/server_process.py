@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+import os
+import resource
+import socket
+import time
+from unittest.mock import patch
+
+
+class ServerUsage:
+    """CPU time and memory used by the server process, as reported by /proc."""
+
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+    def __init__(self, cpu_seconds: float, rss_bytes: int, peak_rss_bytes: int) -> None:
+        self.cpu_seconds = cpu_seconds
+        self.rss_bytes = rss_bytes
+        self.peak_rss_bytes = peak_rss_bytes
+
+    @classmethod
+    def of(cls, pid: int) -> "ServerUsage":
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name can contain spaces, so fields are counted from the end of it.
+            fields = f.read().rsplit(")", 1)[1].split()
+            utime, stime = int(fields[11]), int(fields[12])
+
+        memory = {}
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    memory[key] = int(value.split()[0]) * 1024
+
+        return cls((utime + stime) / cls.CLOCK_TICKS, memory["VmRSS"], memory["VmHWM"])
+
+
+def _raise_open_file_limit() -> None:
+    # Thousands of sockets need thousands of file descriptors.
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _serve(fake_redis: bool, broker: str) -> None:
+    from server import __main__ as server_module
+    from server.lib import BrokerKind, ServerConfig
+
+    _raise_open_file_limit()
+    config = ServerConfig(broker=BrokerKind(broker))
+
+    if not fake_redis:
+        asyncio.run(server_module.start_server(config))
+        return
+
+    import fakeredis
+
+    # The broker's Redis client is swapped out the same way the test suite swaps it for a mock.
+    with patch("server.lib.redis_broker.redis.Redis", fakeredis.aioredis.FakeRedis):
+        asyncio.run(server_module.start_server(config))
+
+
+class ServerProcess:
+    """Runs ``server.__main__.start_server`` in a child process for the duration of a benchmark.
+
+    The server gets a process of its own so that its CPU and memory use can be measured apart from the
+    load generator's.
+    """
+
+    def __init__(
+        self, port: int, fake_redis: bool = False, broker: str = "redis"
+    ) -> None:
+        self.port = port
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(fake_redis, broker),
+            name="benchmark-server",
+            daemon=True,
+        )
+
+    def __enter__(self) -> "ServerProcess":
+        _raise_open_file_limit()
+        self._process.start()
+        self._wait_until_listening()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._process.terminate()
+        self._process.join()
+
+    def usage(self) -> ServerUsage:
+        return ServerUsage.of(self._process.pid)
+
+    def _wait_until_listening(self, timeout: float = 10) -> None:
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            if not self._process.is_alive():
+                raise RuntimeError("Benchmark server exited during start-up")
+
+            try:
+                socket.create_connection(("localhost", self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+
+        raise TimeoutError(f"Benchmark server didn't listen on port {self.port}")
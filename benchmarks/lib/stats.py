@@ -0,0 +1,20 @@
+import statistics
+from typing import Dict, Iterable, Sequence
+
+DEFAULT_PERCENTILES = (50, 99, 99.9)
+
+
+def percentiles(
+    samples: Sequence[float], points: Iterable[float] = DEFAULT_PERCENTILES
+) -> Dict[float, float]:
+    """Return the requested percentiles of `samples`, e.g. ``{50: ..., 99: ..., 99.9: ...}``."""
+    if len(samples) == 0:
+        return {p: float("nan") for p in points}
+
+    if len(samples) == 1:
+        return {p: samples[0] for p in points}
+
+    # 1,000 cut points give us a resolution of 0.1 percentiles, enough for p99.9.
+    cuts = statistics.quantiles(samples, n=1000, method="inclusive")
+
+    return {p: cuts[round(p * 10) - 1] for p in points}
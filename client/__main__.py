@@ -1,32 +1,37 @@
 #!/usr/bin/env python
 
+import argparse
 import asyncio
 from typing import Any, Coroutine
 import nest_asyncio
 import websockets
+from protocol import CODECS, JSON
 from .client import Client
 from .lib import get_random_name
 from .lib.ui import ConsoleDisplay
 
+URI = "ws://localhost:8005"
 
-async def connect(username: str, roomid: str) -> Coroutine[Any, Any, None]:
-    uri = "ws://localhost:8005"
-    async with websockets.connect(uri) as websocket:
-        client = Client(username, websocket)
 
-        # Send a message to the server requesting to join a room
-        event = {"type": "join", "username": username, "roomid": roomid}
-        await client.send_event(event)
-
-        # Wait for the server's response
-        server_event = await client.receive_server_event()
-        assert server_event["type"] == "server_msg"
+async def connect(
+    username: str, roomid: str, codec: str = JSON.name
+) -> Coroutine[Any, Any, None]:
+    async with websockets.connect(URI) as websocket:
+        # The client reconnects by itself if the connection drops, so the display and its chat log
+        # outlive any one connection.
+        codecs = () if codec == JSON.name else (codec,)
+        client = Client(username, websocket, uri=URI, codecs=codecs)
 
-        client.set_roomid(roomid)
+        # Send a message to the server requesting to join a room
+        await client.join(roomid)
 
         # Create and run console UI
         display = ConsoleDisplay(client)
-        await display.run()
+
+        try:
+            await display.run()
+        finally:
+            await client.close()
 
 
 def input_with_default(prompt: str, default) -> str:
@@ -38,7 +43,23 @@ def input_with_default(prompt: str, default) -> str:
     return user_input
 
 
-def main() -> None:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Join a chat room on the local server."
+    )
+    parser.add_argument(
+        "--codec",
+        choices=list(CODECS),
+        default=JSON.name,
+        help="Ask the server to encode messages with this codec rather than JSON.",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+
     username = input_with_default(
         "What is your name? (Empty for random) ", default=get_random_name()
     )
@@ -49,7 +70,7 @@ def main() -> None:
 
     nest_asyncio.apply()
     with asyncio.Runner() as runner:
-        runner.run(connect(username, roomid))
+        runner.run(connect(username, roomid, args.codec))
 
 
 if __name__ == "__main__":
@@ -1,51 +1,310 @@
-import json
-from jsonschema import validate
-from typing import Dict, Callable
+import asyncio
+from typing import Callable, Dict, List, Sequence, Set
+import websockets
 from websockets import WebSocketClientProtocol
+from protocol import (
+    CODECS,
+    JSON,
+    MIN_PROTOCOL_VERSION,
+    MULTI_ROOM_VERSION,
+    PROTOCOL_VERSION,
+    Chat,
+    Error,
+    ErrorCode,
+    History,
+    Join,
+    Leave,
+    Message,
+    ProtocolError,
+    ServerMessage,
+    decode,
+    encode,
+)
+from .lib import Backoff
 
 
-schema = {
-    "$schema": "https://json-schema.org/draft/2020-12/schema",
-    "title": "Client Event",
-    "type": "object",
-    "properties": {
-        "type": {"type": "string"},  # "join" | "chat" | "disconnect"
-        "roomid": {"type": "string"},  # required for "join" and "disconnect"
-        "message": {"type": "string"},  # required for "chat"
-        "user": {"type": "string"},  # required for "chat"
-    },
-    "required": ["type"],
-}
+def stream_id(message_id: str) -> tuple[int, int]:
+    """Make a Redis stream ID, "<milliseconds>-<sequence>", comparable."""
+    milliseconds, sequence = message_id.split("-")
+    return int(milliseconds), int(sequence)
 
 
 class Client:
+    # Refusals to let us rejoin that may not be repeated if we try again later
+    RETRYABLE_ERRORS = {ErrorCode.RATE_LIMITED}
 
-    def __init__(self, username: str, websocket: WebSocketClientProtocol) -> None:
+    def __init__(
+        self,
+        username: str,
+        websocket: WebSocketClientProtocol,
+        uri: str | None = None,
+        backoff: Backoff = Backoff(),
+        trusted: bool = False,
+        codecs: Sequence[str] = (),
+    ) -> None:
         self.username = username
+        # The room we joined with, and every room we're in, including that one
         self.roomid = ""
+        self.rooms: List[str] = []
+        # Rooms we've asked to join since the handshake, that the server hasn't replied about yet
+        self._joining: Set[str] = set()
         self.websocket = websocket
 
+        # A trusted client skips validating the messages it receives.
+        self.trusted = trusted
+
+        # The protocol version and codec the server chose when we joined. We ask for the codecs we'd
+        # rather use than JSON, in order of preference, and the server picks one it has.
+        self.version = PROTOCOL_VERSION
+        self.codecs = tuple(codecs)
+        self.codec = JSON
+
+        # Given the server's URI, a lost connection is reconnected to rather than ending the session.
+        self.uri = uri
+        self.backoff = backoff
+        self._closed = False
+
+        # The ID of the last chat event we've seen in each room, if the server tags them. Rejoining
+        # with it has the server send only the messages we missed while disconnected.
+        self.last_ids: Dict[str, str] = {}
+
     def __repr__(self) -> str:
         return self.username
 
     def set_roomid(self, roomid: str) -> None:
         self.roomid = roomid
 
-    async def receive_server_event(self) -> Dict:
-        server_event = json.loads(await self.websocket.recv())
-        validate(server_event, schema)
-        return server_event
+        if roomid not in self.rooms:
+            self.rooms.insert(0, roomid)
+
+    async def join(self, roomid: str) -> None:
+        """
+        Join a room as the connection's handshake, resuming from the last message we saw if we've
+        been in it before.
+
+        Raises:
+            ProtocolError: If the server refuses the join.
+        """
+        join = Join(
+            username=self.username,
+            roomid=roomid,
+            last_id=self.last_ids.get(roomid),
+            version=PROTOCOL_VERSION,
+            codecs=self.codecs,
+        )
+
+        # Every connection starts out speaking JSON, until the server replies with its choice
+        self.codec = JSON
+        await self.send_event(join)
+
+        # Wait for the server's response
+        reply = await self.receive_server_event()
+
+        if isinstance(reply, Error):
+            raise ProtocolError(reply.code, reply.message)
+
+        if not isinstance(reply, ServerMessage):
+            raise ProtocolError(
+                ErrorCode.UNEXPECTED_MESSAGE,
+                f"Expected a reply to join, not {reply.TYPE}",
+            )
+
+        # Servers that predate versioning don't say which version they chose
+        self.version = reply.version or MIN_PROTOCOL_VERSION
+
+        if reply.codec is not None:
+            if reply.codec not in CODECS:
+                raise ProtocolError(
+                    ErrorCode.INVALID_FIELD,
+                    f"The server chose the {reply.codec} codec, which isn't available",
+                )
+
+            self.codec = CODECS[reply.codec]
+
+        self.set_roomid(roomid)
+
+    async def join_room(self, roomid: str) -> None:
+        """
+        Join another room over the same connection. The server's reply, and the room's messages,
+        arrive with everything else we're sent, and the room is only one of ours once the server
+        has accepted it.
+
+        Raises:
+            ProtocolError: If the server is too old to join more than one room per connection.
+        """
+        if self.version < MULTI_ROOM_VERSION:
+            raise ProtocolError(
+                ErrorCode.UNSUPPORTED_VERSION,
+                "The server can't join more than one room per connection",
+            )
+
+        await self.send_event(
+            Join(
+                username=self.username,
+                roomid=roomid,
+                last_id=self.last_ids.get(roomid),
+            )
+        )
+        self._joining.add(roomid)
+
+    async def leave_room(self, roomid: str) -> None:
+        await self.send_event(Leave(roomid=roomid))
+        self._joining.discard(roomid)
+
+        if roomid in self.rooms:
+            self.rooms.remove(roomid)
+
+        # Reconnecting rejoins the primary room first, so it has to be one we're still in
+        if roomid == self.roomid:
+            self.roomid = self.rooms[0] if self.rooms else ""
+
+    async def receive_server_event(self) -> Message:
+        return decode(
+            await self.websocket.recv(), validate=not self.trusted, codec=self.codec
+        )
+
+    async def reconnect(self, on_error: Callable[[Error], None] | None = None) -> bool:
+        """
+        Connect to the server again and rejoin our rooms, retrying until it succeeds. Rejoining
+        resumes from the last message we saw in each, so the chat log picks up where it left off.
+        A server that refuses to let us rejoin has why reported to on_error, and is only tried
+        again if it might let us in later.
+
+        Returns:
+            Whether we're connected again.
+        """
+        attempt = 0
+
+        while True:
+            await asyncio.sleep(self.backoff.delay(attempt))
+            attempt += 1
+            websocket = None
+
+            try:
+                self.websocket = websocket = await websockets.connect(self.uri)
+                await self.join(self.roomid)
+
+                # A server that has gone back to an older version only lets us into the one room.
+                # Rooms we were still waiting to be let into are asked for again too.
+                if self.version >= MULTI_ROOM_VERSION:
+                    for roomid in [*self.rooms, *self._joining]:
+                        if roomid != self.roomid:
+                            await self.join_room(roomid)
+
+                return True
+            except ProtocolError as error:
+                if on_error is not None:
+                    on_error(error.to_message())
+
+                if error.code not in self.RETRYABLE_ERRORS:
+                    await websocket.close()
+                    return False
+            except (OSError, websockets.InvalidHandshake, websockets.ConnectionClosed):
+                pass
+
+            # A connection the server didn't let us back in over isn't left open
+            if websocket is not None:
+                await websocket.close()
+
+    async def close(self) -> None:
+        self._closed = True
+        await self.websocket.close()
+
+    async def handle_incoming_messages(
+        self,
+        callback: Callable[[Chat], None],
+        on_error: Callable[[Error], None] | None = None,
+    ) -> None:
+        """
+        Pass each chat message we receive to the callback, and any error the server reports to
+        on_error, until we're closed, or the connection is lost and can't be rejoined.
+
+        Raises:
+            ProtocolError: If the server sends something that isn't a valid message.
+        """
+        while True:
+            try:
+                async for frame in self.websocket:
+                    message = decode(frame, validate=not self.trusted, codec=self.codec)
+
+                    # Recent history arrives as one batch of chat messages when we join a room.
+                    if isinstance(message, History):
+                        for chat in message.messages:
+                            self._handle_chat(chat, callback, message.roomid)
+                    elif isinstance(message, Chat):
+                        self._handle_chat(message, callback)
+                    elif isinstance(message, Error):
+                        self._refused(message.roomid)
+
+                        if on_error is not None:
+                            on_error(message)
+                    elif isinstance(message, ServerMessage):
+                        # The server's replies to joining and leaving rooms after the first
+                        self._joined(message.roomid)
+                    else:
+                        raise ProtocolError(
+                            ErrorCode.UNEXPECTED_MESSAGE,
+                            f"Unexpected {message.TYPE} message",
+                        )
+            except websockets.ConnectionClosed:
+                pass
+
+            # A client that's left every room has none to rejoin, so its session ends here
+            if self.uri is None or self._closed or not self.roomid:
+                return
+
+            if not await self.reconnect(on_error):
+                return
+
+    def _joined(self, roomid: str | None) -> None:
+        if roomid not in self._joining:
+            return
+
+        self._joining.discard(roomid)
+
+        if roomid not in self.rooms:
+            self.rooms.append(roomid)
+
+        if not self.roomid:
+            self.roomid = roomid
+
+    def _refused(self, roomid: str | None) -> None:
+        # A room the server wouldn't let us into isn't one to rejoin after reconnecting
+        if roomid not in self._joining:
+            return
+
+        self._joining.discard(roomid)
+
+        if roomid in self.rooms:
+            self.rooms.remove(roomid)
+
+    def _handle_chat(
+        self,
+        chat: Chat,
+        callback: Callable[[Chat], None],
+        roomid: str | None = None,
+    ) -> None:
+        message_id = chat.id
+
+        if message_id is not None:
+            # Messages from servers that predate tagging them with their room are from the room we
+            # joined with, the only one those servers let us join.
+            roomid = chat.roomid or roomid or self.roomid
+            last_id = self.last_ids.get(roomid)
+
+            # A message published while we were joining can arrive both in the history and live, so
+            # anything at or before the last ID we've seen is a repeat. IDs are only in order
+            # within a room.
+            if last_id and stream_id(message_id) <= stream_id(last_id):
+                return
+
+            self.last_ids[roomid] = message_id
 
-    async def handle_incoming_messages(self, callback: Callable[[Dict], None]) -> None:
-        async for message in self.websocket:
-            event = json.loads(message)
-            assert event["type"] == "chat"
-            callback(event)
+        callback(chat)
 
-    async def send_event(self, event: Dict) -> None:
-        validate(event, schema)
-        await self.websocket.send(json.dumps(event))
+    async def send_event(self, message: Message) -> None:
+        await self.websocket.send(encode(message, self.codec))
 
-    async def send_message(self, msg: str) -> None:
-        event = {"type": "chat", "message": msg, "user": self.username}
-        await self.send_event(event)
+    async def send_message(self, msg: str, roomid: str | None = None) -> None:
+        """Send a chat message, to the given room if we're in more than one."""
+        await self.send_event(Chat(message=msg, user=self.username, roomid=roomid))
@@ -1 +1,2 @@
+from .backoff import Backoff
 from .username_randomiser import get_random_name
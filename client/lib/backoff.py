@@ -0,0 +1,20 @@
+import random
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Backoff:
+    """Exponential backoff with full jitter.
+
+    Each delay is drawn uniformly between zero and an exponentially growing bound, capped at `cap`
+    seconds. Spreading retries over the whole range means that clients which all lost their
+    connection at the same moment, say to a server restart, don't all come back at the same moment.
+    """
+
+    base: float = 0.5
+    cap: float = 30.0
+
+    def delay(self, attempt: int) -> float:
+        # The exponent is capped as well, so long outages can't overflow the float
+        bound = min(self.cap, self.base * 2 ** min(attempt, 32))
+        return random.uniform(0, bound)
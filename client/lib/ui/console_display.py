@@ -1,6 +1,8 @@
 import asyncio
-from typing import Dict
+from typing import List, Tuple
 import urwid as u
+import websockets
+from protocol import Chat, Error
 from .custom_widgets import Chatlog, InputBox, InfoPanel
 from client.client import Client
 
@@ -18,12 +20,25 @@ class ConsoleDisplay:
         ("heading", "white", "", "bold"),
         ("user_highlight", "light green", ""),
         ("self_highlight", "light red", "", "underline"),
+        ("error", "yellow", "", "bold"),
     ]
 
-    def __init__(self, client: Client) -> None:
+    # Incoming messages are drawn at most this many times a second, however fast they arrive
+    MAX_FRAME_RATE = 30
+
+    def __init__(
+        self,
+        client: Client,
+        scrollback_bytes: int = Chatlog.DEFAULT_SCROLLBACK_BYTES,
+    ) -> None:
         self.client = client
 
-        self.chatlog = Chatlog()
+        # (user, message, attr) lines waiting to be added to the chat log
+        self._pending: List[Tuple[str, str, str]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._last_flush = float("-inf")
+
+        self.chatlog = Chatlog(scrollback_bytes)
         chatlog_lb = self.LineBoxDecoration(self.chatlog, "Chatlog")
 
         self.inputbox = InputBox()
@@ -45,22 +60,54 @@ class ConsoleDisplay:
 
         self.frame = u.Frame(columns, header=header, footer=footer)
 
-    def _handle_receive_message(self, event: Dict):
+    def _handle_receive_message(self, chat: Chat):
         """Behaviour for displaying messages on client receipt"""
-        highlight = "user_highlight"
-        if event["user"] == self.client.username:
-            highlight = "self_highlight"
-
-        self.chatlog.append_and_set_focus(event["user"], event["message"], highlight)
+        self._add_line(chat.user, chat.message, self._highlight(chat))
+
+    async def _send_message(self, message: str) -> None:
+        try:
+            await self.client.send_message(message)
+        except websockets.ConnectionClosed:
+            # While the client is reconnecting it has no connection to send over
+            self._add_line("Client", f"Not connected, so not sent: {message}", "error")
+
+    def _handle_error(self, error: Error) -> None:
+        """Errors from the server are shown in the chat log, in line with the messages."""
+        self._add_line("Server", error.message, "error")
+
+    def _add_line(self, user: str, message: str, attr: str) -> None:
+        # Redrawing the screen for every message can't keep up with a busy room, so messages are
+        # buffered and drawn in batches, one per frame.
+        self._pending.append((user, message, attr))
+
+        if self._flush_handle is None:
+            frame_interval = 1 / self.MAX_FRAME_RATE
+            delay = self._last_flush + frame_interval - self._event_loop.time()
+            self._flush_handle = self._event_loop.call_later(
+                max(delay, 0), self._flush_pending_messages
+            )
+
+    def _flush_pending_messages(self) -> None:
+        self._flush_handle = None
+        self._last_flush = self._event_loop.time()
+
+        pending, self._pending = self._pending, []
+        self.chatlog.extend(pending)
         self.urwid_loop.draw_screen()
 
+    def _highlight(self, chat: Chat) -> str:
+        if chat.user == self.client.username:
+            return "self_highlight"
+
+        return "user_highlight"
+
     async def run(self) -> None:
 
         def exit_on_esc(key: str) -> None:
             if key in {"esc"}:
                 raise u.ExitMainLoop()
 
-        event_loop = asyncio.get_running_loop()
+        event_loop = self._event_loop = asyncio.get_running_loop()
         urwid_asyncio_loop = u.AsyncioEventLoop(loop=event_loop)
 
         self.urwid_loop = u.MainLoop(
@@ -72,12 +119,14 @@ class ConsoleDisplay:
 
         # Behaviour for sending messages on inputbox 'enter'
         def handle_on_enter(message: str) -> None:
-            event_loop.create_task(self.client.send_message(message))
+            event_loop.create_task(self._send_message(message))
 
         self.inputbox.set_on_enter(handle_on_enter)
 
         event_loop.create_task(
-            self.client.handle_incoming_messages(callback=self._handle_receive_message)
+            self.client.handle_incoming_messages(
+                callback=self._handle_receive_message, on_error=self._handle_error
+            )
         )
 
         self.urwid_loop.run()
@@ -0,0 +1,21 @@
+import sys
+
+
+class ChatRecord:
+    """One line of the chat log, stored as compactly as plain Python allows.
+
+    Records have no instance dict, and their user and attr strings are interned, so the many records
+    sharing a username, each of which arrived as its own freshly decoded string, share one copy.
+    """
+
+    __slots__ = ("user", "message", "attr")
+
+    def __init__(self, user: str, message: str, attr: str) -> None:
+        self.user = sys.intern(user)
+        self.message = message
+        self.attr = sys.intern(attr)
+
+    @property
+    def size(self) -> int:
+        """Bytes this record alone keeps alive. Interned strings are shared, so aren't counted."""
+        return sys.getsizeof(self) + sys.getsizeof(self.message)
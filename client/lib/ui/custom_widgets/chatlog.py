@@ -1,22 +1,74 @@
+from typing import Iterable, Tuple
 import urwid as u
+from .chat_record import ChatRecord
 from .deque_walker import DequeWalker
 
 
 class Chatlog(u.ListBox):
-    def __init__(self) -> None:
+    # Messages are kept as compact records, and only turned into widgets as they're scrolled into
+    # view. The scrollback is limited by the memory those records take rather than by their number,
+    # so it holds however many messages fit, short or long. 16 MiB is over 100,000 typical messages.
+    #
+    # The log follows new messages while it's focused on the newest one. Once it's been scrolled up
+    # it stays where it is, and isn't redrawn for messages that arrive out of view.
+    DEFAULT_SCROLLBACK_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, scrollback_bytes: int = DEFAULT_SCROLLBACK_BYTES) -> None:
         self.exit_focus = None
-        self.walker = DequeWalker(wrap_around=False)
+        # The size the log was last rendered at, to tell which messages it's showing
+        self._size: Tuple[int, int] | None = None
+        self.walker = DequeWalker(
+            wrap_around=False,
+            maxlen=None,
+            widget_factory=self._render,
+            max_bytes=scrollback_bytes,
+            sizeof=ChatRecord.size.fget,
+        )
 
         super().__init__(body=self.walker)
 
+        u.connect_signal(self.walker, "appended", self._on_appended)
+        u.connect_signal(self.walker, "evicted", self._on_evicted)
+
     @property
     def size(self) -> int:
         return len(self.walker.contents)
 
+    def render(self, size: Tuple[int, int], focus: bool = False) -> u.Canvas:
+        self._size = size
+        return super().render(size, focus)
+
     def append(self, user: str, message: str, attr: str) -> None:
-        text_content = [(attr, user), f": {message}"]
-        self.walker.append(u.Text(text_content))
+        self.walker.append(ChatRecord(user, message, attr))
+
+    def extend(self, messages: Iterable[Tuple[str, str, str]]) -> None:
+        """Append a batch of (user, message, attr) messages. The log is changed at most once,
+        however many messages are in the batch."""
+        self.walker.extend(
+            ChatRecord(user, message, attr) for user, message, attr in messages
+        )
+
+    @staticmethod
+    def _render(record: ChatRecord) -> u.Text:
+        return u.Text([(record.attr, record.user), f": {record.message}"])
+
+    def _on_appended(self, start: int, stop: int) -> None:
+        # Focused on what was the newest message, or on nothing yet
+        if self.walker.focus >= start - 1:
+            self.walker.set_focus(stop - 1)
+        elif self._shows(start):
+            self.walker._modified()
+
+    def _shows(self, position: int) -> bool:
+        # A log that hasn't been drawn has nothing to redraw
+        if self._size is None:
+            return False
+
+        _, _, (_, below) = self.calculate_visible(self._size)
+        return any(item.position >= position for item in below)
 
-    def append_and_set_focus(self, user: str, message: str, attr: str) -> None:
-        self.append(user, message, attr)
-        self.walker.set_focus(self.size - 1)
+    def _on_evicted(self, start: int, stop: int) -> None:
+        # Evicting old messages doesn't renumber the rest, so the view only has to change if the
+        # message it's focused on has gone.
+        if self.walker.focus < stop and self.size:
+            self.walker.set_focus(self.walker.first_position)
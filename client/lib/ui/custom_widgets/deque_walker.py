@@ -1,6 +1,7 @@
+import sys
 import urwid as u
-from collections import deque
-from typing import Self
+from collections import OrderedDict, deque
+from typing import Any, Callable, Iterable, Self
 
 
 class DequeWalker(deque, u.ListWalker):
@@ -9,6 +10,22 @@ class DequeWalker(deque, u.ListWalker):
     maxlen (default 10,000 elements), results in then element at the start of the deque being
     destroyed to prevent excessive memory use.
 
+    Given a `widget_factory`, the walker holds plain records rather than widgets, and a record's
+    widget is only created when the :class:`ListBox` asks for its position, which it only does for
+    the rows it's about to display. The most recently displayed widgets are kept, up to
+    `cache_size` of them, so scrolling and redrawing don't keep recreating them.
+
+    Given `max_bytes`, the walker also evicts records from the start once the sizes reported by
+    `sizeof` add up to more than that.
+
+    Positions are stable: each record keeps the position it was appended at, counting up from 0,
+    rather than its index in the deque, so evicting from the start doesn't move the focus or any
+    other position a :class:`ListBox` holds on to. Negative positions count back from the end, as
+    deque indexes do. Besides the usual "modified" signal, the walker emits "appended" and
+    "evicted" with the (start, stop) range of positions affected, so a view can tell whether a
+    change touches the rows it shows. Records must only be added with :meth:`append` or
+    :meth:`extend` and removed with :meth:`popleft` for positions and sizes to stay right.
+
     Raises:
         IndexError: If attempting to access an element outside of the length or capacity of the
         underlying deque. Additionally, attempting to retrieve a position using `next_position` or
@@ -16,14 +33,31 @@ class DequeWalker(deque, u.ListWalker):
         an `IndexError`.
     """
 
+    signals = ["appended", "evicted"]
+
     DEFAULT_MAXLEN = 10_000
+    DEFAULT_CACHE_SIZE = 256
 
-    def __init__(self, wrap_around: bool = False, maxlen: int = DEFAULT_MAXLEN) -> None:
+    def __init__(
+        self,
+        wrap_around: bool = False,
+        maxlen: int | None = DEFAULT_MAXLEN,
+        widget_factory: Callable[[Any], u.Widget] | None = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        max_bytes: int | None = None,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+    ) -> None:
         """
         contents -- list to copy into this object
 
         wrap_around -- if true, jumps to beginning/end of list on move
 
+        widget_factory -- if given, creates the widget displayed for a record
+
+        cache_size -- how many created widgets to keep for reuse
+
+        max_bytes -- if given, the most memory the records may take up, as measured by sizeof
+
         This class inherits :class:`deque` which means
         it can be treated as a deque would.
 
@@ -35,14 +69,97 @@ class DequeWalker(deque, u.ListWalker):
         self.focus = 0
         self.wrap_around = wrap_around
 
+        # The position of the oldest record. Everything after it is numbered consecutively.
+        self.first_position = 0
+
+        self._widget_factory = widget_factory
+        self._cache_size = cache_size
+        self._widgets: OrderedDict[int, u.Widget] = OrderedDict()
+
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._sizeof = sizeof
+
     @property
     def contents(self) -> Self:
         return self
 
+    @property
+    def last_position(self) -> int:
+        """The position of the newest record, or one before `first_position` while empty."""
+        return self.first_position + len(self) - 1
+
+    def append(self, record: Any) -> None:
+        self._append(record)
+        u.emit_signal(self, "appended", self.last_position, self.last_position + 1)
+
+    def extend(self, records: Iterable[Any]) -> None:
+        """Append several records, notifying listeners of them all at once."""
+        start = self.last_position + 1
+
+        for record in records:
+            self._append(record)
+
+        # Records at the start of a long batch may have been evicted again before its end
+        start = max(start, self.first_position)
+
+        if start <= self.last_position:
+            u.emit_signal(self, "appended", start, self.last_position + 1)
+
+    def popleft(self) -> Any:
+        record = super().popleft()
+        self.bytes -= self._sizeof(record)
+
+        position = self.first_position
+        self.first_position += 1
+        self._widgets.pop(position, None)
+
+        u.emit_signal(self, "evicted", position, position + 1)
+        return record
+
+    def _append(self, record: Any) -> None:
+        if len(self) == self.maxlen:
+            self.popleft()
+
+        super().append(record)
+        self.bytes += self._sizeof(record)
+
+        if self.max_bytes is not None:
+            # The newest record is always kept, even if it's over budget on its own
+            while self.bytes > self.max_bytes and len(self) > 1:
+                self.popleft()
+
+    def __getitem__(self, position: int) -> Any:
+        if position >= 0:
+            index = position - self.first_position
+
+            if index < 0:
+                raise IndexError(f"No widget at position {position}")
+        else:
+            index = position
+            position += self.last_position + 1
+
+        record = super().__getitem__(index)
+
+        if self._widget_factory is None:
+            return record
+
+        widget = self._widgets.get(position)
+
+        if widget is None:
+            widget = self._widgets[position] = self._widget_factory(record)
+
+            if len(self._widgets) > self._cache_size:
+                self._widgets.popitem(last=False)
+        else:
+            self._widgets.move_to_end(position)
+
+        return widget
+
     def set_focus(self, position: int) -> None:
         """Set focus position."""
 
-        if not 0 <= position < len(self):
+        if not self.first_position <= position <= self.last_position:
             raise IndexError(f"No widget at position {position}")
 
         self.focus = position
@@ -52,9 +169,9 @@ class DequeWalker(deque, u.ListWalker):
         """
         Return position after start_from.
         """
-        if len(self) - 1 <= position:
+        if self.last_position <= position:
             if self.wrap_around:
-                return 0
+                return self.first_position
             raise IndexError
         return position + 1
 
@@ -62,8 +179,8 @@ class DequeWalker(deque, u.ListWalker):
         """
         Return position before start_from.
         """
-        if position <= 0:
+        if position <= self.first_position:
             if self.wrap_around:
-                return len(self) - 1
+                return self.last_position
             raise IndexError
         return position - 1
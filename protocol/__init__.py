@@ -0,0 +1,28 @@
+from .codecs import (
+    CBOR,
+    CODECS,
+    JSON,
+    MSGPACK,
+    Codec,
+    codec_for_frame,
+    negotiate_codec,
+    transcode,
+    transcode_history,
+)
+from .messages import (
+    MIN_PROTOCOL_VERSION,
+    MULTI_ROOM_VERSION,
+    PROTOCOL_VERSION,
+    Chat,
+    Error,
+    ErrorCode,
+    History,
+    Join,
+    Leave,
+    Message,
+    ProtocolError,
+    ServerMessage,
+    decode,
+    encode,
+    negotiate_version,
+)
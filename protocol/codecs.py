@@ -0,0 +1,121 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Sequence
+import cbor2
+import msgpack
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Codec:
+    """How a connection's frames are serialised, and how the messages it publishes are stored in
+    Redis. Every message is a map, so which codec a stored frame was written with can be told from
+    its first byte: see :func:`codec_for_frame`.
+
+    `binary` codecs produce bytes, which are sent as binary websocket frames. JSON produces text.
+    """
+
+    name: str
+    binary: bool
+    dumps: Callable[[Dict[str, Any]], str | bytes]
+    loads: Callable[[str | bytes], Any]
+    # The bytes this codec's maps start with
+    first_bytes: FrozenSet[int]
+
+
+# Every JSON frame is encoded by this one encoder, built once, rather than through json.dumps and its
+# per-call option handling. It has the default options, so frames look the same as they always have.
+_encoder = json.JSONEncoder()
+
+JSON = Codec(
+    name="json",
+    binary=False,
+    dumps=_encoder.encode,
+    loads=json.loads,
+    first_bytes=frozenset(b"{"),
+)
+
+MSGPACK = Codec(
+    name="msgpack",
+    binary=True,
+    dumps=msgpack.packb,
+    loads=msgpack.unpackb,
+    # Maps are 0x80-0x8f when they have fewer than 16 keys, else 0xde or 0xdf
+    first_bytes=frozenset([*range(0x80, 0x90), 0xDE, 0xDF]),
+)
+
+CBOR = Codec(
+    name="cbor",
+    binary=True,
+    dumps=cbor2.dumps,
+    loads=cbor2.loads,
+    # Maps are major type 5, 0xa0-0xbf
+    first_bytes=frozenset(range(0xA0, 0xC0)),
+)
+
+CODECS: Dict[str, Codec] = {codec.name: codec for codec in (JSON, MSGPACK, CBOR)}
+
+
+def codec_for_frame(frame: str | bytes) -> Codec:
+    """The codec a frame was encoded with, from its first byte.
+
+    Raises:
+        ValueError: If no available codec writes frames that start that way.
+    """
+    if isinstance(frame, str):
+        return JSON
+
+    for codec in CODECS.values():
+        if frame[:1] and frame[0] in codec.first_bytes:
+            return codec
+
+    raise ValueError(f"Not a frame from any available codec: {frame[:1]!r}")
+
+
+def transcode(frame: str | bytes, codec: Codec) -> str | bytes:
+    """Re-encode a frame, from whichever codec it was written with, for a connection using `codec`.
+    Frames already in that codec are passed through without being decoded."""
+    source = codec_for_frame(frame)
+
+    if source is codec:
+        if isinstance(frame, bytes) and not codec.binary:
+            return frame.decode()
+
+        return frame
+
+    return codec.dumps(source.loads(frame))
+
+
+def transcode_history(
+    frames: Iterable[str | bytes], codec: Codec, roomid: str | None = None
+) -> str | bytes:
+    """Assemble stored chat frames into one history message for a connection using `codec`, tagged
+    with the room they're from if it's given."""
+    frames = list(frames)
+    head: Dict[str, Any] = {"type": "history"}
+
+    if roomid is not None:
+        head["roomid"] = roomid
+
+    if codec is JSON and all(codec_for_frame(frame) is JSON for frame in frames):
+        # JSON frames are already serialised chat events, so the batch is assembled around them
+        # rather than decoded and encoded again.
+        messages = ", ".join(transcode(frame, JSON) for frame in frames)
+        return json.dumps(head)[:-1] + ', "messages": [' + messages + "]}"
+
+    return codec.dumps(
+        {
+            **head,
+            "messages": [codec_for_frame(frame).loads(frame) for frame in frames],
+        }
+    )
+
+
+def negotiate_codec(names: Sequence[str]) -> Codec:
+    """The first of a peer's preferred codecs that's available here, or JSON if none are."""
+    for name in names:
+        codec = CODECS.get(name)
+
+        if codec is not None:
+            return codec
+
+    return JSON
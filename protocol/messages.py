@@ -0,0 +1,341 @@
+import re
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any, ClassVar, Dict, Tuple, Type
+from .codecs import JSON, Codec
+
+# The version of the protocol spoken here, and the oldest one still understood. Joins that don't say
+# which version they speak are from clients that predate versioning, which spoke version 1.
+PROTOCOL_VERSION = 2
+MIN_PROTOCOL_VERSION = 1
+
+# The first version in which a connection can join and leave rooms after its first join
+MULTI_ROOM_VERSION = 2
+
+# Message IDs are Redis stream IDs, "<milliseconds>-<sequence>"
+MESSAGE_ID = re.compile(r"\d+-\d+")
+
+
+class ErrorCode(StrEnum):
+    INVALID_FRAME = "invalid_frame"
+    UNKNOWN_TYPE = "unknown_type"
+    INVALID_FIELD = "invalid_field"
+    UNEXPECTED_MESSAGE = "unexpected_message"
+    UNSUPPORTED_VERSION = "unsupported_version"
+    RATE_LIMITED = "rate_limited"
+    NOT_IN_ROOM = "not_in_room"
+    TOO_MANY_ROOMS = "too_many_rooms"
+
+
+class ProtocolError(ValueError):
+    """A frame that isn't a valid message, or a message that isn't valid where it was sent."""
+
+    def __init__(
+        self, code: ErrorCode, message: str, roomid: str | None = None
+    ) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        # The room the refused message was for, when it was for one
+        self.roomid = roomid
+
+    def to_message(self) -> "Error":
+        return Error(code=self.code, message=self.message, roomid=self.roomid)
+
+
+def _field(
+    event: Dict[str, Any],
+    name: str,
+    kind: type,
+    validate: bool,
+    required: bool = True,
+) -> Any:
+    value = event.get(name)
+
+    if not validate or (value is None and not required):
+        return value
+
+    # bool is a subclass of int, but true isn't a version number
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise ProtocolError(
+            ErrorCode.INVALID_FIELD,
+            f"{event.get('type')} {name} must be a {kind.__name__}",
+        )
+
+    return value
+
+
+@dataclass(frozen=True, slots=True)
+class Join:
+    """Sent by a client to join a room. The first message on every connection, and from version 2
+    on, sent again to join more rooms over the same connection."""
+
+    TYPE: ClassVar[str] = "join"
+
+    username: str
+    roomid: str
+    last_id: str | None = None
+    # The newest protocol version the client speaks
+    version: int = MIN_PROTOCOL_VERSION
+    # The codecs the client would rather use than JSON, most preferred first
+    codecs: Tuple[str, ...] = ()
+
+    def to_event(self) -> Dict[str, Any]:
+        event = {"type": self.TYPE, "username": self.username, "roomid": self.roomid}
+
+        if self.last_id is not None:
+            event["last_id"] = self.last_id
+
+        if self.version != MIN_PROTOCOL_VERSION:
+            event["version"] = self.version
+
+        if self.codecs:
+            event["codecs"] = list(self.codecs)
+
+        return event
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any], validate: bool = True) -> "Join":
+        version = _field(event, "version", int, validate, required=False)
+        codecs = _field(event, "codecs", list, validate, required=False) or ()
+
+        if validate and not all(isinstance(codec, str) for codec in codecs):
+            raise ProtocolError(
+                ErrorCode.INVALID_FIELD, "join codecs must be a list of names"
+            )
+
+        join = cls(
+            username=_field(event, "username", str, validate),
+            roomid=_field(event, "roomid", str, validate),
+            last_id=_field(event, "last_id", str, validate, required=False),
+            version=MIN_PROTOCOL_VERSION if version is None else version,
+            codecs=tuple(codecs),
+        )
+
+        if validate and not (join.username and join.roomid):
+            raise ProtocolError(
+                ErrorCode.INVALID_FIELD, "join username and roomid must not be empty"
+            )
+
+        if (
+            validate
+            and join.last_id is not None
+            and not MESSAGE_ID.fullmatch(join.last_id)
+        ):
+            raise ProtocolError(
+                ErrorCode.INVALID_FIELD,
+                "join last_id must be a message ID, <milliseconds>-<sequence>",
+                join.roomid,
+            )
+
+        return join
+
+
+@dataclass(frozen=True, slots=True)
+class Leave:
+    """Sent by a client to leave one of the rooms it has joined, from version 2 on. The connection
+    stays open, even once it has left every room."""
+
+    TYPE: ClassVar[str] = "leave"
+
+    roomid: str
+
+    def to_event(self) -> Dict[str, Any]:
+        return {"type": self.TYPE, "roomid": self.roomid}
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any], validate: bool = True) -> "Leave":
+        return cls(roomid=_field(event, "roomid", str, validate))
+
+
+@dataclass(frozen=True, slots=True)
+class Chat:
+    """A chat message. Sent by clients, and relayed by the server to everyone in the room, tagged
+    with an ID when the server keeps history.
+
+    The server tags every message it relays with its room. Clients in more than one room tag the
+    messages they send with the room they're for, which may be left out while they're only in one.
+    """
+
+    TYPE: ClassVar[str] = "chat"
+
+    message: str
+    user: str
+    id: str | None = None
+    roomid: str | None = None
+
+    def to_event(self) -> Dict[str, Any]:
+        event = {"type": self.TYPE, "message": self.message, "user": self.user}
+
+        if self.roomid is not None:
+            event["roomid"] = self.roomid
+
+        if self.id is not None:
+            event["id"] = self.id
+
+        return event
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any], validate: bool = True) -> "Chat":
+        return cls(
+            message=_field(event, "message", str, validate),
+            user=_field(event, "user", str, validate),
+            id=_field(event, "id", str, validate, required=False),
+            roomid=_field(event, "roomid", str, validate, required=False),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class History:
+    """A room's recent chat messages, oldest first, sent by the server as a client joins."""
+
+    TYPE: ClassVar[str] = "history"
+
+    messages: Tuple[Chat, ...]
+    roomid: str | None = None
+
+    def to_event(self) -> Dict[str, Any]:
+        event: Dict[str, Any] = {"type": self.TYPE}
+
+        if self.roomid is not None:
+            event["roomid"] = self.roomid
+
+        event["messages"] = [message.to_event() for message in self.messages]
+        return event
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any], validate: bool = True) -> "History":
+        messages = _field(event, "messages", list, validate)
+
+        if validate and not all(isinstance(message, dict) for message in messages):
+            raise ProtocolError(
+                ErrorCode.INVALID_FIELD, "history messages must be chat messages"
+            )
+
+        return cls(
+            messages=tuple(Chat.from_event(message, validate) for message in messages),
+            roomid=_field(event, "roomid", str, validate, required=False),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ServerMessage:
+    """A notice from the server. The reply to a connection's first join carries the protocol version
+    the server chose for the connection, and the codec it chose if that isn't JSON. Replies to joins
+    and leaves carry the room they were for."""
+
+    TYPE: ClassVar[str] = "server_msg"
+
+    message: str
+    version: int | None = None
+    codec: str | None = None
+    roomid: str | None = None
+
+    def to_event(self) -> Dict[str, Any]:
+        event = {"type": self.TYPE, "message": self.message}
+
+        if self.version is not None:
+            event["version"] = self.version
+
+        if self.codec is not None:
+            event["codec"] = self.codec
+
+        if self.roomid is not None:
+            event["roomid"] = self.roomid
+
+        return event
+
+    @classmethod
+    def from_event(
+        cls, event: Dict[str, Any], validate: bool = True
+    ) -> "ServerMessage":
+        return cls(
+            message=_field(event, "message", str, validate),
+            version=_field(event, "version", int, validate, required=False),
+            codec=_field(event, "codec", str, validate, required=False),
+            roomid=_field(event, "roomid", str, validate, required=False),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class Error:
+    """Sent by the server in reply to a message it couldn't accept, with the room the message was
+    for if it was for one."""
+
+    TYPE: ClassVar[str] = "error"
+
+    code: str
+    message: str
+    roomid: str | None = None
+
+    def to_event(self) -> Dict[str, Any]:
+        event = {"type": self.TYPE, "code": self.code, "message": self.message}
+
+        if self.roomid is not None:
+            event["roomid"] = self.roomid
+
+        return event
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any], validate: bool = True) -> "Error":
+        return cls(
+            code=_field(event, "code", str, validate),
+            message=_field(event, "message", str, validate),
+            roomid=_field(event, "roomid", str, validate, required=False),
+        )
+
+
+Message = Join | Leave | Chat | History | ServerMessage | Error
+
+MESSAGE_TYPES: Dict[str, Type[Message]] = {
+    cls.TYPE: cls for cls in (Join, Leave, Chat, History, ServerMessage, Error)
+}
+
+
+def encode(message: Message, codec: Codec = JSON) -> str | bytes:
+    return codec.dumps(message.to_event())
+
+
+def decode(frame: str | bytes, validate: bool = True, codec: Codec = JSON) -> Message:
+    """Decode a frame, encoded with `codec`, into a message.
+
+    With `validate` off, as for a trusted peer, fields aren't type checked.
+
+    Raises:
+        ProtocolError: If the frame isn't a valid message.
+    """
+    try:
+        event = codec.loads(frame)
+    except (ValueError, TypeError):
+        # Binary codecs refuse text frames with a TypeError
+        event = None
+
+    if not isinstance(event, dict):
+        raise ProtocolError(
+            ErrorCode.INVALID_FRAME, f"Frames must be {codec.name} encoded maps"
+        )
+
+    cls = MESSAGE_TYPES.get(event.get("type"))
+
+    if cls is None:
+        raise ProtocolError(
+            ErrorCode.UNKNOWN_TYPE, f"Unknown message type {event.get('type')!r}"
+        )
+
+    return cls.from_event(event, validate)
+
+
+def negotiate_version(version: int) -> int:
+    """The protocol version to use with a peer that speaks up to `version`.
+
+    Raises:
+        ProtocolError: If the peer only speaks versions older than we understand.
+    """
+    if version < MIN_PROTOCOL_VERSION:
+        raise ProtocolError(
+            ErrorCode.UNSUPPORTED_VERSION,
+            f"Protocol version {version} is not supported, the oldest supported version is "
+            f"{MIN_PROTOCOL_VERSION}",
+        )
+
+    return min(version, PROTOCOL_VERSION)
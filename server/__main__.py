@@ -1,53 +1,371 @@
 #!/usr/bin/env python
 
+import argparse
 import asyncio
+import contextlib
+import dataclasses
+import functools
+import logging
+import multiprocessing
 import websockets
 from websockets import WebSocketServerProtocol
-import json
-from .lib import ChatClient
+from protocol import (
+    ErrorCode,
+    Join,
+    ProtocolError,
+    decode,
+    encode,
+    negotiate_codec,
+    negotiate_version,
+)
+from .lib import (
+    Broker,
+    BrokerKind,
+    ChatClient,
+    ConnectionRegistry,
+    MemoryBroker,
+    OutboundLimits,
+    RateLimit,
+    RedisBroker,
+    RoomHub,
+    ServerConfig,
+    SlowConsumerPolicy,
+    configure_logging,
+    metrics,
+)
 
 HOST = ""
 PORT = 8005
 
+DEFAULT_CONNECTION_BURST = 10
+DEFAULT_ROOM_BURST = 100
 
-async def subscribe_to_channel(chat_client: ChatClient, roomid: str) -> None:
-    event = {
-        "type": "server_msg",
-        "message": f"Joined {roomid}",
-    }
-    chat_client.subscribe(roomid)
-    await chat_client.websocket.send(json.dumps(event))
+logger = logging.getLogger("server")
 
 
-async def handler(websocket: WebSocketServerProtocol):
+async def relay(chat_client: ChatClient) -> None:
     """
-    Handle a connection and dispatch it according to the requested chatroom.
+    Relay what the client sends to its rooms, and drain its outbox, until either side of the
+    connection ends. Messages published to its rooms reach the client through the hub's broadcast;
+    the outbox only has work to do if the client falls behind.
     """
-    message = await websocket.recv()
-    event = json.loads(message)
+    async with asyncio.TaskGroup() as tasks:
+        receiving = tasks.create_task(chat_client.publish_messages())
+        sending = tasks.create_task(chat_client.outbox.drain())
 
-    assert event["type"] == "join"
-    assert event["roomid"]
-    assert event["username"]
+        # Neither task outlives the other. Once the client stops sending, or can no longer be sent
+        # to, the other is cancelled, and the task group waits for it to finish.
+        receiving.add_done_callback(lambda _: sending.cancel())
+        sending.add_done_callback(lambda _: receiving.cancel())
 
-    chat_client = ChatClient(event["username"], websocket)
 
-    await subscribe_to_channel(chat_client, event["roomid"])
+async def handler(
+    websocket: WebSocketServerProtocol,
+    hub: RoomHub,
+    connections: ConnectionRegistry,
+    outbound_limits: OutboundLimits = OutboundLimits(),
+    rate_limit: RateLimit | None = None,
+    max_rooms: int | None = None,
+):
+    """
+    Handle a connection, joining it to the room it asks for in its handshake and to any others it
+    joins later on.
+    """
+    try:
+        join = decode(await websocket.recv())
+
+        if not isinstance(join, Join):
+            raise ProtocolError(
+                ErrorCode.UNEXPECTED_MESSAGE,
+                f"Expected a join message, not {join.TYPE}",
+            )
+
+        version = negotiate_version(join.version)
+        codec = negotiate_codec(join.codecs)
+    except ProtocolError as error:
+        # Without a valid join there's nothing more the connection can do, so it's closed once
+        # the client has been told why.
+        await websocket.send(encode(error.to_message()))
+        return
+
+    chat_client = ChatClient(
+        join.username,
+        websocket,
+        hub,
+        outbound_limits,
+        codec,
+        rate_limit,
+        version,
+        max_rooms,
+    )
+    roomid = join.roomid
+
+    # However the connection ends, even if joining fails part way, the registry removes the client
+    # from its rooms once we're done with it.
+    async with connections.serve(chat_client):
+        try:
+            # A client that's reconnecting passes the ID of the last message it saw, so it can be
+            # sent just the ones it missed.
+            await chat_client.join(roomid, join.last_id, handshake=True)
+            logger.debug(
+                "Client joined", extra={"user": chat_client.username, "roomid": roomid}
+            )
+
+            await relay(chat_client)
+        except* websockets.ConnectionClosed:
+            # A connection that drops without a closing handshake is a disconnect like any other
+            pass
+
+    logger.debug("Client left", extra={"user": chat_client.username})
+
+
+def create_broker(config: ServerConfig) -> Broker:
+    if config.broker is BrokerKind.MEMORY:
+        return MemoryBroker(
+            history_length=config.history_length,
+            room_rate_limit=config.room_rate_limit,
+        )
+
+    return RedisBroker(
+        history_length=config.history_length,
+        room_rate_limit=config.room_rate_limit,
+        cluster=config.broker is BrokerKind.REDIS_CLUSTER,
+    )
+
 
-    await asyncio.gather(chat_client.publish_messages(), chat_client.poll_messages())
+async def start_server(config: ServerConfig = ServerConfig(), reuse_port: bool = False):
+    # A single hub is shared by every connection this process serves, so each room costs one broker
+    # subscription no matter how many local clients have joined it.
+    hub = RoomHub(create_broker(config))
+    connections = ConnectionRegistry(hub)
+    ws_handler = functools.partial(
+        handler,
+        hub=hub,
+        connections=connections,
+        outbound_limits=config.outbound_limits,
+        rate_limit=config.connection_rate_limit,
+        max_rooms=config.max_rooms,
+    )
 
-    # When the client disconnects, either by terminating their end of the connection or by sending
-    # a "leave" message, we'll remove their connection from the room.
-    chat_client.unsubscribe()
+    async with contextlib.AsyncExitStack() as stack:
+        stack.push_async_callback(hub.aclose)
 
+        if config.metrics_port is not None:
+            metrics.track_hub(hub)
+            metrics.track_connections(connections)
+            await stack.enter_async_context(
+                await metrics.serve_metrics(HOST, config.metrics_port)
+            )
 
-async def start_server():
-    async with websockets.serve(handler, HOST, PORT):
+            lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag())
+            stack.callback(lag_monitor.cancel)
+
+        await stack.enter_async_context(
+            websockets.serve(ws_handler, HOST, PORT, reuse_port=reuse_port)
+        )
+        logger.info("Serving", extra={"port": PORT})
         await asyncio.Future()
 
 
-def main():
-    asyncio.run(start_server())
+def serve(config: ServerConfig, reuse_port: bool = False) -> None:
+    """Run a server in this process until it's interrupted."""
+    listener = configure_logging(config.log_level, config.message_log_sample_rate)
+
+    try:
+        asyncio.run(start_server(config, reuse_port=reuse_port))
+    finally:
+        listener.stop()
+
+
+def run_worker(config: ServerConfig, index: int) -> None:
+    if config.metrics_port is not None:
+        config = dataclasses.replace(config, metrics_port=config.metrics_port + index)
+
+    serve(config, reuse_port=True)
+
+
+def run_workers(workers: int, config: ServerConfig) -> None:
+    """
+    Serve from several processes at once. Every worker binds PORT with SO_REUSEPORT so the kernel
+    spreads incoming connections between them, and runs its own room hub. Messages still reach
+    clients connected to other workers because every hub publishes and subscribes through Redis.
+
+    Metrics can't share a port the same way, since each scrape has to reach a particular worker, so
+    worker i serves its metrics on metrics_port + i.
+    """
+    processes = [
+        multiprocessing.Process(
+            target=run_worker, args=(config, i), name=f"chat-worker-{i}"
+        )
+        for i in range(workers)
+    ]
+
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+
+    return number
+
+
+def non_negative_int(value: str) -> int:
+    number = int(value)
+
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a non-negative integer")
+
+    return number
+
+
+def positive_float(value: str) -> float:
+    number = float(value)
+
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+
+    return number
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the websocket chat server.")
+    parser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=1,
+        help="Number of server processes sharing the port, e.g. one per CPU core.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics over HTTP at /metrics on this port.",
+    )
+    parser.add_argument(
+        "--max-outbound-messages",
+        type=int,
+        default=OutboundLimits.max_messages,
+        help="Messages queued for a slow client before its slow consumer policy applies.",
+    )
+    parser.add_argument(
+        "--max-outbound-bytes",
+        type=int,
+        default=OutboundLimits.max_bytes,
+        help="Bytes queued for a slow client before its slow consumer policy applies.",
+    )
+    parser.add_argument(
+        "--slow-consumer-policy",
+        type=SlowConsumerPolicy,
+        choices=list(SlowConsumerPolicy),
+        default=OutboundLimits.policy,
+        help="What to do once a slow client's queue is full.",
+    )
+    parser.add_argument(
+        "--broker",
+        type=BrokerKind,
+        choices=list(BrokerKind),
+        default=ServerConfig.broker,
+        help="Share rooms through Redis, the default, or a Redis Cluster, or keep them in memory. "
+        "The memory broker needs no Redis, but only serves a single process.",
+    )
+    parser.add_argument(
+        "--history",
+        type=non_negative_int,
+        default=ServerConfig.history_length,
+        help="Keep about this many recent messages per room and send them to clients as they "
+        "join. 0, the default, keeps no history.",
+    )
+    parser.add_argument(
+        "--connection-rate-limit",
+        type=positive_float,
+        default=None,
+        help="Messages a second each connection may send. Unlimited by default.",
+    )
+    parser.add_argument(
+        "--connection-burst",
+        type=positive_int,
+        default=DEFAULT_CONNECTION_BURST,
+        help="Messages a connection may send at once, before its rate limit applies.",
+    )
+    parser.add_argument(
+        "--room-rate-limit",
+        type=positive_float,
+        default=None,
+        help="Messages a second each room may receive, across every server sharing the same "
+        "Redis. Unlimited by default.",
+    )
+    parser.add_argument(
+        "--room-burst",
+        type=positive_int,
+        default=DEFAULT_ROOM_BURST,
+        help="Messages a room may receive at once, before its rate limit applies.",
+    )
+    parser.add_argument(
+        "--max-rooms",
+        type=positive_int,
+        default=ServerConfig.max_rooms,
+        help="Rooms each connection may be in at once. Unlimited by default.",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default=ServerConfig.log_level,
+    )
+    parser.add_argument(
+        "--message-log-sample-rate",
+        type=float,
+        default=ServerConfig.message_log_sample_rate,
+        help="Fraction of chat messages to log, from 0 (none, the default) to 1 (all).",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and args.broker is BrokerKind.MEMORY:
+        parser.error("--workers needs the redis broker to share rooms between workers")
+
+    return args
+
+
+def rate_limit(rate: float | None, burst: int) -> RateLimit | None:
+    return RateLimit(rate=rate, burst=burst) if rate is not None else None
+
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    config = ServerConfig(
+        outbound_limits=OutboundLimits(
+            max_messages=args.max_outbound_messages,
+            max_bytes=args.max_outbound_bytes,
+            policy=args.slow_consumer_policy,
+        ),
+        metrics_port=args.metrics_port,
+        log_level=args.log_level,
+        message_log_sample_rate=args.message_log_sample_rate,
+        history_length=args.history,
+        broker=args.broker,
+        connection_rate_limit=rate_limit(
+            args.connection_rate_limit, args.connection_burst
+        ),
+        room_rate_limit=rate_limit(args.room_rate_limit, args.room_burst),
+        max_rooms=args.max_rooms,
+    )
+
+    if args.workers > 1:
+        run_workers(args.workers, config)
+    else:
+        serve(config)
 
 
 if __name__ == "__main__":
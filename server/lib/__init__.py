@@ -1 +1,11 @@
+from . import metrics
+from .broker import Broker, BrokerKind
 from .chat_client import ChatClient
+from .config import ServerConfig
+from .connections import ConnectionRegistry
+from .log import configure_logging
+from .memory_broker import MemoryBroker
+from .outbound_queue import OutboundLimits, OutboundQueue, SlowConsumerPolicy
+from .rate_limit import RateLimit
+from .redis_broker import RedisBroker
+from .room_hub import RoomHub
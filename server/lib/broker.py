@@ -0,0 +1,69 @@
+import abc
+from enum import StrEnum
+from typing import Callable
+
+# Called with a room's ID and a frame published to it, in its sender's codec
+Deliver = Callable[[str, str | bytes], None]
+
+
+class BrokerKind(StrEnum):
+    """Which :class:`Broker` a server uses.
+
+    REDIS shares rooms between every server process using the same Redis, so it's needed for
+    `--workers` and for running more than one host. REDIS_CLUSTER does the same through a Redis
+    Cluster, with a sharded pub/sub channel per room. MEMORY keeps everything in the server process,
+    which saves a network hop per message on a single-process install.
+    """
+
+    REDIS = "redis"
+    REDIS_CLUSTER = "redis-cluster"
+    MEMORY = "memory"
+
+
+class Broker(abc.ABC):
+    """Carries messages published to rooms to the room hubs subscribed to them, and keeps what a
+    room's members share wherever they're connected: its history and its rate limit.
+
+    A hub subscribes to each room once, however many of its clients are in it, and the broker passes
+    every message published to the room to the hub's `deliver` callback until the hub unsubscribes.
+    With a non-zero `history_length` each message is tagged with its history ID before it's
+    delivered, and about that many of each room's most recent messages are kept.
+    """
+
+    history_length: int
+
+    @property
+    @abc.abstractmethod
+    def subscriptions(self) -> int:
+        """How many rooms are subscribed to."""
+
+    @property
+    def pending(self) -> int:
+        """How many messages are waiting to be published."""
+        return 0
+
+    @abc.abstractmethod
+    async def subscribe(self, roomid: str, deliver: Deliver) -> None: ...
+
+    @abc.abstractmethod
+    async def unsubscribe(self, roomid: str) -> None: ...
+
+    @abc.abstractmethod
+    async def publish(self, roomid: str, frame: str | bytes) -> None: ...
+
+    @abc.abstractmethod
+    async def history(self, roomid: str, after: str | None = None) -> list[str | bytes]:
+        """The frames of the room's most recent messages, oldest first and tagged with their IDs.
+
+        Given the ID of the last message a client saw, only the messages published since then are
+        returned, as far back as the history goes. Empty unless the broker keeps history.
+        """
+
+    @abc.abstractmethod
+    async def admit(self, roomid: str) -> bool:
+        """Whether another message can be published to the room without exceeding its rate limit.
+        Every message that's admitted counts towards the limit, so only ask when about to publish.
+        """
+
+    async def aclose(self) -> None:
+        pass
@@ -1,46 +1,225 @@
-import asyncio
-import json
+import logging
+from typing import Set
 from websockets import WebSocketServerProtocol
-import redis
+from protocol import (
+    JSON,
+    MULTI_ROOM_VERSION,
+    PROTOCOL_VERSION,
+    Chat,
+    Codec,
+    ErrorCode,
+    Join,
+    Leave,
+    ProtocolError,
+    ServerMessage,
+    decode,
+    encode,
+    transcode_history,
+)
+from . import metrics
+from .log import MESSAGE_LOGGER
+from .outbound_queue import OutboundLimits, OutboundQueue
+from .rate_limit import RateLimit, TokenBucket
+from .room_hub import RoomHub
+
+message_logger = logging.getLogger(MESSAGE_LOGGER)
 
 
 class ChatClient:
-    """This class encapsulates a chat client from the point of view of our websocket server."""
+    """This class encapsulates a chat client from the point of view of our websocket server.
+
+    A connection joins its first room with its handshake. From protocol version 2 on, it can join
+    and leave more rooms as it goes, so a user watching several rooms needs only one connection, one
+    outbox and one rate limit. Joins and leaves take from the rate limit like chat messages do, and
+    the rooms a connection can be in at once can be capped with `max_rooms`. The hub counts the
+    client once in each room it's in.
+    """
 
-    def __init__(self, username: str, websocket: WebSocketServerProtocol) -> None:
+    def __init__(
+        self,
+        username: str,
+        websocket: WebSocketServerProtocol,
+        hub: RoomHub,
+        outbound_limits: OutboundLimits = OutboundLimits(),
+        codec: Codec = JSON,
+        rate_limit: RateLimit | None = None,
+        version: int = PROTOCOL_VERSION,
+        max_rooms: int | None = None,
+    ) -> None:
         self.username = username
         self.websocket = websocket
+        self.outbox = OutboundQueue(websocket, outbound_limits)
+
+        # The protocol version and codec agreed when the client joined, used for its frames and the
+        # messages it publishes
+        self.version = version
+        self.codec = codec
+
+        # The rooms the client is in, and how many it may be in at once
+        self.rooms: Set[str] = set()
+        self.max_rooms = max_rooms
+
+        # How often this connection may publish, whatever its rooms' own limits
+        self._bucket = TokenBucket(rate_limit) if rate_limit is not None else None
+
+        self._hub = hub
+
+    async def join(
+        self, roomid: str, last_id: str | None = None, handshake: bool = False
+    ) -> None:
+        """Join a room, reply to the client, then send it the room's history.
+
+        The connection's first join is its handshake. The reply to it tells the client which
+        protocol version the server chose for it, and which codec unless it's JSON, and like the
+        join itself is always JSON.
+        """
+        if (
+            self.max_rooms is not None
+            and roomid not in self.rooms
+            and len(self.rooms) >= self.max_rooms
+        ):
+            raise ProtocolError(
+                ErrorCode.TOO_MANY_ROOMS,
+                f"You can't be in more than {self.max_rooms} rooms at once",
+                roomid,
+            )
+
+        reply = ServerMessage(
+            message=f"Joined {roomid}",
+            version=self.version if handshake else None,
+            codec=self.codec.name if handshake and self.codec is not JSON else None,
+            roomid=roomid,
+        )
+
+        # Live messages are held back in the client's outbox until it has been sent the messages that
+        # came before them.
+        self.outbox.pause()
+
+        await self.subscribe(roomid)
+        await self.websocket.send(encode(reply, JSON if handshake else self.codec))
+        await self.send_history(roomid, last_id)
+
+        self.outbox.resume()
+
+    async def leave(self, roomid: str) -> None:
+        if roomid not in self.rooms:
+            raise ProtocolError(
+                ErrorCode.NOT_IN_ROOM, f"You aren't in {roomid}", roomid
+            )
 
-        self.roomid = None
+        await self.unsubscribe(roomid)
 
-        self._redis = redis.Redis(host="localhost", port=6379, decode_responses=True)
-        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        reply = ServerMessage(message=f"Left {roomid}", roomid=roomid)
+        await self.websocket.send(encode(reply, self.codec))
 
-    def subscribe(self, roomid: str) -> None:
-        self._pubsub.subscribe(roomid)
-        self.roomid = roomid
+    async def subscribe(self, roomid: str) -> None:
+        # The hub counts the client as a member before its Redis subscription completes, so the room
+        # is recorded first: if subscribing fails, unsubscribing still knows which room to leave.
+        self.rooms.add(roomid)
+        await self._hub.subscribe(roomid, self)
 
-    def unsubscribe(self) -> None:
-        self._pubsub.unsubscribe()
-        self.roomid = None
+    async def send_history(self, roomid: str, last_id: str | None = None) -> None:
+        """Send the room's recent messages to the client, if the server keeps history. A client
+        resuming a session passes the ID of the last message it saw and is sent only what it missed.
+        """
+        frames = await self._hub.history(roomid, after=last_id)
+
+        if frames:
+            await self.websocket.send(transcode_history(frames, self.codec, roomid))
+
+    async def unsubscribe(self, roomid: str | None = None) -> None:
+        """Leave the room, or every room the client is in."""
+        left = [roomid] if roomid is not None else list(self.rooms)
+        self.rooms.difference_update(left)
+
+        await self._hub.leave(left, self)
 
     async def publish_messages(self):
-        async for message in self.websocket:
-            event = json.loads(message)
-            assert event["type"] == "chat"
+        async for frame in self.websocket:
+            metrics.MESSAGES_RECEIVED.inc()
+
+            try:
+                message = decode(frame, codec=self.codec)
+
+                if self.version >= MULTI_ROOM_VERSION and isinstance(message, Join):
+                    self._take_token(message.roomid)
+                    await self.join(message.roomid, message.last_id)
+                    continue
+
+                if self.version >= MULTI_ROOM_VERSION and isinstance(message, Leave):
+                    self._take_token(message.roomid)
+                    await self.leave(message.roomid)
+                    continue
+
+                if not isinstance(message, Chat):
+                    raise ProtocolError(
+                        ErrorCode.UNEXPECTED_MESSAGE,
+                        f"Expected a chat message, not {message.TYPE}",
+                    )
+
+                roomid = self._room_for(message)
+                await self._check_rate_limits(roomid)
+            except ProtocolError as error:
+                # A bad message is refused, but doesn't cost the client its connection
+                await self.websocket.send(encode(error.to_message(), self.codec))
+                continue
+
+            # Checking the level first avoids building the record's fields when message logging is
+            # off, which it is unless sampling has been enabled.
+            if message_logger.isEnabledFor(logging.INFO):
+                message_logger.info(
+                    "Received chat event",
+                    extra={
+                        "roomid": roomid,
+                        "user": message.user,
+                        "text": message.message,
+                    },
+                )
+
+            # This is the only place a chat event is serialised. The hub broadcasts the published
+            # frame untouched to clients using the same codec, and transcodes it once for each other
+            # codec, so the encoding work per message doesn't grow with the size of the room. It's
+            # encoded afresh, rather than relayed as received, so that only the fields the protocol
+            # defines are passed on, and tagged with its room for clients that are in several.
+            chat = Chat(message=message.message, user=message.user, roomid=roomid)
+            await self._hub.publish(roomid, encode(chat, self.codec))
+
+    def _room_for(self, chat: Chat) -> str:
+        roomid = chat.roomid
+
+        # A chat can only leave out its room while the client is in just the one
+        if roomid is None and len(self.rooms) == 1:
+            [roomid] = self.rooms
 
-            print(f"Received chat event: {json.dumps({"user": event["user"], "message": event["message"]})}")
+        if roomid is None:
+            raise ProtocolError(
+                ErrorCode.INVALID_FIELD,
+                "chat roomid is needed unless in exactly one room",
+            )
 
-            self._redis.publish(self.roomid, json.dumps(event))
+        if roomid not in self.rooms:
+            raise ProtocolError(
+                ErrorCode.NOT_IN_ROOM, f"You aren't in {roomid}", roomid
+            )
 
-    async def poll_messages(self):
-        while True:
-            message = self._pubsub.get_message()
+        return roomid
 
-            if message is not None:
-                assert message["type"] == "message"
-                event = json.loads(message["data"])
+    def _take_token(self, roomid: str) -> None:
+        if self._bucket is not None and not self._bucket.take():
+            metrics.MESSAGES_THROTTLED.inc()
+            raise ProtocolError(
+                ErrorCode.RATE_LIMITED, "You're sending messages too quickly", roomid
+            )
 
-                await self.websocket.send(json.dumps(event))
+    async def _check_rate_limits(self, roomid: str) -> None:
+        # The connection's own limit is checked first, so a client flooding the server is turned away
+        # without costing a round-trip to Redis for the room's.
+        self._take_token(roomid)
 
-            await asyncio.sleep(0)
+        if not await self._hub.admit(roomid):
+            metrics.MESSAGES_THROTTLED.inc()
+            raise ProtocolError(
+                ErrorCode.RATE_LIMITED,
+                "This room is receiving too many messages",
+                roomid,
+            )
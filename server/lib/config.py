@@ -0,0 +1,21 @@
+from dataclasses import dataclass, field
+from .broker import BrokerKind
+from .outbound_queue import OutboundLimits
+from .rate_limit import RateLimit
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    """Everything a server process needs to know to start serving, as set on the command line."""
+
+    outbound_limits: OutboundLimits = field(default_factory=OutboundLimits)
+    metrics_port: int | None = None
+    log_level: str = "INFO"
+    message_log_sample_rate: float = 0.0
+    history_length: int = 0
+    broker: BrokerKind = BrokerKind.REDIS
+    # Neither is limited unless a rate is given
+    connection_rate_limit: RateLimit | None = None
+    room_rate_limit: RateLimit | None = None
+    # Rooms a connection may be in at once, unlimited unless given
+    max_rooms: int | None = None
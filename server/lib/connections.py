@@ -0,0 +1,52 @@
+import contextlib
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, Set
+from . import metrics
+from .room_hub import RoomHub
+
+if TYPE_CHECKING:
+    from .chat_client import ChatClient
+
+
+class ConnectionRegistry:
+    """Every connection this process is serving, from its join until it has been torn down.
+
+    A connection is served inside :meth:`serve`, which guarantees that however the connection ends,
+    whether the client leaves, its socket fails or its handler is cancelled, the client leaves its
+    rooms. The hub then drops its Redis subscription to each once it has no local members left, so a
+    server that has seen any number of connections holds only what its current ones need.
+
+    :attr:`leaked` counts clients the hub still holds that are no longer being served, which should
+    always be 0.
+    """
+
+    def __init__(self, hub: RoomHub) -> None:
+        self._hub = hub
+        self._clients: Set["ChatClient"] = set()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def __iter__(self) -> Iterator["ChatClient"]:
+        return iter(self._clients)
+
+    def __contains__(self, client: object) -> bool:
+        return client in self._clients
+
+    @property
+    def leaked(self) -> int:
+        # A client in several rooms is a member of each, but only counted once
+        members = set().union(*self._hub.rooms.values())
+        return len(members - self._clients)
+
+    @contextlib.asynccontextmanager
+    async def serve(self, client: "ChatClient") -> AsyncIterator["ChatClient"]:
+        self._clients.add(client)
+        metrics.CONNECTIONS_OPENED.inc()
+
+        try:
+            yield client
+        finally:
+            self._clients.discard(client)
+            metrics.CONNECTIONS_CLOSED.inc()
+
+            await client.unsubscribe()
@@ -0,0 +1,113 @@
+import copy
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+# Per-message events are logged here rather than under their module's logger, so that they can be
+# enabled and sampled independently of everything else the server logs.
+MESSAGE_LOGGER = "server.messages"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON, including any fields passed with `extra`."""
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+        "message",
+        "asctime",
+        "taskName",
+    }
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (key, value)
+            for key, value in vars(record).items()
+            if key not in self.RESERVED
+        )
+
+        # A record that has been through a StructuredQueueHandler carries its traceback as text
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """Puts records on a queue with their message and traceback kept apart.
+
+    QueueHandler formats a record before queueing it, appending any traceback to its message, so a
+    JsonFormatter would never see it. This one only resolves the message's arguments and renders
+    the traceback into `exc_text`, leaving the traceback's frames behind as QueueHandler does.
+    """
+
+    _traceback_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._traceback_formatter.formatException(
+                    record.exc_info
+                )
+
+            record.exc_info = None
+
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through a random `rate` fraction of records."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return random.random() < self.rate
+
+
+def configure_logging(
+    level: str = "INFO", message_sample_rate: float = 0.0
+) -> QueueListener:
+    """Send the server's logs to stderr from a background thread.
+
+    Loggers only put records on a queue, so logging never blocks the event loop on a slow stderr.
+    Per-message events are off unless `message_sample_rate` is above zero, in which case that
+    fraction of them is logged. The returned listener has been started and must be stopped on exit
+    to flush what's left on the queue.
+    """
+    records: queue.SimpleQueue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(records, stream_handler)
+
+    server_logger = logging.getLogger("server")
+    server_logger.setLevel(level)
+    server_logger.addHandler(StructuredQueueHandler(records))
+    server_logger.propagate = False
+
+    message_logger = logging.getLogger(MESSAGE_LOGGER)
+
+    if message_sample_rate > 0:
+        message_logger.setLevel(logging.INFO)
+        if message_sample_rate < 1:
+            message_logger.addFilter(SamplingFilter(message_sample_rate))
+    else:
+        message_logger.setLevel(logging.WARNING)
+
+    listener.start()
+    return listener
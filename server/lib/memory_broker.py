@@ -0,0 +1,99 @@
+import time
+from collections import deque
+from typing import Dict, Tuple
+from .broker import Broker, Deliver
+from .publisher import tag_frame
+from .rate_limit import RateLimit, TokenBucket
+
+
+def _parse_id(message_id: str) -> Tuple[int, int]:
+    milliseconds, _, sequence = message_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+class MemoryBroker(Broker):
+    """A broker for a server that runs as a single process, with every room kept in memory.
+
+    Messages are delivered to the hub as they're published, without leaving the process. History
+    IDs are in the same form as Redis stream IDs, the time in milliseconds and a sequence number, so
+    clients resume the same way whichever broker the server uses. History doesn't outlive the process.
+    """
+
+    def __init__(
+        self, history_length: int = 0, room_rate_limit: RateLimit | None = None
+    ) -> None:
+        self.history_length = history_length
+        self.room_rate_limit = room_rate_limit
+
+        self._rooms: Dict[str, Deliver] = {}
+        self._history: Dict[str, deque[Tuple[Tuple[int, int], str | bytes]]] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._last_id = (0, 0)
+
+    @property
+    def subscriptions(self) -> int:
+        return len(self._rooms)
+
+    async def subscribe(self, roomid: str, deliver: Deliver) -> None:
+        self._rooms[roomid] = deliver
+
+    async def unsubscribe(self, roomid: str) -> None:
+        self._rooms.pop(roomid, None)
+
+        # Only the room's members can publish to it, so nothing is left to be limited
+        self._buckets.pop(roomid, None)
+
+    async def publish(self, roomid: str, frame: str | bytes) -> None:
+        if self.history_length:
+            message_id = self._next_id()
+            frame = tag_frame(frame, "%d-%d" % message_id)
+
+            history = self._history.get(roomid)
+
+            if history is None:
+                history = self._history[roomid] = deque(maxlen=self.history_length)
+
+            history.append((message_id, frame))
+
+        deliver = self._rooms.get(roomid)
+
+        if deliver is not None:
+            deliver(roomid, frame)
+
+    async def history(self, roomid: str, after: str | None = None) -> list[str | bytes]:
+        history = self._history.get(roomid, ())
+
+        try:
+            last_seen = _parse_id(after) if after is not None else None
+        except ValueError:
+            # An ID that can't be from this broker says nothing about what the client has missed
+            last_seen = None
+
+        return [
+            frame
+            for message_id, frame in history
+            if last_seen is None or message_id > last_seen
+        ]
+
+    async def admit(self, roomid: str) -> bool:
+        if self.room_rate_limit is None:
+            return True
+
+        bucket = self._buckets.get(roomid)
+
+        if bucket is None:
+            bucket = self._buckets[roomid] = TokenBucket(self.room_rate_limit)
+
+        return bucket.take()
+
+    def _next_id(self) -> Tuple[int, int]:
+        # IDs only ever increase, even if the clock goes back or several messages share a millisecond
+        milliseconds = time.time_ns() // 1_000_000
+        last_milliseconds, last_sequence = self._last_id
+
+        if milliseconds > last_milliseconds:
+            self._last_id = (milliseconds, 0)
+        else:
+            self._last_id = (last_milliseconds, last_sequence + 1)
+
+        return self._last_id
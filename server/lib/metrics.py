@@ -0,0 +1,305 @@
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from .connections import ConnectionRegistry
+    from .room_hub import RoomHub
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Labels, float]
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> Iterator[Sample]:
+        yield self.name, (), self.value
+
+
+class Gauge:
+    """A value that can go up and down.
+
+    Instead of being set directly, a gauge can be given a function that's called at scrape time. The
+    function returns either a single value or, for gauges with `label_names`, a mapping of label
+    values to values.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.value = 0.0
+        self._function: Callable[[], float | Dict[Tuple[str, ...], float]] | None = None
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(
+        self, function: Callable[[], float | Dict[Tuple[str, ...], float]] | None
+    ) -> None:
+        self._function = function
+
+    def samples(self) -> Iterator[Sample]:
+        if self._function is None:
+            yield self.name, (), self.value
+            return
+
+        value = self._function()
+
+        if not self.label_names:
+            yield self.name, (), value
+            return
+
+        for label_values, labelled_value in value.items():
+            yield self.name, tuple(zip(self.label_names, label_values)), labelled_value
+
+
+class Histogram:
+    type = "histogram"
+
+    DEFAULT_BUCKETS = (
+        0.0001,
+        0.0005,
+        0.001,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+    )
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self) -> Iterator[Sample]:
+        cumulative = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", (("le", repr(bound)),), cumulative
+
+        cumulative += self.counts[-1]
+        yield f"{self.name}_bucket", (("le", "+Inf"),), cumulative
+        yield f"{self.name}_sum", (), self.sum
+        yield f"{self.name}_count", (), cumulative
+
+
+Metric = Counter | Gauge | Histogram
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(
+                        f'{key}="{_escape(value)}"' for key, value in labels
+                    )
+                    lines.append(f"{name}{{{label_text}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = Registry()
+
+CONNECTIONS = REGISTRY.register(
+    Gauge("chat_connections", "Open websocket connections.")
+)
+ROOM_CONNECTIONS = REGISTRY.register(
+    Gauge("chat_room_connections", "Open connections per room.", ("room",))
+)
+CONNECTIONS_OPENED = REGISTRY.register(
+    Counter("chat_connections_opened_total", "Connections that have joined a room.")
+)
+CONNECTIONS_CLOSED = REGISTRY.register(
+    Counter("chat_connections_closed_total", "Connections that have been torn down.")
+)
+CONNECTIONS_LEAKED = REGISTRY.register(
+    Gauge(
+        "chat_connections_leaked",
+        "Clients still in a room whose connection is no longer being served. Should be 0.",
+    )
+)
+REDIS_SUBSCRIPTIONS = REGISTRY.register(
+    Gauge("chat_redis_subscriptions", "Rooms subscribed to through the broker.")
+)
+MESSAGES_RECEIVED = REGISTRY.register(
+    Counter("chat_messages_received_total", "Chat messages received from clients.")
+)
+MESSAGES_SENT = REGISTRY.register(
+    Counter("chat_messages_sent_total", "Frames written to client websockets.")
+)
+MESSAGES_DROPPED = REGISTRY.register(
+    Counter(
+        "chat_messages_dropped_total",
+        "Frames discarded by a slow client's outbound queue.",
+    )
+)
+MESSAGES_THROTTLED = REGISTRY.register(
+    Counter(
+        "chat_messages_throttled_total",
+        "Chat messages refused for exceeding a connection's or a room's rate limit.",
+    )
+)
+PUBLISH_LATENCY = REGISTRY.register(
+    Histogram(
+        "chat_publish_latency_seconds",
+        "Time taken by Redis to accept a batch of published messages.",
+    )
+)
+FAN_OUT_LATENCY = REGISTRY.register(
+    Histogram(
+        "chat_fan_out_latency_seconds",
+        "Time taken to hand a room message to every local member's websocket.",
+    )
+)
+SEND_LATENCY = REGISTRY.register(
+    Histogram(
+        "chat_send_latency_seconds",
+        "Time taken to send a queued frame to a slow client's websocket.",
+    )
+)
+PUBLISH_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("chat_publish_queue_depth", "Messages waiting to be published to Redis.")
+)
+OUTBOUND_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "chat_outbound_queue_depth",
+        "Frames queued for slow clients, across all connections.",
+    )
+)
+EVENT_LOOP_LAG = REGISTRY.register(
+    Histogram(
+        "chat_event_loop_lag_seconds",
+        "How late the event loop runs a callback scheduled for a given time.",
+    )
+)
+
+
+def track_hub(hub: "RoomHub") -> None:
+    """Report the state of `hub` through the gauges that are computed at scrape time."""
+    ROOM_CONNECTIONS.set_function(
+        lambda: {(roomid,): len(members) for roomid, members in hub.rooms.items()}
+    )
+    PUBLISH_QUEUE_DEPTH.set_function(lambda: hub.broker.pending)
+    REDIS_SUBSCRIPTIONS.set_function(lambda: hub.subscriptions)
+
+
+def track_connections(connections: "ConnectionRegistry") -> None:
+    """Report the connections being served, whichever rooms they're in, if any."""
+    CONNECTIONS.set_function(lambda: len(connections))
+    OUTBOUND_QUEUE_DEPTH.set_function(
+        lambda: sum(len(client.outbox) for client in connections)
+    )
+    CONNECTIONS_LEAKED.set_function(lambda: connections.leaked)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    loop = asyncio.get_running_loop()
+
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - scheduled, 0))
+
+
+async def serve_metrics(host: str, port: int) -> asyncio.Server:
+    """Serve the metrics registry over HTTP at /metrics, for Prometheus to scrape."""
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = await reader.readline()
+            method, path, *_ = request_line.decode("latin-1").split()
+
+            # The request's headers are of no interest, but have to be read before replying.
+            while (await reader.readline()).strip():
+                pass
+
+            if method == "GET" and path.split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = REGISTRY.render().encode()
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,143 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from enum import StrEnum
+from websockets import WebSocketServerProtocol
+from . import metrics
+
+
+class SlowConsumerPolicy(StrEnum):
+    """What an :class:`OutboundQueue` does once it's full.
+
+    DROP_OLDEST discards the oldest queued frames to make room, keeping a sliding window of the most
+    recent messages. COALESCE discards the whole backlog and keeps only the newest frame, letting the
+    client catch up with the live conversation. DISCONNECT closes the connection.
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+@dataclass(frozen=True)
+class OutboundLimits:
+    max_messages: int = 1_000
+    max_bytes: int = 1 << 20
+    policy: SlowConsumerPolicy = SlowConsumerPolicy.DROP_OLDEST
+
+    # Once this many bytes are waiting in the socket's write buffer, the client is considered slow and
+    # further frames are held in its queue rather than written straight to the socket.
+    high_water: int = 1 << 16
+
+
+class OutboundQueue:
+    """Frames waiting to be sent to a single client that isn't keeping up with its room.
+
+    The queue is bounded by both message count and size, so a slow client costs at most `max_bytes`
+    of server memory however busy its room is. Frames that had to be discarded are counted in
+    `dropped`.
+    """
+
+    DISCONNECT_CODE = 1008
+
+    def __init__(
+        self,
+        websocket: WebSocketServerProtocol,
+        limits: OutboundLimits = OutboundLimits(),
+    ) -> None:
+        self.websocket = websocket
+        self.limits = limits
+        self.dropped = 0
+
+        self._frames: deque[tuple[str | bytes, int]] = deque()
+        self._bytes = 0
+        self._ready = asyncio.Event()
+        self._closing: asyncio.Task | None = None
+        self._paused = False
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    @property
+    def backlogged(self) -> bool:
+        """Whether new frames have to be queued to stay behind ones the client hasn't received."""
+        if self._frames or self._paused or self._closing is not None:
+            return True
+
+        return self.websocket.transport.get_write_buffer_size() > self.limits.high_water
+
+    def put(self, frame: str | bytes) -> None:
+        if self._closing is not None:
+            self._count_dropped(1)
+            return
+
+        size = len(frame) if isinstance(frame, bytes) else len(frame.encode())
+        self._frames.append((frame, size))
+        self._bytes += size
+
+        if not self._full():
+            self._ready.set()
+            return
+
+        match self.limits.policy:
+            case SlowConsumerPolicy.DROP_OLDEST:
+                while self._full() and len(self._frames) > 1:
+                    self._discard_oldest()
+            case SlowConsumerPolicy.COALESCE:
+                while len(self._frames) > 1:
+                    self._discard_oldest()
+            case SlowConsumerPolicy.DISCONNECT:
+                self._count_dropped(len(self._frames))
+                self._frames.clear()
+                self._bytes = 0
+                self._closing = asyncio.get_running_loop().create_task(
+                    self.websocket.close(self.DISCONNECT_CODE, "Slow consumer")
+                )
+                return
+
+        self._ready.set()
+
+    def pause(self) -> None:
+        """Queue every frame and hold off sending them until :meth:`resume` is called."""
+        self._paused = True
+
+    def resume(self) -> None:
+        self._paused = False
+        self._ready.set()
+
+    async def drain(self) -> None:
+        """Send queued frames to the client, in order, as fast as its connection allows."""
+        while True:
+            await self._ready.wait()
+
+            while self._frames and not self._paused:
+                frame, size = self._frames.popleft()
+                self._bytes -= size
+
+                # WebSocketServerProtocol.send writes the frame before waiting for the socket to
+                # drain, so frames broadcast after this point can't overtake it.
+                with metrics.SEND_LATENCY.time():
+                    await self.websocket.send(frame)
+
+                metrics.MESSAGES_SENT.inc()
+
+            self._ready.clear()
+
+    def _full(self) -> bool:
+        return (
+            len(self._frames) > self.limits.max_messages
+            or self._bytes > self.limits.max_bytes
+        )
+
+    def _discard_oldest(self) -> None:
+        _, size = self._frames.popleft()
+        self._bytes -= size
+        self._count_dropped(1)
+
+    def _count_dropped(self, count: int) -> None:
+        self.dropped += count
+        metrics.MESSAGES_DROPPED.inc(count)
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from typing import Tuple
+from redis import asyncio as redis
+from redis.exceptions import NoScriptError
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Appends a frame to its room's history stream and publishes it tagged with the entry's ID, so that
+# the ID every subscriber sees is the one the frame can be resumed from. Stream IDs only ever increase
+# within a room, whichever server process published the message.
+#
+# The frame is published with the command given, PUBLISH, or SPUBLISH to a shard channel in a cluster.
+#
+# The frame may be JSON, MessagePack or CBOR, told apart by their first byte as in protocol.codecs.
+# Chat frames are maps of a few entries, which both binary codecs count in their first byte, so the
+# ID is added as a new first entry by bumping that count, without decoding the rest of the frame.
+PUBLISH_WITH_HISTORY = """
+local id = redis.call("XADD", KEYS[1], "MAXLEN", "~", ARGV[3], "*", "frame", ARGV[2])
+local frame = ARGV[2]
+local head = string.byte(frame, 1)
+local tagged
+
+if head == 123 then
+    tagged = '{"id": "' .. id .. '", ' .. string.sub(frame, 2)
+elseif head < 160 then
+    tagged = string.char(head + 1, 162) .. "id" .. string.char(217, #id) .. id .. string.sub(frame, 2)
+else
+    tagged = string.char(head + 1, 98) .. "id" .. string.char(120, #id) .. id .. string.sub(frame, 2)
+end
+
+redis.call(ARGV[4], ARGV[1], tagged)
+return id
+"""
+
+
+def history_key(roomid: str) -> str:
+    # The room's ID is the key's hash tag, so that in a cluster everything kept for a room, and its
+    # shard channel, is in the same slot and can be used by the same script.
+    return f"history:{{{roomid}}}"
+
+
+def shard_channel(roomid: str) -> str:
+    """The shard channel a room's messages are published to in a Redis Cluster.
+
+    It's nothing but the room's hash tag, so it's in the same slot as the room's keys, whatever the
+    room's ID. The braces are stripped again to find the room a message was published to.
+    """
+    return f"{{{roomid}}}"
+
+
+def tag_frame(frame: str | bytes, message_id: str | bytes) -> str | bytes:
+    """Add a message ID to a serialised event, the same way :data:`PUBLISH_WITH_HISTORY` does."""
+    if isinstance(frame, str):
+        return f'{{"id": "{message_id}", {frame[1:]}'
+
+    if isinstance(message_id, str):
+        message_id = message_id.encode()
+
+    head = frame[0]
+
+    if head == ord("{"):
+        return b'{"id": "' + message_id + b'", ' + frame[1:]
+
+    if head < 0xA0:
+        # A MessagePack fixmap, given the key as a fixstr and the ID as a str 8
+        tag = bytes([head + 1, 0xA2]) + b"id" + bytes([0xD9, len(message_id)])
+    else:
+        # A CBOR map, given the key as a short text string and the ID with a one byte length
+        tag = bytes([head + 1, 0x62]) + b"id" + bytes([0x78, len(message_id)])
+
+    return tag + message_id + frame[1:]
+
+
+class Publisher:
+    """Publishes room messages to Redis from a single background task.
+
+    Chat handlers only enqueue their message, so a slow Redis round-trip never holds up the event loop
+    for other connections. The task drains whatever has queued up since its last round-trip and sends
+    it as one pipelined batch of PUBLISH commands, preserving the order messages were enqueued in.
+
+    The queue is bounded: once `max_queued` messages are waiting, `publish` waits for room rather than
+    letting memory grow without limit while Redis is unavailable.
+
+    With a non-zero `history_length`, each message is also appended to its room's history stream in
+    the same pipeline, and the stream is trimmed to roughly that many messages. The published frame
+    then carries the message's stream ID, which clients can resume from after reconnecting.
+
+    Given a Redis Cluster client and `cluster`, messages are published to each room's shard channel
+    with SPUBLISH, so that each one only travels to the node that owns the room's slot rather than
+    to every node in the cluster. The cluster pipeline sends each node its share of the batch.
+    """
+
+    DEFAULT_MAX_QUEUED = 10_000
+    DEFAULT_MAX_BATCH = 256
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        history_length: int = 0,
+        cluster: bool = False,
+    ) -> None:
+        self._redis = redis_client
+        self._history_length = history_length
+        self._cluster = cluster
+        # Cluster pipelines don't load the scripts they run, unlike others, so the script is loaded
+        # on every primary before the first batch, and again after any node turns out not to have it.
+        self._script_loaded = not cluster
+        self._publish_with_history = redis_client.register_script(PUBLISH_WITH_HISTORY)
+        self._queue: asyncio.Queue[Tuple[str, str | bytes]] = asyncio.Queue(
+            maxsize=max_queued
+        )
+        self._max_batch = max_batch
+        self._task: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def publish(self, roomid: str, data: str | bytes) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+        await self._queue.put((roomid, data))
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+
+            while len(batch) < self._max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._publish_batch(batch)
+            except redis.RedisError as error:
+                if isinstance(error, NoScriptError):
+                    # A node that's restarted, or joined the cluster, has an empty script cache
+                    self._script_loaded = False
+
+                logger.exception(
+                    "Failed to publish messages", extra={"messages": len(batch)}
+                )
+
+    async def _publish_batch(self, batch: list[Tuple[str, str | bytes]]) -> None:
+        if self._history_length and not self._script_loaded:
+            await self._redis.script_load(PUBLISH_WITH_HISTORY)
+            self._script_loaded = True
+
+        command = "SPUBLISH" if self._cluster else "PUBLISH"
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for roomid, data in batch:
+                channel = shard_channel(roomid) if self._cluster else roomid
+
+                if self._history_length:
+                    await self._publish_with_history(
+                        keys=[history_key(roomid)],
+                        args=[channel, data, self._history_length, command],
+                        client=pipe,
+                    )
+                elif self._cluster:
+                    # Cluster pipelines have no spublish method
+                    pipe.execute_command("SPUBLISH", channel, data)
+                else:
+                    pipe.publish(channel, data)
+
+            with metrics.PUBLISH_LATENCY.time():
+                await pipe.execute()
@@ -0,0 +1,107 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable
+from redis import asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """A token bucket's shape: up to `burst` messages at once, refilled at `rate` messages a second."""
+
+    rate: float
+    burst: int
+
+
+class TokenBucket:
+    """Limits how often a single connection can publish, without leaving the process.
+
+    The bucket starts full. Each message takes a token, and tokens are refilled continuously at the
+    limit's rate, up to its burst, so the time of the last refill is all that has to be kept.
+    """
+
+    def __init__(
+        self, limit: RateLimit, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.limit = limit
+        self._clock = clock
+        self._tokens = float(limit.burst)
+        self._refilled = clock()
+
+    def take(self) -> bool:
+        """Take a token if there's one left, returning whether there was."""
+        now = self._clock()
+        self._tokens = min(
+            self.limit.burst, self._tokens + (now - self._refilled) * self.limit.rate
+        )
+        self._refilled = now
+
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+        return True
+
+
+# Takes a token from a room's bucket, stored as a hash of its tokens and when they were last refilled.
+# Time comes from the Redis server, so workers on different hosts refill the bucket by the same clock.
+# It's kept in milliseconds: Lua prints numbers to 14 significant digits, too few for microseconds
+# since the epoch. A bucket left alone long enough to refill completely expires, as it'd be full anyway.
+TAKE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "refilled")
+local tokens = tonumber(bucket[1]) or burst
+local refilled = tonumber(bucket[2]) or now
+
+tokens = math.min(burst, tokens + math.max(0, now - refilled) * rate / 1000)
+
+local taken = 0
+
+if tokens >= 1 then
+    tokens = tokens - 1
+    taken = 1
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "refilled", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst * 1000 / rate) + 1)
+return taken
+"""
+
+
+def rate_limit_key(roomid: str) -> str:
+    # Hash tagged like the room's other keys: see history_key
+    return f"rate_limit:{{{roomid}}}"
+
+
+class RoomRateLimiter:
+    """Limits how often a room's messages can be published, across every server process.
+
+    Each room has one token bucket in Redis, shared by every worker serving it, so the limit holds
+    however the room's members are spread between them. If Redis can't be reached, messages are let
+    through: publishing them would fail anyway, and that's already reported.
+    """
+
+    def __init__(self, redis_client: redis.Redis, limit: RateLimit) -> None:
+        self.limit = limit
+        self._take_token = redis_client.register_script(TAKE_TOKEN)
+
+    async def take(self, roomid: str) -> bool:
+        """Take a token from the room's bucket if there's one left, returning whether there was."""
+        try:
+            return bool(
+                await self._take_token(
+                    keys=[rate_limit_key(roomid)],
+                    args=[self.limit.rate, self.limit.burst],
+                )
+            )
+        except redis.RedisError:
+            logger.exception(
+                "Failed to check room rate limit", extra={"roomid": roomid}
+            )
+            return True
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from typing import Dict
+from redis import asyncio as redis
+from .broker import Broker, Deliver
+from .publisher import Publisher, history_key, shard_channel, tag_frame
+from .rate_limit import RateLimit, RoomRateLimiter
+from .sharded_pubsub import ShardedPubSub
+
+logger = logging.getLogger(__name__)
+
+
+class RedisBroker(Broker):
+    """A broker that shares rooms between every server process using the same Redis.
+
+    The broker owns the process's only Redis connection pool and pubsub connection. Outgoing messages
+    go through a :class:`Publisher` so that publishing never waits on Redis. History is kept in a
+    stream per room, and room rate limits in a token bucket per room: see :class:`RoomRateLimiter`.
+
+    With `cluster`, `host` and `port` are those of any node in a Redis Cluster, of version 7 or
+    later. Each room is then a shard channel, published to with SPUBLISH and subscribed to on the
+    node that owns its slot, so pub/sub throughput grows with the number of nodes: see
+    :class:`ShardedPubSub`. A room's keys share its slot, so its history and rate limit are kept on
+    the same node.
+
+    If the pubsub connection is lost, it's reconnected to, with exponential backoff, and every room
+    is subscribed to again. Messages published in the meantime aren't delivered.
+    """
+
+    RECONNECT_DELAY = 0.5
+    MAX_RECONNECT_DELAY = 30.0
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        history_length: int = 0,
+        room_rate_limit: RateLimit | None = None,
+        cluster: bool = False,
+    ) -> None:
+        self.history_length = history_length
+        self.cluster = cluster
+
+        # Responses are left as bytes, since frames published by clients using a binary codec aren't
+        # text.
+        if cluster:
+            self._redis = redis.RedisCluster(host=host, port=port)
+            self._pubsub = ShardedPubSub(self._redis)
+        else:
+            self._redis = redis.Redis(host=host, port=port)
+            self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+
+        self._publisher = Publisher(
+            self._redis, history_length=history_length, cluster=cluster
+        )
+        self._room_limiter = (
+            RoomRateLimiter(self._redis, room_rate_limit)
+            if room_rate_limit is not None
+            else None
+        )
+
+        self._rooms: Dict[str, Deliver] = {}
+        self._reader: asyncio.Task | None = None
+
+        # PubSub commands must not run concurrently: while the pubsub has no connection yet, each
+        # concurrent command would open its own and only the last one would ever be read from.
+        self._pubsub_lock = asyncio.Lock()
+
+    @property
+    def subscriptions(self) -> int:
+        return len(self._pubsub.channels)
+
+    @property
+    def pending(self) -> int:
+        return self._publisher.pending
+
+    async def subscribe(self, roomid: str, deliver: Deliver) -> None:
+        self._rooms[roomid] = deliver
+
+        async with self._pubsub_lock:
+            await self._pubsub.subscribe(self._channel(roomid))
+
+        self._ensure_reader()
+
+    async def unsubscribe(self, roomid: str) -> None:
+        self._rooms.pop(roomid, None)
+
+        async with self._pubsub_lock:
+            await self._pubsub.unsubscribe(self._channel(roomid))
+
+    async def publish(self, roomid: str, frame: str | bytes) -> None:
+        await self._publisher.publish(roomid, frame)
+
+    async def history(self, roomid: str, after: str | None = None) -> list[bytes]:
+        if not self.history_length:
+            return []
+
+        # The most recent entries are read backwards, and put back in order. After a gap longer than
+        # the history, that's the end of the gap, so a client that resumes is sent the newest
+        # messages it missed rather than the oldest.
+        entries = await self._redis.xrevrange(
+            history_key(roomid),
+            min="-" if after is None else f"({after}",
+            count=self.history_length,
+        )
+        entries.reverse()
+
+        return [
+            tag_frame(fields[b"frame"], message_id) for message_id, fields in entries
+        ]
+
+    async def admit(self, roomid: str) -> bool:
+        if self._room_limiter is None:
+            return True
+
+        return await self._room_limiter.take(roomid)
+
+    async def aclose(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+
+        await self._publisher.aclose()
+
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    def _channel(self, roomid: str) -> str:
+        return shard_channel(roomid) if self.cluster else roomid
+
+    def _ensure_reader(self) -> None:
+        # PubSub.listen returns once every room has been unsubscribed from, so the reader is restarted
+        # whenever the broker goes from no rooms to one.
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    async def _read(self) -> None:
+        attempt = 0
+
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    attempt = 0
+
+                    try:
+                        self._deliver(message)
+                    except Exception:
+                        # Anything published to a room's channel reaches us, frame or not, and
+                        # one bad message mustn't stop every room's being delivered
+                        logger.exception(
+                            "Failed to deliver a message",
+                            extra={"channel": message.get("channel")},
+                        )
+
+                return
+            except redis.ConnectionError:
+                # The pubsub reconnects the next time it's listened to, and then subscribes to
+                # every room again
+                delay = min(self.RECONNECT_DELAY * 2**attempt, self.MAX_RECONNECT_DELAY)
+                logger.warning(
+                    "Lost the pubsub connection",
+                    extra={"retry_in": delay},
+                    exc_info=True,
+                )
+                attempt += 1
+
+                await asyncio.sleep(delay)
+
+    def _deliver(self, message: Dict) -> None:
+        roomid = message["channel"].decode()
+
+        if self.cluster:
+            roomid = roomid[1:-1]
+
+        deliver = self._rooms.get(roomid)
+
+        if deliver is not None:
+            deliver(roomid, message["data"])
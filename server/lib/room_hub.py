@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import logging
+from typing import TYPE_CHECKING, Dict, Iterable, List, Set
+import websockets
+from websockets import WebSocketServerProtocol
+from protocol import Codec, transcode
+from . import metrics
+from .broker import Broker
+from .redis_broker import RedisBroker
+
+if TYPE_CHECKING:
+    from .chat_client import ChatClient
+
+logger = logging.getLogger(__name__)
+
+
+class RoomHub:
+    """A process-wide fan-out point between a :class:`Broker` and the chat clients connected to this
+    server.
+
+    Each room is subscribed to once, however many local clients are in it, and every message the
+    broker delivers for that room is broadcast to the room's local clients in-process: the frame is
+    encoded once for each codec in use in the room and written to each client's socket without
+    waiting on any of them. Clients whose sockets have fallen behind get the frame through their
+    bounded :class:`OutboundQueue` instead.
+
+    The broker is Redis unless another is given, so that rooms are shared with every other server
+    process using the same Redis.
+
+    Every client joining a room waits for its subscription to be made, so none of them can miss a
+    message published in the meantime. A room whose subscription fails is forgotten, along with the
+    clients waiting to join it, and the next join tries again.
+    """
+
+    def __init__(self, broker: Broker | None = None) -> None:
+        self._broker = broker if broker is not None else RedisBroker()
+        self._rooms: Dict[str, Set["ChatClient"]] = {}
+        # The subscriptions being made, by room
+        self._subscribing: Dict[str, asyncio.Task] = {}
+
+    @property
+    def rooms(self) -> Dict[str, Set["ChatClient"]]:
+        return self._rooms
+
+    @property
+    def broker(self) -> Broker:
+        return self._broker
+
+    @property
+    def subscriptions(self) -> int:
+        """How many rooms the hub is subscribed to through its broker."""
+        return self._broker.subscriptions
+
+    def members(self, roomid: str) -> Set["ChatClient"]:
+        return self._rooms.get(roomid, set())
+
+    async def subscribe(self, roomid: str, client: "ChatClient") -> None:
+        members = self._rooms.get(roomid)
+
+        if members is None:
+            # Register the room before awaiting so that concurrent joins don't subscribe twice.
+            members = self._rooms[roomid] = set()
+            subscribing = asyncio.get_running_loop().create_task(
+                self._broker.subscribe(roomid, self._fan_out)
+            )
+            subscribing.add_done_callback(
+                functools.partial(self._subscribed, roomid, members)
+            )
+            self._subscribing[roomid] = subscribing
+
+        members.add(client)
+        subscribing = self._subscribing.get(roomid)
+
+        if subscribing is not None:
+            # Shielded, so that one joiner giving up doesn't cancel the subscription for the rest
+            await asyncio.shield(subscribing)
+
+    async def unsubscribe(self, roomid: str, client: "ChatClient") -> None:
+        await self.leave([roomid], client)
+
+    async def leave(self, roomids: Iterable[str], client: "ChatClient") -> None:
+        """Take the client out of the rooms, then unsubscribe from each one left with no members.
+
+        The client is out of every room before anything is awaited, so it can't be left behind in
+        any of them, and a room that can't be unsubscribed from, say while Redis is down, doesn't
+        stop the rest from being unsubscribed.
+        """
+        emptied = []
+
+        for roomid in roomids:
+            members = self._rooms.get(roomid)
+
+            if members is None:
+                continue
+
+            members.discard(client)
+
+            if not members:
+                del self._rooms[roomid]
+                emptied.append(roomid)
+
+        for roomid in emptied:
+            try:
+                await self._broker.unsubscribe(roomid)
+            except Exception:
+                logger.exception(
+                    "Failed to unsubscribe from a room", extra={"roomid": roomid}
+                )
+
+    async def admit(self, roomid: str) -> bool:
+        """Whether another message can be published to the room without exceeding its rate limit.
+        Every message that's admitted counts towards the limit, so only ask when about to publish.
+        """
+        return await self._broker.admit(roomid)
+
+    async def publish(self, roomid: str, data: str | bytes) -> None:
+        await self._broker.publish(roomid, data)
+
+    async def history(self, roomid: str, after: str | None = None) -> list[str | bytes]:
+        """The frames of the room's most recent messages, oldest first and tagged with their IDs,
+        each in the codec its sender used. See :meth:`Broker.history`."""
+        return await self._broker.history(roomid, after=after)
+
+    async def aclose(self) -> None:
+        for subscribing in self._subscribing.values():
+            subscribing.cancel()
+
+        await self._broker.aclose()
+
+    def _subscribed(
+        self, roomid: str, members: Set["ChatClient"], subscribing: asyncio.Task
+    ) -> None:
+        if self._subscribing.get(roomid) is subscribing:
+            del self._subscribing[roomid]
+
+        failed = subscribing.cancelled() or subscribing.exception() is not None
+
+        # Unless everyone has left it already, and it's been joined afresh since
+        if failed and self._rooms.get(roomid) is members:
+            del self._rooms[roomid]
+
+    def _fan_out(self, roomid: str, payload: str | bytes) -> None:
+        with metrics.FAN_OUT_LATENCY.time():
+            # The payload is in its sender's codec. It's transcoded at most once for each codec in
+            # use in the room, however many clients use it.
+            frames: Dict[Codec, str | bytes] = {}
+            writable: Dict[Codec, List[WebSocketServerProtocol]] = {}
+
+            def frame_for(codec: Codec) -> str | bytes:
+                frame = frames.get(codec)
+
+                if frame is None:
+                    frame = frames[codec] = transcode(payload, codec)
+
+                return frame
+
+            for client in self._rooms.get(roomid, ()):
+                # Clients that have fallen behind get the frame queued so it's sent in order, within
+                # the bounds of their slow-consumer policy. Everyone else is written to directly.
+                if client.outbox.backlogged:
+                    client.outbox.put(frame_for(client.codec))
+                else:
+                    writable.setdefault(client.codec, []).append(client.websocket)
+
+            for codec, sockets in writable.items():
+                websockets.broadcast(sockets, frame_for(codec))
+
+        metrics.MESSAGES_SENT.inc(sum(len(sockets) for sockets in writable.values()))
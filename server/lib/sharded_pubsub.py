@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, Set
+from redis import asyncio as redis
+from redis.asyncio.connection import Connection
+
+logger = logging.getLogger(__name__)
+
+
+class _Shard:
+    """A subscriber connection to one primary, and the task reading what it pushes."""
+
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+        self.reader: asyncio.Task | None = None
+        # Subscriptions refused in a row, because of slots moving
+        self.refusals = 0
+
+
+class ShardedPubSub:
+    """Sharded pub/sub on a Redis Cluster, for redis-py's asyncio client, which doesn't have it.
+
+    Each shard channel is subscribed to with SSUBSCRIBE on the primary that owns its slot, over one
+    connection per primary, so a message published with SPUBLISH is only passed between the node
+    that owns it and its subscribers. Classic pub/sub sends every message to every node in the
+    cluster, which caps its throughput however many nodes are added.
+
+    It stands in for redis-py's PubSub, as far as a :class:`RedisBroker` uses it. Messages from every
+    primary are read in the background and yielded by :meth:`listen`.
+
+    When a slot moves to another node, the old owner unsubscribes us from its channels, and they're
+    subscribed to again wherever the slot now lives. The same happens to every channel subscribed
+    through a primary whose connection fails, once the cluster can be reached. A subscription
+    refused while a slot moves is retried after a delay that doubles with each refusal in a row;
+    one refused for any other reason, such as an ACL or a node too old for SSUBSCRIBE, isn't.
+    """
+
+    RESUBSCRIBE_DELAY = 1.0
+    MAX_RESUBSCRIBE_DELAY = 30.0
+    # Errors a node gives while a slot it owned is being moved
+    SLOT_ERRORS = ("MOVED", "ASK", "TRYAGAIN")
+
+    def __init__(self, cluster: redis.RedisCluster) -> None:
+        # The shard each channel is subscribed through
+        self.channels: Dict[str, _Shard] = {}
+
+        self._cluster = cluster
+        # Live shards by node name
+        self._shards: Dict[str, _Shard] = {}
+        self._messages: asyncio.Queue[Dict[str, Any]] = asyncio.Queue()
+        self._lock = asyncio.Lock()
+        self._resubscribing: Set[asyncio.Task] = set()
+
+    async def subscribe(self, channel: str) -> None:
+        async with self._lock:
+            await self._subscribe(channel)
+
+    async def unsubscribe(self, channel: str) -> None:
+        async with self._lock:
+            shard = self.channels.pop(channel, None)
+
+            if shard is None or shard not in self._shards.values():
+                # A shard that's been lost has no subscriptions left to cancel
+                return
+
+            if shard in self.channels.values():
+                await shard.connection.send_command(
+                    "SUNSUBSCRIBE", channel, check_health=False
+                )
+            else:
+                # Nothing else is subscribed through the connection, so it's closed instead
+                await self._close(shard)
+
+    async def listen(self) -> AsyncIterator[Dict[str, Any]]:
+        while True:
+            yield await self._messages.get()
+
+    async def aclose(self) -> None:
+        for task in self._resubscribing:
+            task.cancel()
+
+        async with self._lock:
+            for shard in list(self._shards.values()):
+                await self._close(shard)
+
+            self.channels = {}
+
+    async def _subscribe(self, channel: str) -> None:
+        # Learns the cluster's slots the first time, and is a no-op after that
+        await self._cluster.initialize()
+        node = self._cluster.get_node_from_key(channel)
+        shard = self._shards.get(node.name)
+
+        if shard is None:
+            # Connects as the cluster's own clients do, with its credentials and TLS settings
+            connection = node.connection_class(**node.connection_kwargs)
+            await connection.connect()
+
+            shard = self._shards[node.name] = _Shard(connection)
+            shard.reader = asyncio.get_running_loop().create_task(self._read(shard))
+
+        self.channels[channel] = shard
+        await shard.connection.send_command("SSUBSCRIBE", channel, check_health=False)
+
+    async def _close(self, shard: _Shard) -> None:
+        self._forget(shard)
+
+        if shard.reader is not None:
+            shard.reader.cancel()
+
+        await shard.connection.disconnect()
+
+    def _forget(self, shard: _Shard) -> None:
+        self._shards = {
+            name: other for name, other in self._shards.items() if other is not shard
+        }
+
+    def _channels_of(self, shard: _Shard) -> list[str]:
+        return [channel for channel, other in self.channels.items() if other is shard]
+
+    async def _read(self, shard: _Shard) -> None:
+        while True:
+            try:
+                kind, channel, data = await shard.connection.read_response(
+                    push_request=True
+                )
+            except redis.ConnectionError:
+                logger.warning("Lost a shard's pubsub connection", exc_info=True)
+                self._forget(shard)
+                self._resubscribe(self._channels_of(shard))
+                return
+            except redis.ResponseError as error:
+                if str(error).split(" ", 1)[0] not in self.SLOT_ERRORS:
+                    # Asking again would only be refused again
+                    logger.error("A shard refused a subscription", exc_info=True)
+                    continue
+
+                # A slot moved between learning who owned it and subscribing there. Which channel
+                # was refused isn't said, so every channel on the connection is checked again.
+                delay = min(
+                    self.RESUBSCRIBE_DELAY * 2**shard.refusals,
+                    self.MAX_RESUBSCRIBE_DELAY,
+                )
+                logger.warning(
+                    "A shard refused a subscription",
+                    extra={"retry_in": delay},
+                    exc_info=True,
+                )
+                shard.refusals += 1
+                self._resubscribe(self._channels_of(shard), delay)
+                continue
+
+            if kind == b"ssubscribe":
+                shard.refusals = 0
+            elif kind == b"smessage":
+                self._messages.put_nowait({"channel": channel, "data": data})
+            elif (
+                kind == b"sunsubscribe" and self.channels.get(channel.decode()) is shard
+            ):
+                # We didn't ask to leave the channel, so its slot has moved
+                self._resubscribe([channel.decode()])
+
+    def _resubscribe(self, channels: Iterable[str], delay: float = 0) -> None:
+        task = asyncio.get_running_loop().create_task(
+            self._subscribe_again(set(channels), delay)
+        )
+        self._resubscribing.add(task)
+        task.add_done_callback(self._resubscribing.discard)
+
+    async def _subscribe_again(self, channels: Set[str], delay: float) -> None:
+        await asyncio.sleep(delay)
+
+        while True:
+            async with self._lock:
+                try:
+                    # The slots have moved, or a node has gone, so they're learnt afresh
+                    await self._cluster.nodes_manager.initialize()
+
+                    for channel in channels:
+                        # Unless it's been unsubscribed from in the meantime
+                        if channel in self.channels:
+                            await self._subscribe(channel)
+
+                    # Shards whose channels have all moved elsewhere aren't needed any more
+                    for shard in list(self._shards.values()):
+                        if shard not in self.channels.values():
+                            await self._close(shard)
+
+                    return
+                except redis.RedisError:
+                    logger.warning("Failed to resubscribe to shards", exc_info=True)
+
+            await asyncio.sleep(self.RESUBSCRIBE_DELAY)
@@ -0,0 +1,71 @@
+import json
+from unittest.mock import patch
+from benchmarks import __main__ as benchmarks_module
+from benchmarks.lib import LoadResult, ServerUsage
+
+
+def summary(**overrides):
+    return {"connections": 10, "latency_ms_p50": 1.5, **overrides}
+
+
+class TestBenchmarksModule:
+    def test_reports_a_run(self):
+        # Given
+        result = LoadResult()
+        result.connections, result.connect_seconds = 10, 2.0
+        result.published, result.expected_deliveries = 20, 200
+        result.delivered, result.run_seconds, result.errors = 190, 4.0, 3
+        result.latencies_ms = [1.0, 2.0, 3.0]
+
+        before = ServerUsage(cpu_seconds=1.0, rss_bytes=0, peak_rss_bytes=0)
+        after = ServerUsage(
+            cpu_seconds=3.5, rss_bytes=64 * 2**20, peak_rss_bytes=96 * 2**20
+        )
+
+        # When
+        report = benchmarks_module.report(result, before, after)
+
+        # Then
+        assert report == {
+            "connections": 10,
+            "connections_per_second": 5.0,
+            "messages_published": 20,
+            "messages_published_per_second": 5.0,
+            "messages_delivered": 190,
+            "messages_missing": 10,
+            "messages_delivered_per_second": 47.5,
+            "server_errors": 3,
+            "latency_ms_p50": 2.0,
+            "latency_ms_p99": 2.98,
+            "latency_ms_p999": 2.998,
+            "server_cpu_seconds": 2.5,
+            "server_rss_mib": 64.0,
+            "server_peak_rss_mib": 96.0,
+        }
+
+    @patch("benchmarks.__main__.run")
+    def test_prints_a_column_per_codec(self, mock_run, capsys):
+        # Given
+        mock_run.side_effect = [summary(), summary(latency_ms_p50=12.25)]
+
+        # When
+        benchmarks_module.main(["--codecs", "json", "msgpack"])
+
+        # Then
+        assert capsys.readouterr().out.splitlines() == [
+            "codec           json  msgpack",
+            "connections       10       10",
+            "latency_ms_p50   1.5    12.25",
+        ]
+        assert [c.args[1] for c in mock_run.call_args_list] == ["json", "msgpack"]
+
+    @patch("benchmarks.__main__.run")
+    def test_prints_json_when_asked(self, mock_run, capsys):
+        # Given
+        mock_run.return_value = summary()
+
+        # When
+        benchmarks_module.main(["--json"])
+
+        # Then
+        assert json.loads(capsys.readouterr().out) == {"json": summary()}
@@ -0,0 +1,73 @@
+import asyncio
+import time
+import pytest
+from collections import deque
+from unittest.mock import Mock
+from websockets import WebSocketClientProtocol
+from benchmarks.lib import LoadGenerator, LoadResult
+from benchmarks.lib.load_generator import SyntheticClient
+from protocol import Chat, Error, ErrorCode, History, encode
+
+
+@pytest.mark.asyncio(scope="class")
+class TestSyntheticClient:
+    async def test_receives_chats_and_counts_errors(self):
+        # Given - a chat, then history and an error the server sent instead
+        sent_ns = time.perf_counter_ns()
+        client = SyntheticClient("USER", "ROOM")
+        client.websocket = Mock(WebSocketClientProtocol)
+        client.websocket.messages = deque(
+            [
+                encode(Chat(message=f"0:{sent_ns}", user="USER")),
+                encode(History(messages=(Chat(message="Old", user="USER"),))),
+                encode(Error(code=ErrorCode.RATE_LIMITED, message="Slow down")),
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        client.websocket.__aiter__ = mock_aiter
+        result = LoadResult()
+        result.expected_deliveries = 1
+        done = asyncio.Event()
+
+        # When
+        await client.receive_messages(result, done)
+
+        # Then
+        assert done.is_set()
+        assert result.delivered == 1
+        assert len(result.latencies_ms) == 1
+        assert result.latencies_ms[0] >= 0
+        assert result.errors == 1
+
+
+class TestLoadGenerator:
+    def test_expects_every_room_member_to_receive_every_message(self):
+        # When
+        load = LoadGenerator("ws://MOCK", clients=5, rooms=2, senders=1, messages=10)
+
+        # Then - rooms of 3 and 2 clients, with one sender each
+        assert [client.roomid for client in load.clients] == [
+            "bench-room-0",
+            "bench-room-1",
+            "bench-room-0",
+            "bench-room-1",
+            "bench-room-0",
+        ]
+        assert load.senders == load.clients[:2]
+        assert load.expected_deliveries == 3 * 10 + 2 * 10
+
+    def test_reports_rates_over_the_time_taken(self):
+        # Given
+        result = LoadResult()
+        result.connections, result.connect_seconds = 100, 2.0
+        result.published, result.delivered, result.run_seconds = 50, 500, 5.0
+
+        # Then
+        assert result.connections_per_second == 50
+        assert result.published_per_second == 10
+        assert result.delivered_per_second == 100
+        assert LoadResult().delivered_per_second == 0
@@ -0,0 +1,32 @@
+import io
+from unittest.mock import patch
+from benchmarks.lib import ServerUsage
+
+# A command name can hold spaces and brackets of its own
+STAT = (
+    "1234 (python -m (server)) S 1 1234 1234 0 -1 4194560 2000 0 0 0 "
+    "150 50 0 0 20 0 3 0 100 200000000 5000"
+)
+STATUS = """\
+Name:\tpython
+VmPeak:\t  300000 kB
+VmHWM:\t   40960 kB
+VmRSS:\t   20480 kB
+Threads:\t3
+"""
+
+
+class TestServerUsage:
+    def test_reads_cpu_time_and_memory_from_proc(self):
+        # Given
+        files = {"/proc/1234/stat": STAT, "/proc/1234/status": STATUS}
+
+        # When
+        with patch("builtins.open", lambda path: io.StringIO(files[path])):
+            with patch.object(ServerUsage, "CLOCK_TICKS", 100):
+                usage = ServerUsage.of(1234)
+
+        # Then - utime and stime are counted in clock ticks, and memory in kB
+        assert usage.cpu_seconds == 2.0
+        assert usage.rss_bytes == 20480 * 1024
+        assert usage.peak_rss_bytes == 40960 * 1024
@@ -0,0 +1,26 @@
+import math
+import pytest
+from benchmarks.lib import percentiles
+
+
+class TestPercentiles:
+    def test_returns_the_requested_percentiles(self):
+        # Given
+        samples = list(range(1, 1001))
+
+        # When
+        result = percentiles(samples)
+
+        # Then
+        assert result == pytest.approx({50: 500.5, 99: 990.01, 99.9: 999.001})
+
+    def test_every_percentile_of_one_sample_is_that_sample(self):
+        assert percentiles([7.5], points=(50, 99)) == {50: 7.5, 99: 7.5}
+
+    def test_percentiles_of_no_samples_are_nan(self):
+        # When
+        result = percentiles([])
+
+        # Then
+        assert list(result) == [50, 99, 99.9]
+        assert all(math.isnan(value) for value in result.values())
@@ -0,0 +1,37 @@
+from unittest.mock import patch
+from client.lib import Backoff
+
+
+class TestBackoff:
+    def test_delay_bound_doubles_with_each_attempt(self):
+        # Given
+        backoff = Backoff(base=1, cap=100)
+
+        # When
+        with patch("client.lib.backoff.random.uniform", lambda a, b: b):
+            delays = [backoff.delay(attempt) for attempt in range(4)]
+
+        # Then
+        assert delays == [1, 2, 4, 8]
+
+    def test_delay_is_capped(self):
+        # Given
+        backoff = Backoff(base=1, cap=10)
+
+        # When
+        with patch("client.lib.backoff.random.uniform", lambda a, b: b):
+            delay = backoff.delay(1_000)
+
+        # Then
+        assert delay == 10
+
+    def test_delay_is_jittered_between_zero_and_its_bound(self):
+        # Given
+        backoff = Backoff(base=1, cap=10)
+
+        # When
+        delays = [backoff.delay(3) for _ in range(100)]
+
+        # Then
+        assert all(0 <= delay <= 8 for delay in delays)
+        assert len(set(delays)) > 1
@@ -1,9 +1,10 @@
 import pytest
-from unittest.mock import AsyncMock, Mock
+from unittest.mock import AsyncMock, Mock, patch
 import json
-from jsonschema import ValidationError
-from websockets import WebSocketClientProtocol
+from websockets import ConnectionClosedError, WebSocketClientProtocol
 from client.client import Client
+from client.lib import Backoff
+from protocol import CODECS, Chat, Error, Join, ProtocolError, ServerMessage, decode
 from collections import deque
 
 
@@ -30,7 +31,7 @@ class TestClientClass:
 
     async def test_can_receive_server_events(self, mock_websocket):
         # Given
-        dummy_server_event = '{"type": "join", "roomid": "DUMMY"}'
+        dummy_server_event = '{"type": "server_msg", "message": "Joined DUMMY"}'
 
         # Mock our websocket to receive a dummy event from the server
         mock_websocket.recv = AsyncMock(return_value=dummy_server_event)
@@ -41,9 +42,9 @@ class TestClientClass:
         event = await client.receive_server_event()
 
         # Then
-        assert event == json.loads(dummy_server_event)
+        assert event == ServerMessage(message="Joined DUMMY")
 
-    async def test_raises_ValidationError_if_incoming_message_doesnt_match_schema(
+    async def test_raises_ProtocolError_if_incoming_message_is_invalid(
         self, mock_websocket
     ):
         # Given
@@ -54,7 +55,7 @@ class TestClientClass:
         client = Client("MOCK_USERNAME", mock_websocket)
 
         # When & Then
-        with pytest.raises(ValidationError):
+        with pytest.raises(ProtocolError):
             await client.receive_server_event()
 
     async def test_can_handle_incoming_messages(self, mock_websocket):
@@ -63,9 +64,9 @@ class TestClientClass:
         # below three messages as if they've been received over the network.
         mock_websocket.messages = deque(
             [
-                '{"type":"chat", "message": "Message1"}',
-                '{"type":"chat", "message": "Message2"}',
-                '{"type":"chat", "message": "Message3"}',
+                '{"type":"chat", "message": "Message1", "user": "U"}',
+                '{"type":"chat", "message": "Message2", "user": "U"}',
+                '{"type":"chat", "message": "Message3", "user": "U"}',
             ]
         )
 
@@ -81,8 +82,8 @@ class TestClientClass:
 
         handled = []
 
-        def callback(event):
-            handled.append(event["message"])
+        def callback(chat):
+            handled.append(chat.message)
 
         # When
         await client.handle_incoming_messages(callback)
@@ -91,7 +92,265 @@ class TestClientClass:
         assert len(handled) == 3
         assert handled == ["Message1", "Message2", "Message3"]
 
-    async def test_raise_AssertionError_if_message_type_is_invalid(
+    async def test_handles_each_message_in_a_history_batch(self, mock_websocket):
+        # Given
+        mock_websocket.messages = deque(
+            [
+                '{"type": "history", "messages": [{"type": "chat", "message": "Message1", "user": "U"}, '
+                '{"type": "chat", "message": "Message2", "user": "U"}]}',
+                '{"type": "chat", "message": "Message3", "user": "U"}',
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket)
+
+        handled = []
+
+        def callback(chat):
+            handled.append(chat.message)
+
+        # When
+        await client.handle_incoming_messages(callback)
+
+        # Then
+        assert handled == ["Message1", "Message2", "Message3"]
+
+    async def test_skips_chat_events_it_has_already_seen(self, mock_websocket):
+        # Given - a message that arrives both in the history and live
+        mock_websocket.messages = deque(
+            [
+                '{"type": "history", "messages": [{"id": "1-0", "type": "chat", "message": '
+                '"Message1", "user": "U"}, {"id": "2-0", "type": "chat", "message": "Message2", "user": "U"}]}',
+                '{"id": "2-0", "type": "chat", "message": "Message2", "user": "U"}',
+                '{"id": "10-0", "type": "chat", "message": "Message3", "user": "U"}',
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.set_roomid("MOCK_ROOMID")
+
+        handled = []
+
+        def callback(chat):
+            handled.append(chat.message)
+
+        # When
+        await client.handle_incoming_messages(callback)
+
+        # Then
+        assert handled == ["Message1", "Message2", "Message3"]
+        assert client.last_ids == {"MOCK_ROOMID": "10-0"}
+
+    async def test_join_sends_join_event_and_waits_for_server(self, mock_websocket):
+        # Given
+        mock_websocket.recv = AsyncMock(
+            return_value='{"type": "server_msg", "message": "Joined MOCK_ROOMID"}'
+        )
+        client = Client("MOCK_USERNAME", mock_websocket)
+
+        # When
+        await client.join("MOCK_ROOMID")
+
+        # Then
+        mock_websocket.send.assert_awaited_once_with(
+            '{"type": "join", "username": "MOCK_USERNAME", "roomid": "MOCK_ROOMID", '
+            '"version": 2}'
+        )
+        assert client.roomid == "MOCK_ROOMID"
+        assert client.rooms == ["MOCK_ROOMID"]
+
+    async def test_join_resumes_from_the_last_message_seen(self, mock_websocket):
+        # Given
+        mock_websocket.recv = AsyncMock(
+            return_value='{"type": "server_msg", "message": "Joined MOCK_ROOMID"}'
+        )
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.last_ids = {"MOCK_ROOMID": "1-0", "OTHER_ROOMID": "2-0"}
+
+        # When
+        await client.join("MOCK_ROOMID")
+
+        # Then
+        sent = json.loads(mock_websocket.send.await_args.args[0])
+        assert sent["last_id"] == "1-0"
+
+    @patch("client.client.asyncio.sleep", new_callable=AsyncMock)
+    @patch("client.client.websockets.connect", new_callable=AsyncMock)
+    async def test_reconnects_and_rejoins_when_the_connection_drops(
+        self, mock_connect, mock_sleep, mock_websocket
+    ):
+        # Given - a connection that drops after one message
+        async def dropping_aiter(self):
+            yield '{"id": "1-0", "type": "chat", "message": "Message1", "user": "U"}'
+            raise ConnectionClosedError(None, None)
+
+        mock_websocket.__aiter__ = dropping_aiter
+
+        # And a server that refuses the first attempt to reconnect
+        new_websocket = AsyncMock(WebSocketClientProtocol)
+        new_websocket.messages = deque(
+            ['{"id": "2-0", "type": "chat", "message": "Message2", "user": "U"}']
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+            client._closed = True
+
+        new_websocket.__aiter__ = mock_aiter
+        new_websocket.recv = AsyncMock(
+            return_value='{"type": "server_msg", "message": "Joined MOCK_ROOMID", '
+            '"version": 2}'
+        )
+        mock_connect.side_effect = [ConnectionRefusedError(), new_websocket]
+
+        client = Client(
+            "MOCK_USERNAME", mock_websocket, uri="ws://MOCK", backoff=Backoff(1, 10)
+        )
+        client.set_roomid("MOCK_ROOMID")
+        client.rooms.append("OTHER_ROOMID")
+
+        handled = []
+
+        def callback(chat):
+            handled.append(chat.message)
+
+        # When
+        with patch("client.lib.backoff.random.uniform", lambda a, b: b):
+            await client.handle_incoming_messages(callback)
+
+        # Then - the client backed off before each attempt
+        assert [c.args[0] for c in mock_sleep.await_args_list] == [1, 2]
+        assert mock_connect.await_count == 2
+
+        # And rejoined its rooms from the last message it saw, on the same chat log
+        assert client.websocket is new_websocket
+        rejoin, rejoin_other = [
+            json.loads(c.args[0]) for c in new_websocket.send.await_args_list
+        ]
+        assert rejoin["roomid"] == "MOCK_ROOMID"
+        assert rejoin["last_id"] == "1-0"
+        assert rejoin_other["roomid"] == "OTHER_ROOMID"
+        assert "last_id" not in rejoin_other
+        assert handled == ["Message1", "Message2"]
+
+    @patch("client.client.asyncio.sleep", new_callable=AsyncMock)
+    @patch("client.client.websockets.connect", new_callable=AsyncMock)
+    async def test_retries_and_reports_a_refused_rejoin(
+        self, mock_connect, mock_sleep, mock_websocket
+    ):
+        # Given - a server that refuses the first rejoin, then drops the second connection
+        refusing = AsyncMock(WebSocketClientProtocol)
+        refusing.recv.return_value = (
+            '{"type": "error", "code": "rate_limited", "message": "Slow down"}'
+        )
+        dropping = AsyncMock(WebSocketClientProtocol)
+        dropping.recv.side_effect = ConnectionClosedError(None, None)
+        accepting = AsyncMock(WebSocketClientProtocol)
+        accepting.recv.return_value = '{"type": "server_msg", "message": "Joined"}'
+        mock_connect.side_effect = [refusing, dropping, accepting]
+
+        client = Client("MOCK_USERNAME", mock_websocket, uri="ws://MOCK")
+        client.set_roomid("MOCK_ROOMID")
+        on_error = Mock()
+
+        # When
+        reconnected = await client.reconnect(on_error)
+
+        # Then - the error's reported, and the failed connections are closed
+        assert reconnected
+        on_error.assert_called_once_with(
+            Error(code="rate_limited", message="Slow down")
+        )
+        refusing.close.assert_awaited_once()
+        dropping.close.assert_awaited_once()
+        accepting.close.assert_not_awaited()
+        assert client.websocket is accepting
+        assert mock_sleep.await_count == 3
+
+    @patch("client.client.asyncio.sleep", new_callable=AsyncMock)
+    @patch("client.client.websockets.connect", new_callable=AsyncMock)
+    async def test_gives_up_on_a_rejoin_refused_for_good(
+        self, mock_connect, mock_sleep, mock_websocket
+    ):
+        # Given
+        refusing = AsyncMock(WebSocketClientProtocol)
+        refusing.recv.return_value = (
+            '{"type": "error", "code": "invalid_field", "message": "Bad join"}'
+        )
+        mock_connect.return_value = refusing
+
+        async def dropping_aiter(self):
+            raise ConnectionClosedError(None, None)
+            yield
+
+        mock_websocket.__aiter__ = dropping_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket, uri="ws://MOCK")
+        client.set_roomid("MOCK_ROOMID")
+        on_error = Mock()
+
+        # When
+        await client.handle_incoming_messages(Mock(), on_error)
+
+        # Then - the session ends
+        mock_connect.assert_awaited_once()
+        refusing.close.assert_awaited_once()
+        on_error.assert_called_once_with(
+            Error(code="invalid_field", message="Bad join")
+        )
+
+    async def test_does_not_reconnect_without_a_room_to_rejoin(self, mock_websocket):
+        # Given - a client that's left every room, whose connection then drops
+        async def dropping_aiter(self):
+            raise ConnectionClosedError(None, None)
+            yield
+
+        mock_websocket.__aiter__ = dropping_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket, uri="ws://MOCK")
+        client.reconnect = AsyncMock()
+
+        # When
+        await client.handle_incoming_messages(Mock())
+
+        # Then
+        client.reconnect.assert_not_awaited()
+
+    async def test_does_not_reconnect_once_closed(self, mock_websocket):
+        # Given
+        mock_websocket.messages = deque([])
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket, uri="ws://MOCK")
+        client.reconnect = AsyncMock()
+
+        # When
+        await client.close()
+        await client.handle_incoming_messages(Mock())
+
+        # Then
+        mock_websocket.close.assert_awaited_once()
+        client.reconnect.assert_not_awaited()
+
+    async def test_raises_ProtocolError_if_message_type_is_invalid(
         self, mock_websocket
     ):
         # Given
@@ -107,34 +366,300 @@ class TestClientClass:
         mock_callback = Mock()
 
         # When & Then
-        with pytest.raises(AssertionError):
+        with pytest.raises(ProtocolError):
             await client.handle_incoming_messages(mock_callback)
 
         mock_callback.assert_not_called()
 
-    async def test_calls_websocket_send_when_sending_an_event(self, mock_websocket):
+    async def test_raises_ProtocolError_on_messages_not_expected_from_the_server(
+        self, mock_websocket
+    ):
         # Given
+        mock_websocket.messages = deque(
+            ['{"type": "join", "username": "MOCK", "roomid": "MOCK_ROOMID"}']
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
         client = Client("MOCK_USERNAME", mock_websocket)
-        event = {"type": "chat", "message": "Hello!"}
+
+        # When & Then
+        with pytest.raises(ProtocolError):
+            await client.handle_incoming_messages(Mock())
+
+    async def test_passes_errors_from_the_server_to_on_error(self, mock_websocket):
+        # Given
+        mock_websocket.messages = deque(
+            [
+                '{"type": "error", "code": "invalid_field", "message": "Bad chat"}',
+                '{"type": "chat", "message": "Message1", "user": "U"}',
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket)
+        mock_callback = Mock()
+        mock_on_error = Mock()
 
         # When
-        await client.send_event(event)
+        await client.handle_incoming_messages(mock_callback, on_error=mock_on_error)
+
+        # Then - the error is reported and the connection carries on
+        mock_on_error.assert_called_once_with(
+            Error(code="invalid_field", message="Bad chat")
+        )
+        mock_callback.assert_called_once_with(Chat(message="Message1", user="U"))
+
+    async def test_ignores_errors_without_on_error(self, mock_websocket):
+        # Given
+        mock_websocket.messages = deque(
+            ['{"type": "error", "code": "invalid_field", "message": "Bad chat"}']
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket)
+        mock_callback = Mock()
+
+        # When
+        await client.handle_incoming_messages(mock_callback)
 
         # Then
-        mock_websocket.send.assert_called_once_with(json.dumps(event))
+        mock_callback.assert_not_called()
+
+    async def test_join_raises_ProtocolError_if_the_server_refuses(
+        self, mock_websocket
+    ):
+        # Given
+        mock_websocket.recv = AsyncMock(
+            return_value='{"type": "error", "code": "unsupported_version", "message": "No"}'
+        )
+        client = Client("MOCK_USERNAME", mock_websocket)
+
+        # When & Then
+        with pytest.raises(ProtocolError) as error:
+            await client.join("MOCK_ROOMID")
 
-    async def test_raises_a_ValidationError_if_invalid_message_on_send_event(
+        assert error.value.code == "unsupported_version"
+        assert client.roomid == ""
+
+    async def test_join_raises_ProtocolError_if_the_reply_is_not_a_server_message(
         self, mock_websocket
     ):
         # Given
+        mock_websocket.recv = AsyncMock(
+            return_value='{"type": "chat", "message": "Hello!", "user": "U"}'
+        )
         client = Client("MOCK_USERNAME", mock_websocket)
-        event = {"not": "a", "valid": "event!"}
 
         # When & Then
-        with pytest.raises(ValidationError):
-            await client.send_event(event)
+        with pytest.raises(ProtocolError):
+            await client.join("MOCK_ROOMID")
+
+    async def test_join_uses_the_version_the_server_chose(self, mock_websocket):
+        # Given
+        mock_websocket.recv = AsyncMock(
+            return_value='{"type": "server_msg", "message": "Joined", "version": 1}'
+        )
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.version = None
 
-        mock_websocket.send.assert_not_called()
+        # When
+        await client.join("MOCK_ROOMID")
+
+        # Then
+        assert client.version == 1
+
+    async def test_joins_and_leaves_more_rooms_over_the_same_connection(
+        self, mock_websocket
+    ):
+        # Given
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.set_roomid("ROOM1")
+        client.last_ids = {"ROOM2": "2-0"}
+
+        # When
+        await client.join_room("ROOM2")
+        await client.join_room("ROOM3")
+        await client.leave_room("ROOM3")
+        await client.send_message("Hello!", roomid="ROOM2")
+
+        # Then
+        assert [json.loads(c.args[0]) for c in mock_websocket.send.await_args_list] == [
+            {
+                "type": "join",
+                "username": "MOCK_USERNAME",
+                "roomid": "ROOM2",
+                "last_id": "2-0",
+            },
+            {"type": "join", "username": "MOCK_USERNAME", "roomid": "ROOM3"},
+            {"type": "leave", "roomid": "ROOM3"},
+            {
+                "type": "chat",
+                "message": "Hello!",
+                "user": "MOCK_USERNAME",
+                "roomid": "ROOM2",
+            },
+        ]
+
+        # And ROOM2 isn't one of ours until the server says so
+        assert client.rooms == ["ROOM1"]
+
+    async def test_records_rooms_once_the_server_accepts_them(self, mock_websocket):
+        # Given - a server that lets us into one room but not another
+        mock_websocket.messages = deque(
+            [
+                '{"type": "server_msg", "message": "Joined ROOM2", "roomid": "ROOM2"}',
+                '{"type": "error", "code": "too_many_rooms", "message": "No", '
+                '"roomid": "ROOM3"}',
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.set_roomid("ROOM1")
+        await client.join_room("ROOM2")
+        # As when rejoining it after reconnecting
+        client.rooms.append("ROOM3")
+        await client.join_room("ROOM3")
+
+        # When
+        await client.handle_incoming_messages(Mock())
+
+        # Then - only the room it was let into is rejoined after reconnecting
+        assert client.rooms == ["ROOM1", "ROOM2"]
+        assert client._joining == set()
+
+    async def test_a_room_joined_after_leaving_every_room_becomes_the_primary(
+        self, mock_websocket
+    ):
+        # Given
+        mock_websocket.messages = deque(
+            ['{"type": "server_msg", "message": "Joined ROOM2", "roomid": "ROOM2"}']
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.set_roomid("ROOM1")
+        await client.leave_room("ROOM1")
+
+        # When
+        await client.join_room("ROOM2")
+        await client.handle_incoming_messages(Mock())
+
+        # Then
+        assert (client.roomid, client.rooms) == ("ROOM2", ["ROOM2"])
+
+    async def test_leaving_the_room_joined_with_makes_another_the_primary(
+        self, mock_websocket
+    ):
+        # Given
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.set_roomid("ROOM1")
+        client.rooms.append("ROOM2")
+
+        # When
+        await client.leave_room("ROOM1")
+
+        # Then - reconnecting won't rejoin the room that was left
+        assert (client.roomid, client.rooms) == ("ROOM2", ["ROOM2"])
+
+        # And once every room is left there's none
+        await client.leave_room("ROOM2")
+        assert (client.roomid, client.rooms) == ("", [])
+
+    async def test_cannot_join_more_rooms_on_a_version_1_server(self, mock_websocket):
+        # Given
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.version = 1
+
+        # When & Then
+        with pytest.raises(ProtocolError):
+            await client.join_room("ROOM2")
+
+        mock_websocket.send.assert_not_awaited()
+
+    async def test_tracks_the_last_message_seen_in_each_room(self, mock_websocket):
+        # Given - messages from two rooms, whose IDs are only in order within each room
+        mock_websocket.messages = deque(
+            [
+                '{"type": "server_msg", "message": "Joined ROOM2", "roomid": "ROOM2"}',
+                '{"type": "history", "roomid": "ROOM2", "messages": [{"id": "1-0", '
+                '"type": "chat", "message": "Message1", "user": "U"}]}',
+                '{"id": "5-0", "type": "chat", "message": "Message2", "user": "U", '
+                '"roomid": "ROOM1"}',
+                '{"id": "2-0", "type": "chat", "message": "Message3", "user": "U", '
+                '"roomid": "ROOM2"}',
+                '{"id": "2-0", "type": "chat", "message": "Message3", "user": "U", '
+                '"roomid": "ROOM2"}',
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_websocket.__aiter__ = mock_aiter
+
+        client = Client("MOCK_USERNAME", mock_websocket)
+        client.set_roomid("ROOM1")
+        handled = []
+
+        # When
+        await client.handle_incoming_messages(lambda chat: handled.append(chat.message))
+
+        # Then
+        assert handled == ["Message1", "Message2", "Message3"]
+        assert client.last_ids == {"ROOM1": "5-0", "ROOM2": "2-0"}
+
+    async def test_calls_websocket_send_when_sending_an_event(self, mock_websocket):
+        # Given
+        client = Client("MOCK_USERNAME", mock_websocket)
+        event = Join(username="MOCK_USERNAME", roomid="MOCK_ROOMID")
+
+        # When
+        await client.send_event(event)
+
+        # Then
+        mock_websocket.send.assert_called_once_with(
+            '{"type": "join", "username": "MOCK_USERNAME", "roomid": "MOCK_ROOMID"}'
+        )
+
+    async def test_trusted_client_skips_validation(self, mock_websocket):
+        # Given
+        mock_websocket.recv = AsyncMock(
+            return_value='{"type": "chat", "message": 1, "user": "U"}'
+        )
+        client = Client("MOCK_USERNAME", mock_websocket, trusted=True)
+
+        # When
+        event = await client.receive_server_event()
+
+        # Then
+        assert event == Chat(message=1, user="U")
 
     async def test_send_message_results_in_sending_a_message_to_the_ws_server(
         self, mock_websocket
@@ -150,3 +675,36 @@ class TestClientClass:
         # Then
         event = {"type": "chat", "message": message, "user": "MOCK_USERNAME"}
         mock_websocket.send.assert_called_once_with(json.dumps(event))
+
+    async def test_join_switches_to_the_codec_the_server_chose(self, mock_websocket):
+        # Given
+        msgpack = CODECS["msgpack"]
+        mock_websocket.recv = AsyncMock(
+            return_value='{"type": "server_msg", "message": "Joined", "codec": "msgpack"}'
+        )
+        client = Client("MOCK_USERNAME", mock_websocket, codecs=["msgpack"])
+
+        # When
+        await client.join("MOCK_ROOMID")
+        await client.send_message("Hello!")
+
+        # Then - the join asks for the codec in JSON, and what follows uses it
+        join, chat = [c.args[0] for c in mock_websocket.send.await_args_list]
+        assert json.loads(join)["codecs"] == ["msgpack"]
+        assert client.codec is msgpack
+        assert decode(chat, codec=msgpack) == Chat(
+            message="Hello!", user="MOCK_USERNAME"
+        )
+
+    async def test_join_raises_ProtocolError_if_the_codec_is_unavailable(
+        self, mock_websocket
+    ):
+        # Given
+        mock_websocket.recv = AsyncMock(
+            return_value='{"type": "server_msg", "message": "Joined", "codec": "morse"}'
+        )
+        client = Client("MOCK_USERNAME", mock_websocket, codecs=["morse"])
+
+        # When & Then
+        with pytest.raises(ProtocolError):
+            await client.join("MOCK_ROOMID")
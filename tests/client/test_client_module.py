@@ -32,7 +32,7 @@ class TestClientModule:
         monkeypatch.setattr("client.__main__.connect", lambda *_: connect_coroutine)
 
         # When
-        client_module.main()
+        client_module.main([])
 
         # Then
         assert mock_nest_asyncio.apply.called
@@ -52,7 +52,7 @@ class TestClientModule:
         mock_websocket = Mock(websockets.WebSocketClientProtocol)
         # The websocket is mocked to always receive the same message from the server.
         mock_websocket.recv = AsyncMock(
-            return_value='{"type":"server_msg", "roomid":"MOCK_ROOMID"}'
+            return_value='{"type":"server_msg", "message":"Joined MOCK_ROOMID"}'
         )
         mock_websockets_connect.return_value.__aenter__.return_value = mock_websocket
 
@@ -69,7 +69,7 @@ class TestClientModule:
         # A request to join a room should have been sent
         assert mock_websocket.send.called
         mock_websocket.send.assert_called_once_with(
-            '{"type": "join", "username": "USER", "roomid": "ROOMID"}'
+            '{"type": "join", "username": "USER", "roomid": "ROOMID", "version": 2}'
         )
 
         # A corresponding response should have been received
@@ -79,6 +79,9 @@ class TestClientModule:
         assert mock_console_display.called
         assert mock_run_console_display.called
 
+        # The connection is closed once the display exits
+        mock_websocket.close.assert_awaited_once()
+
 
 class TestClientModuleMiscellaneous:
     def test_input_with_default(self, monkeypatch):
@@ -1,9 +1,11 @@
+import asyncio
 import pytest
-from unittest.mock import patch, Mock
+from unittest.mock import AsyncMock, patch, Mock
 from urwid import ExitMainLoop
-from websockets import WebSocketClientProtocol
+from websockets import ConnectionClosedError, WebSocketClientProtocol
 from client.client import Client
 from client.lib.ui import ConsoleDisplay
+from protocol import Chat, Error
 
 
 # Arrange a fixture for a mock client that will be reused across tests
@@ -65,13 +67,14 @@ class TestConsoleDisplay:
     async def test_creates_a_task_to_handle_incoming_messages(
         self, mocked_get_running_loop, _, mock_client, monkeypatch
     ):
-        dummy_event = {"user": "MOCK_USERNAME", "message": "Hello!"}
+        dummy_event = Chat(message="Hello!", user="MOCK_USERNAME")
 
         monkeypatch.setattr(
             mock_client,
             "handle_incoming_messages",
-            lambda callback: callback(dummy_event),
+            lambda callback, on_error: callback(dummy_event),
         )
+        mocked_get_running_loop.return_value.time.return_value = 0.0
 
         # When we initialise and run our console display
         display = ConsoleDisplay(mock_client)
@@ -84,7 +87,9 @@ class TestConsoleDisplay:
         assert mocked_get_running_loop.call_count == 1
         assert loop.create_task.call_count == 1
         loop.create_task.assert_called_with(
-            mock_client.handle_incoming_messages(display._handle_receive_message)
+            mock_client.handle_incoming_messages(
+                display._handle_receive_message, on_error=display._handle_error
+            )
         )
 
     @patch("client.lib.ui.console_display.u.MainLoop")
@@ -96,32 +101,78 @@ class TestConsoleDisplay:
         display = ConsoleDisplay(mock_client)
         await display.run()
 
-        self_event = {"user": mock_client.username, "message": "Hello!"}
-        user_event = {"user": "SOMEONE_ELSE", "message": "Hello to you too!"}
+        self_event = Chat(message="Hello!", user=mock_client.username)
+        user_event = Chat(message="Hello to you too!", user="SOMEONE_ELSE")
 
         log = mock_chatlog.return_value
 
-        # When a new message gets sent to our handler
+        # When new messages get sent to our handler
         display._handle_receive_message(self_event)
-        assert log.append_and_set_focus.call_count == 1
-        log.append_and_set_focus.assert_called_with(
-            self_event["user"], self_event["message"], "self_highlight"
-        )
-
         display._handle_receive_message(user_event)
-        assert log.append_and_set_focus.call_count == 2
-        log.append_and_set_focus.assert_called_with(
-            user_event["user"], user_event["message"], "user_highlight"
-        )
 
+        # Then nothing is drawn until the next frame
+        log.extend.assert_not_called()
+        mock_urwid_loop.return_value.draw_screen.assert_not_called()
+
+        await asyncio.sleep(1 / ConsoleDisplay.MAX_FRAME_RATE)
+
+        # When the whole batch is added to the log and drawn at once
+        log.extend.assert_called_once()
+        assert list(log.extend.call_args.args[0]) == [
+            (self_event.user, self_event.message, "self_highlight"),
+            (user_event.user, user_event.message, "user_highlight"),
+        ]
+        assert mock_urwid_loop.return_value.draw_screen.call_count == 1
+
+    @patch("client.lib.ui.console_display.u.MainLoop")
+    @patch("client.lib.ui.console_display.Chatlog", autospec=True)
+    async def test_errors_from_the_server_are_added_to_the_chatlog(
+        self, mock_chatlog, mock_urwid_loop, mock_client
+    ):
+        # Given
+        display = ConsoleDisplay(mock_client)
+        await display.run()
+
+        # When the server rejects something we sent
+        display._handle_error(Error(code="invalid_field", message="Bad chat"))
+        await asyncio.sleep(1 / ConsoleDisplay.MAX_FRAME_RATE)
+
+        # Then it's shown in the log as a message from the server
+        log = mock_chatlog.return_value
+        assert list(log.extend.call_args.args[0]) == [("Server", "Bad chat", "error")]
+
+    @patch("client.lib.ui.console_display.u.MainLoop")
+    @patch("client.lib.ui.console_display.Chatlog", autospec=True)
+    async def test_redraws_are_limited_to_the_max_frame_rate(
+        self, mock_chatlog, mock_urwid_loop, mock_client
+    ):
+        # Given a display that has just drawn a message
+        display = ConsoleDisplay(mock_client)
+        await display.run()
+
+        event = Chat(message="Hello!", user="SOMEONE_ELSE")
+        display._handle_receive_message(event)
+        await asyncio.sleep(0.01)
+        assert mock_urwid_loop.return_value.draw_screen.call_count == 1
+
+        # When a burst of messages arrives straight after
+        for _ in range(1_000):
+            display._handle_receive_message(event)
+
+        # Then it isn't drawn until a frame has passed since the last draw
+        await asyncio.sleep(0)
+        assert mock_urwid_loop.return_value.draw_screen.call_count == 1
+
+        await asyncio.sleep(1 / ConsoleDisplay.MAX_FRAME_RATE)
         assert mock_urwid_loop.return_value.draw_screen.call_count == 2
+        assert len(list(mock_chatlog.return_value.extend.call_args.args[0])) == 1_000
 
     @patch("client.lib.ui.console_display.u.MainLoop")
     @patch("client.lib.ui.console_display.asyncio.get_running_loop")
     async def test_correctly_calls_client_send_message(
         self, mocked_get_running_loop, _, mock_client
     ):
-        mock_client.send_message = lambda *_: "Sent!"
+        mock_client.send_message = AsyncMock()
 
         # When we initialise and run our console display
         display = ConsoleDisplay(mock_client)
@@ -136,7 +187,31 @@ class TestConsoleDisplay:
 
         assert mocked_get_running_loop.call_count == 1
         assert loop.create_task.call_count == 2
-        loop.create_task.assert_called_with(mock_client.send_message())
+
+        await loop.create_task.call_args.args[0]
+        mock_client.send_message.assert_awaited_once_with("Here's my message!")
+
+    @patch("client.lib.ui.console_display.u.MainLoop")
+    @patch("client.lib.ui.console_display.Chatlog", autospec=True)
+    async def test_messages_that_cant_be_sent_are_reported_in_the_chatlog(
+        self, mock_chatlog, mock_urwid_loop, mock_client
+    ):
+        # Given a client that's reconnecting
+        mock_client.send_message = AsyncMock(
+            side_effect=ConnectionClosedError(None, None)
+        )
+        display = ConsoleDisplay(mock_client)
+        await display.run()
+
+        # When
+        await display._send_message("Hello!")
+        await asyncio.sleep(1 / ConsoleDisplay.MAX_FRAME_RATE)
+
+        # Then
+        log = mock_chatlog.return_value
+        assert list(log.extend.call_args.args[0]) == [
+            ("Client", "Not connected, so not sent: Hello!", "error")
+        ]
 
     @patch("client.lib.ui.console_display.u.MainLoop.run")
     async def test_can_exit_display_with_esc(self, _, mock_client):
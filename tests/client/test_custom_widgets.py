@@ -1,7 +1,9 @@
+import sys
 from unittest.mock import Mock, patch
 import pytest
 import urwid
 from client.lib.ui.custom_widgets import Chatlog, InputBox, InfoPanel, DequeWalker
+from client.lib.ui.custom_widgets.chat_record import ChatRecord
 
 
 class TestChatlog:
@@ -30,30 +32,166 @@ class TestChatlog:
         text = cl.walker.contents[2]
         assert text.text == "User3: Message3"
 
-    def test_can_append_to_log_and_focus_messages(self):
+    def test_can_extend_log_and_follow_its_last_message(self):
+        # Given
         cl = Chatlog()
+        on_modified = Mock()
+        urwid.connect_signal(cl.walker, "modified", on_modified)
 
-        args1 = ("User1", "Message1", "dummy_attribute")
-        args2 = ("User2", "Message2", "dummy_attribute")
-        args3 = ("User3", "Message3", "dummy_attribute")
+        # When
+        cl.extend(
+            [
+                ("User1", "Message1", "dummy_attribute"),
+                ("User2", "Message2", "dummy_attribute"),
+            ]
+        )
+
+        # Then
+        assert [cl.walker[i].text for i in range(cl.size)] == [
+            "User1: Message1",
+            "User2: Message2",
+        ]
+        assert cl.focus == cl.walker.contents[-1]
+        on_modified.assert_called_once()
+
+    def test_extending_with_nothing_changes_nothing(self):
+        # Given
+        cl = Chatlog()
+
+        # When
+        cl.extend([])
+
+        # Then
+        assert cl.size == 0
+
+    def test_follows_new_messages_while_focused_on_the_newest(self):
+        # Given
+        cl = Chatlog()
+        cl.extend([("User", f"Message{i}", "dummy_attribute") for i in range(3)])
+        on_modified = Mock()
+        urwid.connect_signal(cl.walker, "modified", on_modified)
+
+        # When
+        cl.extend([("User", f"Message{i}", "dummy_attribute") for i in range(3, 5)])
+
+        # Then
+        assert cl.walker.focus == 4
+        on_modified.assert_called_once()
+
+    def test_isnt_redrawn_for_messages_out_of_view_once_scrolled_up(self):
+        # Given - a screenful of messages, scrolled up from the newest
+        cl = Chatlog()
+        cl.extend([("User", f"Message{i}", "dummy_attribute") for i in range(10)])
+        cl.walker.set_focus(2)
+        canvas = cl.render((40, 5), focus=True)
+        on_modified = Mock()
+        urwid.connect_signal(cl.walker, "modified", on_modified)
+
+        # When
+        cl.extend([("User", "Message10", "dummy_attribute")])
+
+        # Then - it stays where it was, and what's drawn hasn't changed
+        assert cl.walker.focus == 2
+        on_modified.assert_not_called()
+        assert cl.render((40, 5), focus=True).text == canvas.text
+
+    def test_is_redrawn_for_messages_in_view_once_scrolled_up(self):
+        # Given - a log with room for more, scrolled up from the newest message
+        cl = Chatlog()
+        cl.extend([("User", f"Message{i}", "dummy_attribute") for i in range(2)])
+        cl.walker.set_focus(0)
+        cl.render((40, 5), focus=True)
+        on_modified = Mock()
+        urwid.connect_signal(cl.walker, "modified", on_modified)
+
+        # When
+        cl.extend([("User", "Message2", "dummy_attribute")])
+
+        # Then
+        assert cl.walker.focus == 0
+        on_modified.assert_called_once()
+        canvas = cl.render((40, 5), focus=True)
+        assert canvas.text[2].decode().rstrip() == "User: Message2"
 
-        cl.append_and_set_focus(*args1)
-        text_widget_1: urwid.Text = cl.walker.contents[-1]
+    def test_only_creates_widgets_for_rows_it_displays(self):
+        # Given
+        cl = Chatlog()
+        render = Mock(wraps=Chatlog._render)
+        cl.walker._widget_factory = render
+
+        cl.extend((f"User{i}", f"Message{i}", "dummy_attribute") for i in range(10_000))
+
+        # When
+        canvas = cl.render((40, 5), focus=True)
+
+        # Then - only about a screenful of widgets has been created, for the newest messages
+        assert render.call_count < 10
+        assert canvas.text[-1].decode().rstrip() == "User9999: Message9999"
+
+    def test_scrollback_is_limited_by_memory_budget(self):
+        # Given
+        record_size = ChatRecord("User", "Message", "dummy_attribute").size
+        cl = Chatlog(scrollback_bytes=record_size * 3)
 
-        assert text_widget_1.text == "User1: Message1"
-        assert cl.focus == text_widget_1
+        # When
+        for i in range(5):
+            cl.append("User", "Message", "dummy_attribute")
+
+        # Then - only as many messages as fit in the budget are kept
+        assert cl.size == 3
+        assert cl.walker.bytes == record_size * 3
+
+    def test_focus_stays_on_its_message_as_old_ones_are_evicted(self):
+        # Given a log that's been scrolled up from the newest message
+        record_size = ChatRecord("User", "Message", "dummy_attribute").size
+        cl = Chatlog(scrollback_bytes=record_size * 3)
+        cl.extend([("User", "Message", "dummy_attribute")] * 3)
+        cl.walker.set_focus(1)
+        focused = cl.focus
+
+        # When
+        cl.append("User", "Message", "dummy_attribute")
 
-        cl.append_and_set_focus(*args2)
-        text_widget_2: urwid.Text = cl.walker.contents[-1]
+        # Then
+        assert cl.walker.focus == 1
+        assert cl.focus is focused
 
-        assert text_widget_2.text == "User2: Message2"
-        assert cl.focus == text_widget_2
+    def test_focus_moves_to_oldest_message_if_its_message_is_evicted(self):
+        # Given a log that's been scrolled to the oldest message
+        record_size = ChatRecord("User", "Message", "dummy_attribute").size
+        cl = Chatlog(scrollback_bytes=record_size * 3)
+        cl.extend([("User", "Message", "dummy_attribute")] * 3)
+        cl.walker.set_focus(0)
 
-        cl.append_and_set_focus(*args3)
-        text_widget_3: urwid.Text = cl.walker.contents[-1]
+        # When
+        cl.append("User", "Message", "dummy_attribute")
 
-        assert text_widget_3.text == "User3: Message3"
-        assert cl.focus == text_widget_3
+        # Then
+        assert cl.walker.focus == 1
+
+
+class TestChatRecord:
+    def test_shares_one_copy_of_each_username(self):
+        # Given - usernames decoded from separate messages are separate strings
+        user1 = "".join(["Us", "er"])
+        user2 = "".join(["U", "ser"])
+        assert user1 is not user2
+
+        # When
+        record1 = ChatRecord(user1, "Message1", "dummy_attribute")
+        record2 = ChatRecord(user2, "Message2", "dummy_attribute")
+
+        # Then
+        assert record1.user is record2.user
+        assert not hasattr(record1, "__dict__")
+
+    def test_size_grows_with_message(self):
+        # When
+        short = ChatRecord("User", "Hi", "dummy_attribute")
+        long = ChatRecord("User", "Hi" * 100, "dummy_attribute")
+
+        # Then
+        assert long.size - short.size == 198
 
 
 class TestInputBox:
@@ -257,6 +395,162 @@ class TestDequeWalker:
         assert wrapped_pos_right_edge == 2
         assert wrapped_pos_extraneous == 29
 
+    def test_evicts_records_once_over_max_bytes(self):
+        # Given
+        walker = DequeWalker(maxlen=None, max_bytes=10, sizeof=len)
+
+        # When
+        for message in ("1234", "5678", "90"):
+            walker.append(message)
+
+        assert list(walker) == ["1234", "5678", "90"]
+        walker.append("abc")
+
+        # Then
+        assert list(walker) == ["5678", "90", "abc"]
+        assert walker.bytes == 9
+        assert walker.first_position == 1
+        assert walker[1] == "5678"
+
+    def test_keeps_newest_record_even_if_over_max_bytes(self):
+        # Given
+        walker = DequeWalker(maxlen=None, max_bytes=2, sizeof=len)
+        walker.append("1")
+
+        # When
+        walker.append("12345")
+
+        # Then
+        assert list(walker) == ["12345"]
+        assert walker.bytes == 5
+
+    def test_tracks_bytes_through_maxlen_evictions(self, walker_no_wrap):
+        # When
+        for message in ("1", "2", "3", "4"):
+            walker_no_wrap.append(message)
+
+        # Then
+        assert walker_no_wrap.bytes == sum(sys.getsizeof(m) for m in ("2", "3", "4"))
+
+    def test_positions_stay_the_same_as_records_are_evicted(self, walker_no_wrap):
+        # Given
+        for message in ("widget0", "widget1", "widget2"):
+            walker_no_wrap.append(message)
+        walker_no_wrap.set_focus(1)
+
+        # When
+        walker_no_wrap.append("widget3")
+
+        # Then - every record still has the position it was appended at
+        assert walker_no_wrap.first_position == 1
+        assert walker_no_wrap.last_position == 3
+        assert [walker_no_wrap[p] for p in (1, 2, 3)] == [
+            "widget1",
+            "widget2",
+            "widget3",
+        ]
+        assert walker_no_wrap[-1] == "widget3"
+        assert walker_no_wrap.focus == 1
+
+        with pytest.raises(IndexError):
+            walker_no_wrap[0]
+
+        with pytest.raises(IndexError):
+            walker_no_wrap.set_focus(0)
+
+        assert walker_no_wrap.next_position(2) == 3
+        assert walker_no_wrap.prev_position(2) == 1
+
+        with pytest.raises(IndexError):
+            walker_no_wrap.prev_position(1)
+
+    def test_wraps_around_stable_positions(self, walker_with_wrap):
+        # Given
+        for message in ("widget0", "widget1", "widget2", "widget3"):
+            walker_with_wrap.append(message)
+
+        # When & Then
+        assert walker_with_wrap.next_position(3) == 1
+        assert walker_with_wrap.prev_position(1) == 3
+
+    def test_notifies_listeners_of_appended_and_evicted_positions(self, walker_no_wrap):
+        # Given
+        appended = Mock()
+        evicted = Mock()
+        urwid.connect_signal(walker_no_wrap, "appended", appended)
+        urwid.connect_signal(walker_no_wrap, "evicted", evicted)
+
+        # When
+        walker_no_wrap.append("widget0")
+
+        # Then
+        appended.assert_called_once_with(0, 1)
+
+        # When a batch is added
+        appended.reset_mock()
+        walker_no_wrap.extend(["widget1", "widget2", "widget3"])
+
+        # Then listeners hear about it once, and about the eviction it caused
+        appended.assert_called_once_with(1, 4)
+        evicted.assert_called_once_with(0, 1)
+
+    def test_extend_only_reports_records_that_were_kept(self, walker_no_wrap):
+        # Given
+        appended = Mock()
+        urwid.connect_signal(walker_no_wrap, "appended", appended)
+
+        # When
+        walker_no_wrap.extend([f"widget{i}" for i in range(5)])
+
+        # Then
+        appended.assert_called_once_with(2, 5)
+
+        # When
+        appended.reset_mock()
+        walker_no_wrap.extend([])
+
+        # Then
+        appended.assert_not_called()
+
+    def test_creates_widgets_for_records_on_demand(self):
+        # Given
+        factory = Mock(side_effect=urwid.Text)
+        walker = DequeWalker(widget_factory=factory)
+        walker.append("Message1")
+        walker.append("Message2")
+
+        # When
+        widget = walker[1]
+
+        # Then
+        factory.assert_called_once_with("Message2")
+        assert widget.text == "Message2"
+
+        # And the widget is reused while it's cached
+        assert walker[1] is widget
+        assert factory.call_count == 1
+
+    def test_keeps_only_the_most_recently_used_widgets(self):
+        # Given
+        factory = Mock(side_effect=urwid.Text)
+        walker = DequeWalker(widget_factory=factory, cache_size=2)
+        for message in ("Message1", "Message2", "Message3"):
+            walker.append(message)
+
+        first = walker[0]
+        walker[1]
+        walker[0]
+
+        # When - a third widget pushes out the least recently used one
+        walker[2]
+
+        # Then
+        assert walker[0] is first
+        assert factory.call_count == 3
+
+        walker[1]
+        assert factory.call_count == 4
+
     def test_prev_position_throws_for_invalid_position(self, walker_no_wrap):
         # Given
         walker_no_wrap.append("widget1")
@@ -0,0 +1,138 @@
+import json
+import pytest
+from protocol import (
+    CODECS,
+    JSON,
+    Chat,
+    ErrorCode,
+    History,
+    Join,
+    ProtocolError,
+    ServerMessage,
+    codec_for_frame,
+    decode,
+    encode,
+    negotiate_codec,
+    transcode,
+    transcode_history,
+)
+
+
+class TestCodecs:
+    @pytest.mark.parametrize("codec", CODECS.values(), ids=CODECS.keys())
+    @pytest.mark.parametrize(
+        "message",
+        [
+            Join(username="USER", roomid="ROOMID", codecs=("msgpack", "cbor")),
+            Chat(message="Hello, wörld!", user="USER", id="1-0"),
+            History(messages=(Chat(message="Hello!", user="USER", id="1-0"),)),
+            ServerMessage(message="Joined ROOMID", version=1, codec="msgpack"),
+        ],
+    )
+    def test_messages_survive_a_round_trip_in_every_codec(self, codec, message):
+        # When
+        frame = encode(message, codec)
+
+        # Then - binary codecs produce bytes, to be sent as binary websocket frames
+        assert isinstance(frame, bytes) == codec.binary
+        assert decode(frame, codec=codec) == message
+        assert codec_for_frame(frame) is codec
+
+    def test_json_is_text(self):
+        assert codec_for_frame('{"type": "chat"}') is JSON
+        assert codec_for_frame(b'{"type": "chat"}') is JSON
+
+    @pytest.mark.parametrize("frame", [b"", b"\x00", b"[1, 2]"])
+    def test_frames_from_no_available_codec_are_refused(self, frame):
+        with pytest.raises(ValueError):
+            codec_for_frame(frame)
+
+    @pytest.mark.parametrize("name", ["msgpack", "cbor"])
+    def test_binary_codecs_refuse_text_frames(self, name):
+        # When & Then
+        with pytest.raises(ProtocolError) as error:
+            decode(
+                '{"type": "chat", "message": "Hello!", "user": "U"}', codec=CODECS[name]
+            )
+
+        assert error.value.code == ErrorCode.INVALID_FRAME
+
+    def test_frames_are_transcoded_between_codecs(self):
+        # Given
+        chat = Chat(message="Hello!", user="USER")
+        msgpack, cbor = CODECS["msgpack"], CODECS["cbor"]
+
+        # When & Then
+        assert decode(transcode(encode(chat, msgpack), cbor), codec=cbor) == chat
+        assert decode(transcode(encode(chat, cbor), JSON)) == chat
+        assert decode(transcode(encode(chat), msgpack), codec=msgpack) == chat
+
+    def test_frames_already_in_the_codec_are_passed_through(self):
+        # Given
+        frame = encode(Chat(message="Hello!", user="USER"))
+
+        # When & Then - JSON from Redis arrives as bytes, but is sent as text
+        assert transcode(frame.encode(), JSON) == frame
+        assert transcode(frame, JSON) is frame
+
+    def test_json_history_is_assembled_around_the_stored_frames(self):
+        # Given
+        frames = [b'{"id": "1-0", "message": "1"}', b'{"id": "2-0", "message": "2"}']
+
+        # When
+        frame = transcode_history(frames, JSON)
+
+        # Then
+        assert frame == (
+            '{"type": "history", "messages": [{"id": "1-0", "message": "1"}, '
+            '{"id": "2-0", "message": "2"}]}'
+        )
+        assert transcode_history(frames[:1], JSON, roomid="ROOM") == (
+            '{"type": "history", "roomid": "ROOM", "messages": '
+            '[{"id": "1-0", "message": "1"}]}'
+        )
+
+    @pytest.mark.parametrize("name", ["json", "msgpack", "cbor"])
+    def test_history_of_mixed_codecs_is_sent_in_one_codec(self, name):
+        # Given - messages stored by clients using different codecs
+        codec = CODECS[name]
+        chats = [
+            Chat(message=f"Message{i}", user="USER", id=f"{i}-0") for i in range(3)
+        ]
+        frames = [
+            encode(chats[0]).encode(),
+            encode(chats[1], CODECS["msgpack"]),
+            encode(chats[2], CODECS["cbor"]),
+        ]
+
+        # When
+        frame = transcode_history(frames, codec, roomid="ROOM")
+
+        # Then
+        assert decode(frame, codec=codec) == History(
+            messages=tuple(chats), roomid="ROOM"
+        )
+
+    def test_negotiates_the_first_available_codec_the_peer_prefers(self):
+        # When & Then
+        assert negotiate_codec(["unknown", "json"]) is JSON
+        assert negotiate_codec([]) is JSON
+        assert negotiate_codec(["unknown"]) is JSON
+
+        for name, codec in CODECS.items():
+            assert negotiate_codec(["unknown", name]) is codec
+
+    def test_joins_only_list_codecs_when_asking_for_one(self):
+        # When
+        event = json.loads(encode(Join(username="USER", roomid="ROOMID")))
+
+        # Then
+        assert "codecs" not in event
+        assert decode(encode(Join(username="U", roomid="R"))).codecs == ()
+
+    def test_join_codecs_must_be_names(self):
+        # When & Then
+        with pytest.raises(ProtocolError) as error:
+            decode('{"type": "join", "username": "U", "roomid": "R", "codecs": [1]}')
+
+        assert error.value.code == ErrorCode.INVALID_FIELD
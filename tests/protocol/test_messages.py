@@ -0,0 +1,180 @@
+import json
+import pytest
+from protocol import (
+    MIN_PROTOCOL_VERSION,
+    PROTOCOL_VERSION,
+    Chat,
+    Error,
+    ErrorCode,
+    History,
+    Join,
+    Leave,
+    ProtocolError,
+    ServerMessage,
+    decode,
+    encode,
+    negotiate_version,
+)
+
+
+class TestMessages:
+    @pytest.mark.parametrize(
+        "message",
+        [
+            Join(username="USER", roomid="ROOMID"),
+            Join(username="USER", roomid="ROOMID", last_id="1-0", version=2),
+            Chat(message="Hello!", user="USER"),
+            Chat(message="Hello!", user="USER", id="1-0"),
+            Chat(message="Hello!", user="USER", id="1-0", roomid="ROOMID"),
+            Leave(roomid="ROOMID"),
+            History(
+                messages=(
+                    Chat(message="Hello!", user="USER", id="1-0"),
+                    Chat(message="Hi!", user="OTHER", id="2-0"),
+                )
+            ),
+            History(messages=()),
+            History(messages=(), roomid="ROOMID"),
+            ServerMessage(message="Joined ROOMID"),
+            ServerMessage(message="Joined ROOMID", version=1),
+            ServerMessage(message="Left ROOMID", roomid="ROOMID"),
+            Error(code=ErrorCode.INVALID_FIELD, message="Bad chat"),
+            Error(code=ErrorCode.NOT_IN_ROOM, message="Bad chat", roomid="ROOMID"),
+        ],
+    )
+    def test_messages_survive_a_round_trip(self, message):
+        # When
+        decoded = decode(encode(message))
+
+        # Then
+        assert decoded == message
+        assert type(decoded) is type(message)
+
+    def test_frames_keep_the_wire_format_of_version_1(self):
+        # Given
+        join = Join(username="USER", roomid="ROOMID", version=MIN_PROTOCOL_VERSION)
+        chat = Chat(message="Hello!", user="USER")
+
+        # When & Then - optional fields that aren't set are left out
+        assert (
+            encode(join) == '{"type": "join", "username": "USER", "roomid": "ROOMID"}'
+        )
+        assert encode(chat) == '{"type": "chat", "message": "Hello!", "user": "USER"}'
+
+    def test_joins_without_a_version_are_from_version_1_clients(self):
+        # When
+        join = decode('{"type": "join", "username": "USER", "roomid": "ROOMID"}')
+
+        # Then
+        assert join.version == MIN_PROTOCOL_VERSION
+        assert join.last_id is None
+
+    def test_bytes_frames_are_decoded(self):
+        # When
+        chat = decode(b'{"type": "chat", "message": "Hello!", "user": "USER"}')
+
+        # Then
+        assert chat == Chat(message="Hello!", user="USER")
+
+    @pytest.mark.parametrize(
+        "frame, code",
+        [
+            ("not json", ErrorCode.INVALID_FRAME),
+            ('["type", "chat"]', ErrorCode.INVALID_FRAME),
+            ('{"message": "Hello!"}', ErrorCode.UNKNOWN_TYPE),
+            ('{"type": "disconnect"}', ErrorCode.UNKNOWN_TYPE),
+            ('{"type": "join", "username": "USER"}', ErrorCode.INVALID_FIELD),
+            (
+                '{"type": "join", "username": "", "roomid": "R"}',
+                ErrorCode.INVALID_FIELD,
+            ),
+            (
+                '{"type": "join", "username": "U", "roomid": "R", "version": true}',
+                ErrorCode.INVALID_FIELD,
+            ),
+            (
+                '{"type": "join", "username": "U", "roomid": "R", "last_id": 1}',
+                ErrorCode.INVALID_FIELD,
+            ),
+            (
+                '{"type": "join", "username": "U", "roomid": "R", "last_id": "garbage"}',
+                ErrorCode.INVALID_FIELD,
+            ),
+            (
+                '{"type": "join", "username": "U", "roomid": "R", "last_id": "1-0-"}',
+                ErrorCode.INVALID_FIELD,
+            ),
+            (
+                '{"type": "chat", "message": "Hello!", "user": 1}',
+                ErrorCode.INVALID_FIELD,
+            ),
+            ('{"type": "chat", "message": null, "user": "U"}', ErrorCode.INVALID_FIELD),
+            (
+                '{"type": "chat", "message": "Hi!", "user": "U", "roomid": 1}',
+                ErrorCode.INVALID_FIELD,
+            ),
+            ('{"type": "leave"}', ErrorCode.INVALID_FIELD),
+            ('{"type": "history", "messages": {}}', ErrorCode.INVALID_FIELD),
+            ('{"type": "history", "messages": ["Hello!"]}', ErrorCode.INVALID_FIELD),
+            (
+                '{"type": "history", "messages": [{"type": "chat", "message": "Hi!"}]}',
+                ErrorCode.INVALID_FIELD,
+            ),
+            ('{"type": "server_msg", "message": null}', ErrorCode.INVALID_FIELD),
+            ('{"type": "error", "message": "Bad chat"}', ErrorCode.INVALID_FIELD),
+        ],
+    )
+    def test_invalid_frames_raise_a_ProtocolError(self, frame, code):
+        # When & Then
+        with pytest.raises(ProtocolError) as error:
+            decode(frame)
+
+        assert error.value.code == code
+
+    def test_fields_are_not_checked_without_validation(self):
+        # When
+        chat = decode('{"type": "chat", "message": 42, "user": "USER"}', validate=False)
+
+        # Then
+        assert chat == Chat(message=42, user="USER")
+
+    def test_protocol_errors_become_error_messages(self):
+        # Given
+        error = ProtocolError(ErrorCode.UNKNOWN_TYPE, "Unknown message type 'shout'")
+
+        # When
+        frame = encode(error.to_message())
+
+        # Then
+        assert json.loads(frame) == {
+            "type": "error",
+            "code": "unknown_type",
+            "message": "Unknown message type 'shout'",
+        }
+
+    def test_protocol_errors_say_which_room_they_are_about(self):
+        # Given
+        error = ProtocolError(ErrorCode.NOT_IN_ROOM, "Not in ROOM", roomid="ROOM")
+
+        # When & Then
+        assert error.to_message() == Error(
+            code=ErrorCode.NOT_IN_ROOM, message="Not in ROOM", roomid="ROOM"
+        )
+
+    @pytest.mark.parametrize(
+        "version, expected",
+        [
+            (MIN_PROTOCOL_VERSION, MIN_PROTOCOL_VERSION),
+            (PROTOCOL_VERSION, PROTOCOL_VERSION),
+            (PROTOCOL_VERSION + 1, PROTOCOL_VERSION),
+        ],
+    )
+    def test_negotiates_the_newest_version_both_sides_speak(self, version, expected):
+        assert negotiate_version(version) == expected
+
+    def test_refuses_versions_older_than_it_understands(self):
+        # When & Then
+        with pytest.raises(ProtocolError) as error:
+            negotiate_version(MIN_PROTOCOL_VERSION - 1)
+
+        assert error.value.code == ErrorCode.UNSUPPORTED_VERSION
@@ -1,49 +1,274 @@
 from collections import deque
+import json
+import logging
 import pytest
-from unittest.mock import Mock, patch, call
+from unittest.mock import AsyncMock, Mock, call
 import websockets
-from server.lib import ChatClient
+from protocol import CODECS, Chat, History, Join, Leave, decode, encode
+from server.lib import ChatClient, RateLimit, RoomHub, metrics
+from server.lib.log import MESSAGE_LOGGER
 
 
 @pytest.mark.asyncio(scope="class")
 class TestChatClient:
     @pytest.fixture
-    @patch("server.lib.chat_client.redis.Redis")
-    def mock_chat_client(self, _):
+    def mock_chat_client(self):
         websocket = Mock(websockets.WebSocketServerProtocol)
-        chat_client = ChatClient("MOCK_USER", websocket)
+        hub = AsyncMock(RoomHub)
+        chat_client = ChatClient("MOCK_USER", websocket, hub)
 
         return chat_client
 
     async def test_chat_client_properties_exist(self, mock_chat_client):
         assert mock_chat_client.username == "MOCK_USER"
         assert mock_chat_client.websocket is not None
-        assert mock_chat_client.roomid is None
-        assert mock_chat_client._redis is not None
-        assert mock_chat_client._pubsub is not None
+        assert mock_chat_client.rooms == set()
+        assert mock_chat_client._hub is not None
 
-    async def test_chat_client_subscribes_to_redis_channel(self, mock_chat_client):
+    async def test_chat_client_subscribes_to_room_through_hub(self, mock_chat_client):
         # When
-        assert mock_chat_client.roomid is None
-        mock_chat_client.subscribe("MOCK_ROOMID")
+        assert mock_chat_client.rooms == set()
+        await mock_chat_client.subscribe("MOCK_ROOMID")
 
         # Then
-        mock_chat_client._pubsub.subscribe.assert_called_once_with("MOCK_ROOMID")
-        assert mock_chat_client.roomid == "MOCK_ROOMID"
+        mock_chat_client._hub.subscribe.assert_awaited_once_with(
+            "MOCK_ROOMID", mock_chat_client
+        )
+        assert mock_chat_client.rooms == {"MOCK_ROOMID"}
+
+    async def test_chat_client_can_leave_a_room_it_failed_to_subscribe_to(
+        self, mock_chat_client
+    ):
+        # Given - a hub that counts the client in but can't reach Redis
+        mock_chat_client._hub.subscribe.side_effect = ConnectionError()
+
+        # When
+        with pytest.raises(ConnectionError):
+            await mock_chat_client.subscribe("MOCK_ROOMID")
+
+        await mock_chat_client.unsubscribe()
+
+        # Then
+        mock_chat_client._hub.leave.assert_awaited_once_with(
+            ["MOCK_ROOMID"], mock_chat_client
+        )
+
+    async def test_chat_client_unsubscribes_from_room_through_hub(
+        self, mock_chat_client
+    ):
+        # Given
+        await mock_chat_client.subscribe("MOCK_ROOMID")
+        assert mock_chat_client.rooms == {"MOCK_ROOMID"}
+
+        # When
+        await mock_chat_client.unsubscribe()
+
+        # Then
+        mock_chat_client._hub.leave.assert_awaited_once_with(
+            ["MOCK_ROOMID"], mock_chat_client
+        )
+        assert mock_chat_client.rooms == set()
+
+    async def test_chat_client_leaves_one_room_or_every_room(self, mock_chat_client):
+        # Given
+        for roomid in ["ROOM1", "ROOM2", "ROOM3"]:
+            await mock_chat_client.subscribe(roomid)
+
+        # When
+        await mock_chat_client.unsubscribe("ROOM1")
+
+        # Then
+        mock_chat_client._hub.leave.assert_awaited_once_with(
+            ["ROOM1"], mock_chat_client
+        )
+        assert mock_chat_client.rooms == {"ROOM2", "ROOM3"}
+
+        # When
+        await mock_chat_client.unsubscribe()
+
+        # Then - the rest are left at once
+        [_, (rooms, _)] = [c.args for c in mock_chat_client._hub.leave.await_args_list]
+        assert sorted(rooms) == ["ROOM2", "ROOM3"]
+        assert mock_chat_client.rooms == set()
+
+    async def test_chat_client_joins_with_a_handshake_reply_then_history(
+        self, mock_chat_client
+    ):
+        # Given
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client.outbox = Mock()
+        mock_chat_client.send_history = AsyncMock()
+
+        # When
+        await mock_chat_client.join("MOCK_ROOMID", "1-0", handshake=True)
+
+        # Then - the reply says which version the server chose
+        mock_chat_client._hub.subscribe.assert_awaited_once_with(
+            "MOCK_ROOMID", mock_chat_client
+        )
+        mock_chat_client.websocket.send.assert_awaited_once_with(
+            '{"type": "server_msg", "message": "Joined MOCK_ROOMID", "version": 2, '
+            '"roomid": "MOCK_ROOMID"}'
+        )
+        mock_chat_client.send_history.assert_awaited_once_with("MOCK_ROOMID", "1-0")
+
+        # Live messages wait in the outbox until the client has caught up on the room's history
+        mock_chat_client.outbox.pause.assert_called_once()
+        mock_chat_client.outbox.resume.assert_called_once()
+
+    async def test_chat_client_joins_and_leaves_rooms_after_its_handshake(
+        self, mock_chat_client
+    ):
+        # Given
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client._hub.history.return_value = []
+        mock_chat_client.websocket.messages = deque(
+            [
+                '{"type": "join", "username": "USER", "roomid": "ROOM2"}',
+                '{"type": "leave", "roomid": "ROOM1"}',
+                '{"type": "leave", "roomid": "ROOM1"}',
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_chat_client.websocket.__aiter__ = mock_aiter
+        await mock_chat_client.subscribe("ROOM1")
+
+        # When
+        await mock_chat_client.publish_messages()
+
+        # Then - each is replied to, and leaving a room twice is refused
+        assert mock_chat_client.rooms == {"ROOM2"}
+        assert [
+            json.loads(c.args[0])
+            for c in mock_chat_client.websocket.send.await_args_list
+        ] == [
+            {"type": "server_msg", "message": "Joined ROOM2", "roomid": "ROOM2"},
+            {"type": "server_msg", "message": "Left ROOM1", "roomid": "ROOM1"},
+            {
+                "type": "error",
+                "code": "not_in_room",
+                "message": "You aren't in ROOM1",
+                "roomid": "ROOM1",
+            },
+        ]
+
+    async def test_chat_client_refuses_joins_that_resume_from_an_invalid_id(
+        self, mock_chat_client
+    ):
+        # Given
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client.websocket.messages = deque(
+            [
+                '{"type": "join", "username": "U", "roomid": "ROOM2", "last_id": "bad"}',
+                '{"type": "chat", "message": "Message1", "user": "USER"}',
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_chat_client.websocket.__aiter__ = mock_aiter
+        await mock_chat_client.subscribe("ROOM1")
+
+        # When
+        await mock_chat_client.publish_messages()
+
+        # Then - the join is refused without asking the hub, and the connection carries on
+        [error] = mock_chat_client.websocket.send.await_args_list
+        assert json.loads(error.args[0])["code"] == "invalid_field"
+        assert json.loads(error.args[0])["roomid"] == "ROOM2"
+        mock_chat_client._hub.history.assert_not_awaited()
+        mock_chat_client._hub.publish.assert_awaited_once()
+
+    async def test_chat_client_publishes_to_the_room_each_chat_is_for(
+        self, mock_chat_client
+    ):
+        # Given - a client in two rooms
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client.websocket.messages = deque(
+            [
+                '{"type": "chat", "message": "M1", "user": "U", "roomid": "ROOM2"}',
+                '{"type": "chat", "message": "M2", "user": "U"}',
+                '{"type": "chat", "message": "M3", "user": "U", "roomid": "ROOM3"}',
+            ]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
 
-    async def test_chat_client_unsubscribes_to_redis_channel(self, mock_chat_client):
+        mock_chat_client.websocket.__aiter__ = mock_aiter
+        await mock_chat_client.subscribe("ROOM1")
+        await mock_chat_client.subscribe("ROOM2")
+
+        # When
+        await mock_chat_client.publish_messages()
+
+        # Then - only the chat for a room it's in is published
+        mock_chat_client._hub.publish.assert_awaited_once_with(
+            "ROOM2",
+            '{"type": "chat", "message": "M1", "user": "U", "roomid": "ROOM2"}',
+        )
+        assert [
+            json.loads(c.args[0])["code"]
+            for c in mock_chat_client.websocket.send.await_args_list
+        ] == ["invalid_field", "not_in_room"]
+
+    async def test_chat_client_sends_room_history_as_one_batch(self, mock_chat_client):
+        # Given
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client._hub.history.return_value = [
+            '{"type": "chat", "message": "Message1", "user": "USER1"}',
+            '{"type": "chat", "message": "Message2", "user": "USER2"}',
+        ]
+
+        # When
+        await mock_chat_client.send_history("MOCK_ROOMID")
+
+        # Then
+        mock_chat_client._hub.history.assert_awaited_once_with(
+            "MOCK_ROOMID", after=None
+        )
+        frame = mock_chat_client.websocket.send.await_args.args[0]
+        assert json.loads(frame) == {
+            "type": "history",
+            "roomid": "MOCK_ROOMID",
+            "messages": [
+                {"type": "chat", "message": "Message1", "user": "USER1"},
+                {"type": "chat", "message": "Message2", "user": "USER2"},
+            ],
+        }
+
+    async def test_chat_client_resumes_history_after_last_seen_message(
+        self, mock_chat_client
+    ):
         # Given
-        mock_chat_client.subscribe("MOCK_ROOMID")
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client._hub.history.return_value = []
 
-        mock_chat_client._pubsub.subscribe.assert_called_once_with("MOCK_ROOMID")
-        assert mock_chat_client.roomid == "MOCK_ROOMID"
+        # When
+        await mock_chat_client.send_history("MOCK_ROOMID", "1-0")
+
+        # Then
+        mock_chat_client._hub.history.assert_awaited_once_with(
+            "MOCK_ROOMID", after="1-0"
+        )
+
+    async def test_chat_client_sends_nothing_without_history(self, mock_chat_client):
+        # Given
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client._hub.history.return_value = []
 
         # When
-        mock_chat_client.unsubscribe()
+        await mock_chat_client.send_history("MOCK_ROOMID")
 
         # Then
-        mock_chat_client._pubsub.unsubscribe.assert_called_once()
-        assert mock_chat_client.roomid is None
+        mock_chat_client.websocket.send.assert_not_awaited()
 
     async def test_chat_client_can_handle_publishing_messages_to_channel(
         self, mock_chat_client
@@ -64,43 +289,264 @@ class TestChatClient:
 
         # When
         roomid = "MOCK_ROOMID"
-        mock_chat_client.subscribe(roomid)
+        await mock_chat_client.subscribe(roomid)
+        await mock_chat_client.publish_messages()
+
+        # Then - each is tagged with its room
+        assert mock_chat_client._hub.publish.await_count == 3
+
+        calls = [
+            call(roomid, f'{m[:-1]}, "roomid": "{roomid}"}}') for m in [m1, m2, m3]
+        ]
+        mock_chat_client._hub.publish.assert_has_awaits(calls)
+
+    async def test_chat_client_publishes_chat_events_in_canonical_form(
+        self, mock_chat_client
+    ):
+        # Given - an event with unexpected fields and keys out of order
+        message = '{"user": "USER", "extra": 1, "message": "Message1", "type": "chat"}'
+        mock_chat_client.websocket.messages = deque([message])
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_chat_client.websocket.__aiter__ = mock_aiter
+
+        # When
+        await mock_chat_client.subscribe("MOCK_ROOMID")
         await mock_chat_client.publish_messages()
 
         # Then
-        assert mock_chat_client._redis.publish.call_count == 3
+        mock_chat_client._hub.publish.assert_awaited_once_with(
+            "MOCK_ROOMID",
+            '{"type": "chat", "message": "Message1", "user": "USER", '
+            '"roomid": "MOCK_ROOMID"}',
+        )
+
+    async def test_chat_client_speaks_the_codec_it_joined_with(self, mock_chat_client):
+        # Given - a client using MessagePack, and history stored by a JSON client
+        msgpack = CODECS["msgpack"]
+        mock_chat_client.codec = msgpack
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client.websocket.messages = deque(
+            [encode(Chat(message="Message2", user="USER"), msgpack)]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_chat_client.websocket.__aiter__ = mock_aiter
+        mock_chat_client._hub.history.return_value = [
+            b'{"id": "1-0", "type": "chat", "message": "Message1", "user": "USER1"}'
+        ]
+
+        # When
+        await mock_chat_client.subscribe("MOCK_ROOMID")
+        await mock_chat_client.send_history("MOCK_ROOMID")
+        await mock_chat_client.publish_messages()
+
+        # Then - the history is sent, and the chat published, in MessagePack
+        history = mock_chat_client.websocket.send.await_args.args[0]
+        assert decode(history, codec=msgpack) == History(
+            messages=(Chat(message="Message1", user="USER1", id="1-0"),),
+            roomid="MOCK_ROOMID",
+        )
 
-        calls = [call(roomid, m1), call(roomid, m2), call(roomid, m3)]
-        mock_chat_client._redis.publish.assert_has_calls(calls)
+        [roomid, published] = mock_chat_client._hub.publish.await_args.args
+        assert published == encode(
+            Chat(message="Message2", user="USER", roomid="MOCK_ROOMID"), msgpack
+        )
 
-    async def test_chat_client_can_receive_and_forward_messages_to_websocket(
-        self, mock_chat_client, monkeypatch
+    @pytest.mark.parametrize(
+        "frame, code",
+        [
+            ('{"type": "chat", "message": 42, "user": "USER"}', "invalid_field"),
+            ('{"type": "chat", "user": "USER"}', "invalid_field"),
+            ('{"type": "shout", "message": "Hi!"}', "unknown_type"),
+            ('{"type": "server_msg", "message": "Hi!"}', "unexpected_message"),
+            ("not json", "invalid_frame"),
+        ],
+    )
+    async def test_chat_client_replies_with_an_error_to_invalid_messages(
+        self, mock_chat_client, frame, code
     ):
+        # Given - an invalid message followed by a valid one
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client.websocket.messages = deque(
+            [frame, '{"type": "chat", "message": "Message1", "user": "USER"}']
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_chat_client.websocket.__aiter__ = mock_aiter
+        await mock_chat_client.subscribe("MOCK_ROOMID")
+
+        # When
+        await mock_chat_client.publish_messages()
+
+        # Then - the client is told why the invalid message was refused
+        [error] = mock_chat_client.websocket.send.await_args_list
+        assert json.loads(error.args[0])["type"] == "error"
+        assert json.loads(error.args[0])["code"] == code
+
+        # And the connection carries on with the valid message
+        mock_chat_client._hub.publish.assert_awaited_once()
+
+    @pytest.mark.parametrize("frame", [Join("U", "R"), Leave("R")])
+    async def test_chat_client_refuses_more_rooms_with_protocol_version_1(self, frame):
         # Given
-        chat_events = [
-            '{"type": "chat", "message": "Message1", "user": "USER"}',
-            '{"type": "chat", "message": "Message2", "user": "USER"}',
-            '{"type": "chat", "message": "Message3", "user": "USER"}',
-        ]
-        messages = [
-            {"type": "message", "data": chat_event} for chat_event in chat_events
-        ]
+        websocket = Mock(websockets.WebSocketServerProtocol, send=AsyncMock())
+        chat_client = ChatClient("USER", websocket, AsyncMock(RoomHub), version=1)
+        websocket.messages = deque([encode(frame)])
 
-        def generate_messages():
-            for m in messages:
-                yield m
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
 
-        message_iterator = generate_messages()
+        websocket.__aiter__ = mock_aiter
+        await chat_client.subscribe("MOCK_ROOMID")
 
-        monkeypatch.setattr(
-            mock_chat_client._pubsub, "get_message", lambda: next(message_iterator)
+        # When
+        await chat_client.publish_messages()
+
+        # Then
+        [error] = websocket.send.await_args_list
+        assert json.loads(error.args[0])["code"] == "unexpected_message"
+        assert chat_client.rooms == {"MOCK_ROOMID"}
+
+    async def test_chat_client_refuses_messages_over_its_rate_limit(self):
+        # Given - a client allowed two messages at once, that sends three
+        websocket = Mock(websockets.WebSocketServerProtocol, send=AsyncMock())
+        chat_client = ChatClient(
+            "USER", websocket, AsyncMock(RoomHub), rate_limit=RateLimit(0.001, 2)
         )
+        chat_client._hub.admit.return_value = True
+        message = '{"type": "chat", "message": "Message", "user": "USER"}'
+        websocket.messages = deque([message] * 3)
 
-        # When - our generator will raise a RuntimeError upon the StopIteration signal
-        with pytest.raises(RuntimeError):
-            await mock_chat_client.poll_messages()
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        websocket.__aiter__ = mock_aiter
+        await chat_client.subscribe("MOCK_ROOMID")
+        throttled = metrics.MESSAGES_THROTTLED.value
+
+        # When
+        await chat_client.publish_messages()
+
+        # Then - the third is refused with an error, without asking the room
+        assert chat_client._hub.publish.await_count == 2
+        assert chat_client._hub.admit.await_count == 2
+        [error] = websocket.send.await_args_list
+        assert json.loads(error.args[0])["code"] == "rate_limited"
+        assert metrics.MESSAGES_THROTTLED.value == throttled + 1
+
+    async def test_chat_client_counts_joins_and_leaves_against_its_rate_limit(self):
+        # Given - a client allowed two messages at once, that joins, leaves and joins again
+        websocket = Mock(websockets.WebSocketServerProtocol, send=AsyncMock())
+        hub = AsyncMock(RoomHub)
+        hub.history.return_value = []
+        chat_client = ChatClient("USER", websocket, hub, rate_limit=RateLimit(0.001, 2))
+        websocket.messages = deque(
+            [encode(Join("USER", "ROOM2")), encode(Leave("ROOM2"))]
+            + [encode(Join("USER", "ROOM3"))]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        websocket.__aiter__ = mock_aiter
+
+        # When
+        await chat_client.publish_messages()
+
+        # Then - the second join is refused
+        assert chat_client.rooms == set()
+        error = json.loads(websocket.send.await_args.args[0])
+        assert (error["code"], error["roomid"]) == ("rate_limited", "ROOM3")
+
+    async def test_chat_client_refuses_to_join_more_than_its_maximum_rooms(self):
+        # Given - a client in the one room it's allowed, that joins another
+        websocket = Mock(websockets.WebSocketServerProtocol, send=AsyncMock())
+        hub = AsyncMock(RoomHub)
+        hub.history.return_value = []
+        chat_client = ChatClient("USER", websocket, hub, max_rooms=1)
+        websocket.messages = deque(
+            [encode(Join("USER", "ROOM2")), encode(Join("USER", "ROOM1"))]
+        )
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        websocket.__aiter__ = mock_aiter
+        await chat_client.join("ROOM1", handshake=True)
+
+        # When
+        await chat_client.publish_messages()
+
+        # Then - it's refused, though rejoining its room is still allowed
+        assert chat_client.rooms == {"ROOM1"}
+        hub.subscribe.assert_awaited_with("ROOM1", chat_client)
+        assert hub.subscribe.await_count == 2
+        error = json.loads(websocket.send.await_args_list[1].args[0])
+        assert (error["code"], error["roomid"]) == ("too_many_rooms", "ROOM2")
+
+    async def test_chat_client_refuses_messages_over_the_rooms_rate_limit(
+        self, mock_chat_client
+    ):
+        # Given - a room that can take one more message
+        mock_chat_client.websocket.send = AsyncMock()
+        mock_chat_client._hub.admit.side_effect = [True, False]
+        message = '{"type": "chat", "message": "Message", "user": "USER"}'
+        mock_chat_client.websocket.messages = deque([message] * 2)
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_chat_client.websocket.__aiter__ = mock_aiter
+        await mock_chat_client.subscribe("MOCK_ROOMID")
+
+        # When
+        await mock_chat_client.publish_messages()
 
         # Then
-        assert mock_chat_client.websocket.send.call_count == 3
-        calls = [call(message["data"]) for message in messages]
-        mock_chat_client.websocket.send.assert_has_calls(calls)
+        mock_chat_client._hub.admit.assert_awaited_with("MOCK_ROOMID")
+        mock_chat_client._hub.publish.assert_awaited_once()
+        [error] = mock_chat_client.websocket.send.await_args_list
+        assert json.loads(error.args[0])["code"] == "rate_limited"
+        assert json.loads(error.args[0])["roomid"] == "MOCK_ROOMID"
+
+    async def test_chat_client_logs_chat_events_when_message_logging_is_enabled(
+        self, mock_chat_client, caplog
+    ):
+        # Given
+        message = '{"type": "chat", "message": "Message1", "user": "USER"}'
+        mock_chat_client.websocket.messages = deque([message])
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+        mock_chat_client.websocket.__aiter__ = mock_aiter
+        await mock_chat_client.subscribe("MOCK_ROOMID")
+
+        # When
+        with caplog.at_level(logging.INFO, logger=MESSAGE_LOGGER):
+            await mock_chat_client.publish_messages()
+
+        # Then
+        [record] = caplog.records
+        assert record.message == "Received chat event"
+        assert (record.roomid, record.user, record.text) == (
+            "MOCK_ROOMID",
+            "USER",
+            "Message1",
+        )
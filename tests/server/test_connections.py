@@ -0,0 +1,65 @@
+import pytest
+from unittest.mock import AsyncMock, Mock
+from server.lib import ChatClient, ConnectionRegistry, RoomHub, metrics
+
+
+@pytest.mark.asyncio(scope="class")
+class TestConnectionRegistry:
+    @pytest.fixture
+    def mock_hub(self):
+        hub = Mock(RoomHub)
+        hub.rooms = {}
+
+        return hub
+
+    async def test_serves_connections_until_they_are_torn_down(self, mock_hub):
+        # Given
+        connections = ConnectionRegistry(mock_hub)
+        client = Mock(ChatClient, unsubscribe=AsyncMock())
+        opened = metrics.CONNECTIONS_OPENED.value
+        closed = metrics.CONNECTIONS_CLOSED.value
+
+        # When
+        async with connections.serve(client):
+            # Then
+            assert client in connections
+            assert len(connections) == 1
+            assert list(connections) == [client]
+            client.unsubscribe.assert_not_awaited()
+
+        assert client not in connections
+        assert len(connections) == 0
+        client.unsubscribe.assert_awaited_once()
+        assert metrics.CONNECTIONS_OPENED.value == opened + 1
+        assert metrics.CONNECTIONS_CLOSED.value == closed + 1
+
+    @pytest.mark.parametrize("error", [ConnectionError, ValueError])
+    async def test_connections_leave_their_room_however_they_end(self, mock_hub, error):
+        # Given
+        connections = ConnectionRegistry(mock_hub)
+        client = Mock(ChatClient, unsubscribe=AsyncMock())
+
+        # When
+        with pytest.raises(error):
+            async with connections.serve(client):
+                raise error()
+
+        # Then
+        assert len(connections) == 0
+        client.unsubscribe.assert_awaited_once()
+
+    async def test_counts_clients_left_in_rooms_that_are_not_being_served(
+        self, mock_hub
+    ):
+        # Given - one client being served, and one its handler forgot about
+        connections = ConnectionRegistry(mock_hub)
+        served = Mock(ChatClient, unsubscribe=AsyncMock())
+        forgotten = Mock(ChatClient)
+        mock_hub.rooms = {"ROOM1": {served, forgotten}, "ROOM2": {forgotten}}
+
+        # When
+        async with connections.serve(served):
+            leaked = connections.leaked
+
+        # Then
+        assert leaked == 1
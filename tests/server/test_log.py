@@ -0,0 +1,138 @@
+import json
+import logging
+import sys
+import pytest
+from unittest.mock import patch
+from server.lib import configure_logging
+from server.lib.log import MESSAGE_LOGGER, JsonFormatter, SamplingFilter
+
+
+@pytest.fixture
+def restore_loggers():
+    # configure_logging changes process-wide loggers, which we'll put back after each test.
+    server_logger = logging.getLogger("server")
+    message_logger = logging.getLogger(MESSAGE_LOGGER)
+    saved = [
+        (logger, logger.level, list(logger.handlers), list(logger.filters))
+        for logger in (server_logger, message_logger)
+    ]
+
+    yield
+
+    for logger, level, handlers, filters in saved:
+        logger.setLevel(level)
+        logger.handlers = handlers
+        logger.filters = filters
+
+    server_logger.propagate = True
+
+
+class TestJsonFormatter:
+    def test_formats_records_as_json_with_extra_fields(self):
+        # Given
+        record = logging.LogRecord(
+            "server.test", logging.INFO, __file__, 1, "Hello %s", ("world",), None
+        )
+        record.roomid = "ROOM"
+
+        # When
+        entry = json.loads(JsonFormatter().format(record))
+
+        # Then
+        assert entry["level"] == "INFO"
+        assert entry["logger"] == "server.test"
+        assert entry["message"] == "Hello world"
+        assert entry["roomid"] == "ROOM"
+        assert "args" not in entry
+
+    def test_includes_exception_information(self):
+        # Given
+        try:
+            raise ValueError("Boom")
+        except ValueError:
+            record = logging.LogRecord(
+                "server.test", logging.ERROR, __file__, 1, "Failed", (), True
+            )
+            record.exc_info = sys.exc_info()
+
+        # When
+        entry = json.loads(JsonFormatter().format(record))
+
+        # Then
+        assert "ValueError: Boom" in entry["exc_info"]
+
+
+class TestSamplingFilter:
+    @patch("server.lib.log.random.random")
+    def test_lets_through_records_within_rate(self, mock_random):
+        # Given
+        sampling_filter = SamplingFilter(0.1)
+
+        # When & Then
+        mock_random.return_value = 0.05
+        assert sampling_filter.filter(None)
+
+        mock_random.return_value = 0.5
+        assert not sampling_filter.filter(None)
+
+
+class TestConfigureLogging:
+    def test_server_logs_go_through_a_queue_to_stderr_as_json(
+        self, restore_loggers, capsys
+    ):
+        # When
+        listener = configure_logging("DEBUG")
+        logging.getLogger("server.test").debug("Hello", extra={"roomid": "ROOM"})
+        listener.stop()
+
+        # Then
+        entry = json.loads(capsys.readouterr().err)
+        assert entry["message"] == "Hello"
+        assert entry["roomid"] == "ROOM"
+
+    def test_server_logs_keep_tracebacks_apart_from_messages(
+        self, restore_loggers, capsys
+    ):
+        # When
+        listener = configure_logging("DEBUG")
+
+        try:
+            raise ValueError("Boom")
+        except ValueError:
+            logging.getLogger("server.test").exception("Failed %s", "badly")
+
+        listener.stop()
+
+        # Then
+        entry = json.loads(capsys.readouterr().err)
+        assert entry["message"] == "Failed badly"
+        assert entry["exc_info"].startswith("Traceback")
+        assert entry["exc_info"].endswith("ValueError: Boom")
+
+    def test_message_logging_is_disabled_by_default(self, restore_loggers):
+        # When
+        listener = configure_logging("DEBUG")
+        listener.stop()
+
+        # Then
+        assert not logging.getLogger(MESSAGE_LOGGER).isEnabledFor(logging.INFO)
+
+    def test_message_logging_can_be_sampled(self, restore_loggers):
+        # When
+        listener = configure_logging("WARNING", message_sample_rate=0.1)
+        listener.stop()
+
+        # Then
+        message_logger = logging.getLogger(MESSAGE_LOGGER)
+        assert message_logger.isEnabledFor(logging.INFO)
+        assert [f.rate for f in message_logger.filters] == [0.1]
+
+    def test_all_messages_are_logged_at_full_rate(self, restore_loggers):
+        # When
+        listener = configure_logging(message_sample_rate=1)
+        listener.stop()
+
+        # Then
+        message_logger = logging.getLogger(MESSAGE_LOGGER)
+        assert message_logger.isEnabledFor(logging.INFO)
+        assert message_logger.filters == []
@@ -0,0 +1,106 @@
+import json
+import pytest
+from unittest.mock import Mock, patch
+from server.lib import MemoryBroker, RateLimit
+
+
+@pytest.mark.asyncio(scope="class")
+class TestMemoryBroker:
+    async def test_delivers_messages_to_the_rooms_subscriber_as_published(self):
+        # Given
+        broker = MemoryBroker()
+        deliver = Mock()
+        await broker.subscribe("ROOM", deliver)
+
+        # When
+        await broker.publish("ROOM", '{"m": 1}')
+        await broker.publish("OTHER_ROOM", '{"m": 2}')
+
+        # Then
+        deliver.assert_called_once_with("ROOM", '{"m": 1}')
+        assert broker.subscriptions == 1
+        assert broker.pending == 0
+
+    async def test_stops_delivering_once_unsubscribed(self):
+        # Given
+        broker = MemoryBroker()
+        deliver = Mock()
+        await broker.subscribe("ROOM", deliver)
+
+        # When
+        await broker.unsubscribe("ROOM")
+        await broker.unsubscribe("ROOM")
+        await broker.publish("ROOM", '{"m": 1}')
+
+        # Then
+        deliver.assert_not_called()
+        assert broker.subscriptions == 0
+
+        await broker.aclose()
+
+    async def test_keeps_recent_history_tagged_with_increasing_ids(self):
+        # Given - a clock that stands still, then goes back
+        broker = MemoryBroker(history_length=2)
+        deliver = Mock()
+        await broker.subscribe("ROOM", deliver)
+
+        # When
+        with patch("server.lib.memory_broker.time.time_ns", return_value=5_000_000):
+            await broker.publish("ROOM", '{"m": 1}')
+            await broker.publish("ROOM", '{"m": 2}')
+
+        with patch("server.lib.memory_broker.time.time_ns", return_value=4_000_000):
+            await broker.publish("ROOM", b'{"m": 3}')
+
+        # Then - only the most recent are kept, with the same IDs they were delivered with
+        assert await broker.history("ROOM") == [
+            '{"id": "5-1", "m": 2}',
+            b'{"id": "5-2", "m": 3}',
+        ]
+        assert deliver.call_args.args == ("ROOM", b'{"id": "5-2", "m": 3}')
+        assert await broker.history("OTHER_ROOM") == []
+
+    async def test_history_after_an_id_returns_only_later_frames(self):
+        # Given
+        broker = MemoryBroker(history_length=100)
+
+        for i in range(3):
+            await broker.publish("ROOM", json.dumps({"m": i}))
+
+        ids = [json.loads(frame)["id"] for frame in await broker.history("ROOM")]
+
+        # When & Then
+        assert await broker.history("ROOM", after=ids[0]) == [
+            f'{{"id": "{ids[1]}", "m": 1}}',
+            f'{{"id": "{ids[2]}", "m": 2}}',
+        ]
+        assert await broker.history("ROOM", after=ids[2]) == []
+
+        # And an ID that can't be from this broker is ignored
+        assert len(await broker.history("ROOM", after="not an ID")) == 3
+
+    async def test_keeps_no_history_by_default(self):
+        # Given
+        broker = MemoryBroker()
+
+        # When
+        await broker.publish("ROOM", '{"m": 1}')
+
+        # Then
+        assert await broker.history("ROOM") == []
+
+    async def test_limits_each_rooms_messages(self):
+        # Given
+        broker = MemoryBroker(room_rate_limit=RateLimit(rate=0.001, burst=2))
+        await broker.subscribe("ROOM", Mock())
+
+        # When & Then
+        assert [await broker.admit("ROOM") for _ in range(3)] == [True, True, False]
+        assert await broker.admit("OTHER_ROOM") is True
+
+        # And the limit is dropped with the room
+        await broker.unsubscribe("ROOM")
+        assert await broker.admit("ROOM") is True
+
+    async def test_admits_every_message_without_a_room_rate_limit(self):
+        assert await MemoryBroker().admit("ROOM") is True
@@ -0,0 +1,217 @@
+import asyncio
+import contextlib
+import pytest
+from unittest.mock import AsyncMock, Mock
+from server.lib import (
+    Broker,
+    ChatClient,
+    ConnectionRegistry,
+    RoomHub,
+    metrics,
+)
+from server.lib.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetricTypes:
+    def test_counter_counts_up(self):
+        # Given
+        counter = Counter("test_total", "A counter.")
+
+        # When
+        counter.inc()
+        counter.inc(2)
+
+        # Then
+        assert list(counter.samples()) == [("test_total", (), 3)]
+
+    def test_gauge_goes_up_and_down(self):
+        # Given
+        gauge = Gauge("test_gauge", "A gauge.")
+
+        # When
+        gauge.inc(5)
+        gauge.dec(2)
+
+        # Then
+        assert list(gauge.samples()) == [("test_gauge", (), 3)]
+
+        # When
+        gauge.set(10)
+
+        # Then
+        assert list(gauge.samples()) == [("test_gauge", (), 10)]
+
+    def test_gauge_can_be_computed_at_scrape_time(self):
+        # Given
+        gauge = Gauge("test_gauge", "A gauge.")
+        labelled_gauge = Gauge("test_labelled", "A labelled gauge.", ("room",))
+
+        # When
+        gauge.set_function(lambda: 42)
+        labelled_gauge.set_function(lambda: {("ROOM1",): 1, ("ROOM2",): 2})
+
+        # Then
+        assert list(gauge.samples()) == [("test_gauge", (), 42)]
+        assert list(labelled_gauge.samples()) == [
+            ("test_labelled", (("room", "ROOM1"),), 1),
+            ("test_labelled", (("room", "ROOM2"),), 2),
+        ]
+
+    def test_histogram_counts_observations_into_cumulative_buckets(self):
+        # Given
+        histogram = Histogram("test_seconds", "A histogram.", buckets=(0.1, 1.0))
+
+        # When
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        # Then
+        assert list(histogram.samples()) == [
+            ("test_seconds_bucket", (("le", "0.1"),), 2),
+            ("test_seconds_bucket", (("le", "1.0"),), 3),
+            ("test_seconds_bucket", (("le", "+Inf"),), 4),
+            ("test_seconds_sum", (), 5.65),
+            ("test_seconds_count", (), 4),
+        ]
+
+    def test_histogram_can_time_a_block(self):
+        # Given
+        histogram = Histogram("test_seconds", "A histogram.")
+
+        # When
+        with histogram.time():
+            pass
+
+        # Then
+        assert sum(histogram.counts) == 1
+
+
+class TestRegistry:
+    def test_renders_prometheus_text_format(self):
+        # Given
+        registry = Registry()
+        counter = registry.register(Counter("test_total", "A counter."))
+        gauge = registry.register(Gauge("test_gauge", "A gauge.", ("room",)))
+
+        counter.inc()
+        gauge.set_function(lambda: {('A "quoted" room',): 2})
+
+        # When
+        text = registry.render()
+
+        # Then
+        assert text == (
+            "# HELP test_total A counter.\n"
+            "# TYPE test_total counter\n"
+            "test_total 1.0\n"
+            "# HELP test_gauge A gauge.\n"
+            "# TYPE test_gauge gauge\n"
+            'test_gauge{room="A \\"quoted\\" room"} 2\n'
+        )
+
+
+@pytest.mark.asyncio(scope="class")
+class TestServerMetrics:
+    async def test_track_hub_reports_rooms_and_publish_queue_depth(self):
+        # Given
+        client1, client2, client3 = Mock(ChatClient), Mock(ChatClient), Mock(ChatClient)
+
+        hub = Mock(RoomHub)
+        hub.rooms = {"ROOM1": {client1, client2}, "ROOM2": {client1, client3}}
+        hub.broker = Mock(Broker, pending=7)
+        hub.subscriptions = 2
+
+        # When
+        metrics.track_hub(hub)
+
+        # Then
+        assert list(metrics.ROOM_CONNECTIONS.samples()) == [
+            ("chat_room_connections", (("room", "ROOM1"),), 2),
+            ("chat_room_connections", (("room", "ROOM2"),), 2),
+        ]
+        assert list(metrics.PUBLISH_QUEUE_DEPTH.samples()) == [
+            ("chat_publish_queue_depth", (), 7)
+        ]
+        assert list(metrics.REDIS_SUBSCRIPTIONS.samples()) == [
+            ("chat_redis_subscriptions", (), 2)
+        ]
+
+    async def test_track_connections_reports_connections_and_queue_depths(self):
+        # Given - three connections, one of which has left every room
+        hub = Mock(RoomHub)
+        connections = ConnectionRegistry(hub)
+        clients = [
+            Mock(ChatClient, outbox=[]),
+            Mock(ChatClient, outbox=["Frame1", "Frame2"]),
+            Mock(ChatClient, outbox=["Frame1"]),
+        ]
+        orphan = Mock(ChatClient)
+        hub.rooms = {"ROOM1": set(clients[:2]), "ROOM2": {clients[0], orphan}}
+
+        # When
+        metrics.track_connections(connections)
+
+        async with contextlib.AsyncExitStack() as stack:
+            for client in clients:
+                client.unsubscribe = AsyncMock()
+                await stack.enter_async_context(connections.serve(client))
+
+            # Then
+            assert list(metrics.CONNECTIONS.samples()) == [("chat_connections", (), 3)]
+            assert list(metrics.OUTBOUND_QUEUE_DEPTH.samples()) == [
+                ("chat_outbound_queue_depth", (), 3)
+            ]
+            assert list(metrics.CONNECTIONS_LEAKED.samples()) == [
+                ("chat_connections_leaked", (), 1)
+            ]
+
+    async def test_monitors_event_loop_lag(self):
+        # Given
+        count_before = sum(metrics.EVENT_LOOP_LAG.counts)
+
+        # When
+        monitor = asyncio.create_task(metrics.monitor_event_loop_lag(interval=0))
+        await asyncio.sleep(0.01)
+        monitor.cancel()
+
+        # Then
+        assert sum(metrics.EVENT_LOOP_LAG.counts) > count_before
+
+    async def test_serves_metrics_over_http(self):
+        # Given
+        server = await metrics.serve_metrics("localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def get(path):
+            reader, writer = await asyncio.open_connection("localhost", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+
+        # When
+        async with server:
+            metrics_response = await get("/metrics")
+            not_found_response = await get("/")
+
+        # Then
+        assert metrics_response.startswith("HTTP/1.1 200 OK\r\n")
+        assert metrics_response.endswith(metrics.REGISTRY.render())
+        assert not_found_response.startswith("HTTP/1.1 404 Not Found\r\n")
+
+    async def test_ignores_malformed_requests(self):
+        # Given
+        server = await metrics.serve_metrics("localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        # When
+        async with server:
+            reader, writer = await asyncio.open_connection("localhost", port)
+            writer.write(b"\r\n")
+            response = await reader.read()
+            writer.close()
+
+        # Then
+        assert response == b""
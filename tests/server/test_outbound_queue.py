@@ -0,0 +1,151 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, Mock
+import websockets
+from server.lib import OutboundLimits, OutboundQueue, SlowConsumerPolicy
+
+
+@pytest.fixture
+def mock_websocket():
+    websocket = Mock(websockets.WebSocketServerProtocol)
+    websocket.transport = Mock()
+    websocket.transport.get_write_buffer_size.return_value = 0
+    websocket.send = AsyncMock()
+    websocket.close = AsyncMock()
+
+    return websocket
+
+
+@pytest.mark.asyncio(scope="class")
+class TestOutboundQueue:
+    async def test_is_backlogged_once_socket_buffer_passes_high_water(
+        self, mock_websocket
+    ):
+        # Given
+        queue = OutboundQueue(mock_websocket, OutboundLimits(high_water=10))
+        assert not queue.backlogged
+
+        # When
+        mock_websocket.transport.get_write_buffer_size.return_value = 11
+
+        # Then
+        assert queue.backlogged
+
+    async def test_is_backlogged_while_frames_are_queued(self, mock_websocket):
+        # Given
+        queue = OutboundQueue(mock_websocket)
+
+        # When
+        queue.put("Message1")
+
+        # Then
+        assert queue.backlogged
+        assert len(queue) == 1
+        assert queue.size == len("Message1")
+
+    async def test_drain_sends_queued_frames_in_order(self, mock_websocket):
+        # Given
+        queue = OutboundQueue(mock_websocket)
+        queue.put("Message1")
+        queue.put("Message2")
+
+        # When
+        drain = asyncio.create_task(queue.drain())
+        await asyncio.sleep(0)
+
+        queue.put("Message3")
+        await asyncio.sleep(0)
+
+        # Then
+        assert [c.args[0] for c in mock_websocket.send.await_args_list] == [
+            "Message1",
+            "Message2",
+            "Message3",
+        ]
+        assert len(queue) == 0
+        assert queue.size == 0
+        assert not queue.backlogged
+
+        drain.cancel()
+
+    async def test_paused_queue_holds_frames_until_resumed(self, mock_websocket):
+        # Given
+        queue = OutboundQueue(mock_websocket)
+        drain = asyncio.create_task(queue.drain())
+
+        # When
+        queue.pause()
+        queue.put("Message1")
+        await asyncio.sleep(0)
+
+        # Then
+        assert queue.backlogged
+        mock_websocket.send.assert_not_awaited()
+
+        # When
+        queue.resume()
+        await asyncio.sleep(0)
+
+        # Then
+        mock_websocket.send.assert_awaited_once_with("Message1")
+        assert not queue.backlogged
+
+        drain.cancel()
+
+    async def test_drop_oldest_policy_keeps_most_recent_frames(self, mock_websocket):
+        # Given
+        limits = OutboundLimits(max_messages=2, policy=SlowConsumerPolicy.DROP_OLDEST)
+        queue = OutboundQueue(mock_websocket, limits)
+
+        # When
+        for i in range(5):
+            queue.put(f"Message{i}")
+
+        # Then
+        assert [frame for frame, _ in queue._frames] == ["Message3", "Message4"]
+        assert queue.dropped == 3
+
+    async def test_drop_oldest_policy_respects_byte_limit(self, mock_websocket):
+        # Given
+        limits = OutboundLimits(max_bytes=10, policy=SlowConsumerPolicy.DROP_OLDEST)
+        queue = OutboundQueue(mock_websocket, limits)
+
+        # When
+        queue.put("12345")
+        queue.put("67890")
+        queue.put("abc")
+
+        # Then
+        assert [frame for frame, _ in queue._frames] == ["67890", "abc"]
+        assert queue.size == 8
+        assert queue.dropped == 1
+
+    async def test_coalesce_policy_keeps_only_newest_frame(self, mock_websocket):
+        # Given
+        limits = OutboundLimits(max_messages=3, policy=SlowConsumerPolicy.COALESCE)
+        queue = OutboundQueue(mock_websocket, limits)
+
+        # When
+        for i in range(4):
+            queue.put(f"Message{i}")
+
+        # Then
+        assert [frame for frame, _ in queue._frames] == ["Message3"]
+        assert queue.dropped == 3
+
+    async def test_disconnect_policy_closes_the_connection(self, mock_websocket):
+        # Given
+        limits = OutboundLimits(max_messages=1, policy=SlowConsumerPolicy.DISCONNECT)
+        queue = OutboundQueue(mock_websocket, limits)
+
+        # When
+        queue.put("Message1")
+        queue.put("Message2")
+        queue.put("Message3")
+        await asyncio.sleep(0)
+
+        # Then
+        mock_websocket.close.assert_awaited_once_with(1008, "Slow consumer")
+        assert len(queue) == 0
+        assert queue.dropped == 3
+        assert queue.backlogged
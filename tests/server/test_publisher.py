@@ -0,0 +1,239 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, Mock, call
+from redis import RedisError
+from redis.exceptions import NoScriptError
+from protocol import CODECS, Chat, decode, encode
+from server.lib.publisher import Publisher, tag_frame
+
+
+@pytest.fixture
+def mock_redis():
+    mock_redis = MagicMock()
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+    mock_redis.pipeline.return_value.__aenter__.return_value = pipe
+    mock_redis.register_script.return_value = AsyncMock()
+
+    return mock_redis
+
+
+@pytest.mark.asyncio(scope="class")
+class TestPublisher:
+    async def test_publish_returns_without_waiting_for_redis(self, mock_redis):
+        # Given - a Redis that never responds
+        async def hang():
+            await asyncio.Event().wait()
+
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+        pipe.execute = AsyncMock(side_effect=hang)
+        publisher = Publisher(mock_redis)
+
+        # When - the first message is sent before the second is published
+        await asyncio.wait_for(publisher.publish("ROOM", "Message1"), timeout=1)
+        await asyncio.sleep(0)
+        await asyncio.wait_for(publisher.publish("ROOM", "Message2"), timeout=1)
+        await asyncio.sleep(0)
+
+        # Then - both returned, with the first message in flight and the second still queued
+        pipe.execute.assert_awaited_once()
+        assert publisher.pending == 1
+
+        await publisher.aclose()
+
+    async def test_queued_messages_are_published_as_one_pipelined_batch(
+        self, mock_redis
+    ):
+        # Given
+        publisher = Publisher(mock_redis)
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+
+        # When
+        await publisher.publish("ROOM1", "Message1")
+        await publisher.publish("ROOM2", "Message2")
+        await publisher.publish("ROOM1", "Message3")
+        await asyncio.sleep(0)
+
+        # Then
+        mock_redis.pipeline.assert_called_once_with(transaction=False)
+        pipe.publish.assert_has_calls(
+            [
+                call("ROOM1", "Message1"),
+                call("ROOM2", "Message2"),
+                call("ROOM1", "Message3"),
+            ]
+        )
+        pipe.execute.assert_awaited_once()
+        assert publisher.pending == 0
+
+        await publisher.aclose()
+
+    async def test_messages_are_added_to_room_history_when_enabled(self, mock_redis):
+        # Given
+        publisher = Publisher(mock_redis, history_length=50)
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+        publish_with_history = mock_redis.register_script.return_value
+
+        # When
+        await publisher.publish("ROOM", "Message1")
+        await asyncio.sleep(0)
+
+        # Then - the message is added to the history and published by the same script, in the
+        # same pipeline as the rest of the batch
+        publish_with_history.assert_awaited_once_with(
+            keys=["history:{ROOM}"],
+            args=["ROOM", "Message1", 50, "PUBLISH"],
+            client=pipe,
+        )
+        pipe.publish.assert_not_called()
+        pipe.execute.assert_awaited_once()
+
+        await publisher.aclose()
+
+    async def test_no_history_is_kept_by_default(self, mock_redis):
+        # Given
+        publisher = Publisher(mock_redis)
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+
+        # When
+        await publisher.publish("ROOM", "Message1")
+        await asyncio.sleep(0)
+
+        # Then
+        mock_redis.register_script.return_value.assert_not_awaited()
+        pipe.publish.assert_called_once_with("ROOM", "Message1")
+
+        await publisher.aclose()
+
+    async def test_batches_are_capped_at_max_batch(self, mock_redis):
+        # Given
+        publisher = Publisher(mock_redis, max_batch=2)
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+
+        # When
+        for i in range(5):
+            await publisher.publish("ROOM", f"Message{i}")
+
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+        # Then
+        assert pipe.publish.call_count == 5
+        assert pipe.execute.await_count == 3
+
+        await publisher.aclose()
+
+    async def test_publish_waits_once_queue_is_full(self, mock_redis):
+        # Given
+        publisher = Publisher(mock_redis, max_queued=1)
+        publisher._task = Mock(done=Mock(return_value=False))
+        await publisher.publish("ROOM", "Message1")
+
+        # When & Then
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(publisher.publish("ROOM", "Message2"), 0.01)
+
+    async def test_keeps_publishing_after_a_redis_error(self, mock_redis, caplog):
+        # Given
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+        pipe.execute = AsyncMock(side_effect=[RedisError("Boom"), None])
+        publisher = Publisher(mock_redis)
+
+        # When
+        await publisher.publish("ROOM", "Message1")
+        await asyncio.sleep(0)
+        await publisher.publish("ROOM", "Message2")
+        await asyncio.sleep(0)
+
+        # Then
+        assert pipe.execute.await_count == 2
+        [record] = caplog.records
+        assert record.message == "Failed to publish messages"
+        assert record.messages == 1
+        assert str(record.exc_info[1]) == "Boom"
+
+        await publisher.aclose()
+
+    async def test_publishes_to_shard_channels_in_a_cluster(self, mock_redis):
+        # Given
+        publisher = Publisher(mock_redis, cluster=True)
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+
+        # When
+        await publisher.publish("ROOM", "Message1")
+        await asyncio.sleep(0)
+
+        # Then
+        pipe.execute_command.assert_called_once_with("SPUBLISH", "{ROOM}", "Message1")
+        pipe.publish.assert_not_called()
+        mock_redis.script_load.assert_not_called()
+
+        await publisher.aclose()
+
+    async def test_loads_the_history_script_before_publishing_in_a_cluster(
+        self, mock_redis
+    ):
+        # Given
+        mock_redis.script_load = AsyncMock()
+        publisher = Publisher(mock_redis, history_length=50, cluster=True)
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+        publish_with_history = mock_redis.register_script.return_value
+
+        # When
+        await publisher.publish("ROOM", "Message1")
+        await asyncio.sleep(0)
+        await publisher.publish("ROOM", "Message2")
+        await asyncio.sleep(0)
+
+        # Then - the script is loaded once, and publishes to the room's shard channel
+        mock_redis.script_load.assert_awaited_once()
+        publish_with_history.assert_awaited_with(
+            keys=["history:{ROOM}"],
+            args=["{ROOM}", "Message2", 50, "SPUBLISH"],
+            client=pipe,
+        )
+
+        await publisher.aclose()
+
+    async def test_reloads_the_history_script_once_a_node_lacks_it(self, mock_redis):
+        # Given
+        mock_redis.script_load = AsyncMock()
+        pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+        pipe.execute = AsyncMock(side_effect=[NoScriptError("No script"), None])
+        publisher = Publisher(mock_redis, history_length=50, cluster=True)
+
+        # When
+        await publisher.publish("ROOM", "Message1")
+        await asyncio.sleep(0)
+        await publisher.publish("ROOM", "Message2")
+        await asyncio.sleep(0)
+
+        # Then
+        assert mock_redis.script_load.await_count == 2
+        assert pipe.execute.await_count == 2
+
+        await publisher.aclose()
+
+
+def test_tag_frame_adds_message_id_to_event():
+    # When
+    frame = tag_frame('{"type": "chat", "message": "Message1"}', "1-0")
+
+    # Then
+    assert frame == '{"id": "1-0", "type": "chat", "message": "Message1"}'
+
+
+@pytest.mark.parametrize("name", ["json", "msgpack", "cbor"])
+def test_tag_frame_adds_message_id_to_events_in_any_codec(name):
+    # Given - a frame as Redis returns it
+    codec = CODECS[name]
+    frame = encode(Chat(message="Message1", user="USER"), codec)
+    frame = frame if isinstance(frame, bytes) else frame.encode()
+
+    # When
+    tagged = tag_frame(frame, b"1700000000000-12345678901234567890")
+
+    # Then
+    assert decode(tagged, codec=codec) == Chat(
+        message="Message1", user="USER", id="1700000000000-12345678901234567890"
+    )
@@ -0,0 +1,75 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from redis import RedisError
+from server.lib.rate_limit import (
+    TAKE_TOKEN,
+    RateLimit,
+    RoomRateLimiter,
+    TokenBucket,
+    rate_limit_key,
+)
+
+
+class TestTokenBucket:
+    def test_allows_a_burst_then_refills_at_its_rate(self):
+        # Given
+        now = [0.0]
+        bucket = TokenBucket(RateLimit(rate=2, burst=3), clock=lambda: now[0])
+
+        # When & Then - the burst is available at once
+        assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+        # And a token comes back every half second
+        now[0] = 0.5
+        assert [bucket.take() for _ in range(2)] == [True, False]
+
+    def test_never_holds_more_than_its_burst(self):
+        # Given
+        now = [0.0]
+        bucket = TokenBucket(RateLimit(rate=10, burst=2), clock=lambda: now[0])
+
+        # When - left idle for long enough to refill many times over
+        now[0] = 60.0
+
+        # Then
+        assert [bucket.take() for _ in range(3)] == [True, True, False]
+
+
+@pytest.mark.asyncio(scope="class")
+class TestRoomRateLimiter:
+    @pytest.fixture
+    def mock_redis(self):
+        mock_redis = MagicMock()
+        mock_redis.register_script.return_value = AsyncMock(return_value=1)
+
+        return mock_redis
+
+    async def test_takes_tokens_from_the_rooms_bucket_in_redis(self, mock_redis):
+        # Given
+        limiter = RoomRateLimiter(mock_redis, RateLimit(rate=5, burst=20))
+        take_token = mock_redis.register_script.return_value
+
+        # When
+        taken = await limiter.take("ROOM")
+
+        # Then
+        mock_redis.register_script.assert_called_once_with(TAKE_TOKEN)
+        take_token.assert_awaited_once_with(keys=[rate_limit_key("ROOM")], args=[5, 20])
+        assert taken is True
+
+    async def test_refuses_messages_once_the_bucket_is_empty(self, mock_redis):
+        # Given
+        mock_redis.register_script.return_value.return_value = 0
+        limiter = RoomRateLimiter(mock_redis, RateLimit(rate=5, burst=20))
+
+        # When & Then
+        assert await limiter.take("ROOM") is False
+
+    async def test_lets_messages_through_when_redis_fails(self, mock_redis, caplog):
+        # Given
+        mock_redis.register_script.return_value.side_effect = RedisError()
+        limiter = RoomRateLimiter(mock_redis, RateLimit(rate=5, burst=20))
+
+        # When & Then
+        assert await limiter.take("ROOM") is True
+        assert "Failed to check room rate limit" in caplog.text
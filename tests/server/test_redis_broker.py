@@ -0,0 +1,261 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from redis import ConnectionError
+from redis.asyncio.client import PubSub
+from server.lib import RateLimit, RedisBroker
+from server.lib.publisher import Publisher
+from server.lib.rate_limit import RoomRateLimiter
+
+
+@pytest.mark.asyncio(scope="class")
+class TestRedisBroker:
+    @pytest.fixture
+    @patch("server.lib.redis_broker.redis.Redis")
+    def mock_broker(self, mock_redis):
+        mock_redis.return_value.aclose = AsyncMock()
+        mock_redis.return_value.pubsub.return_value = AsyncMock(PubSub)
+        mock_redis.return_value.pubsub.return_value.unsubscribe = AsyncMock()
+
+        return RedisBroker()
+
+    async def test_subscribes_and_unsubscribes_through_pubsub(self, mock_broker):
+        # When
+        await mock_broker.subscribe("ROOM", Mock())
+        await mock_broker.unsubscribe("ROOM")
+
+        # Then
+        mock_broker._pubsub.subscribe.assert_awaited_once_with("ROOM")
+        mock_broker._pubsub.unsubscribe.assert_awaited_once_with("ROOM")
+
+    async def test_counts_its_redis_subscriptions(self, mock_broker):
+        # Given
+        mock_broker._pubsub.channels = {b"ROOM1": None, b"ROOM2": None}
+
+        # When & Then
+        assert mock_broker.subscriptions == 2
+
+    async def test_pubsub_commands_never_run_concurrently(self, mock_broker):
+        # Given
+        running = 0
+        max_running = 0
+
+        async def mock_subscribe(*_):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0)
+            running -= 1
+
+        mock_broker._pubsub.subscribe = mock_subscribe
+
+        # When
+        await asyncio.gather(
+            *(mock_broker.subscribe(f"ROOM{i}", Mock()) for i in range(5))
+        )
+
+        # Then
+        assert max_running == 1
+
+    async def test_delivers_messages_to_the_rooms_subscriber(self, mock_broker):
+        # Given
+        deliver = Mock()
+        other_deliver = Mock()
+
+        messages = [
+            {"type": "message", "channel": b"ROOM", "data": b'{"m": 1}'},
+            {"type": "message", "channel": b"OTHER_ROOM", "data": b'{"m": 2}'},
+            {"type": "message", "channel": b"UNKNOWN_ROOM", "data": b'{"m": 3}'},
+        ]
+
+        async def mock_listen():
+            for m in messages:
+                yield m
+
+        mock_broker._pubsub.listen = mock_listen
+
+        # When
+        await mock_broker.subscribe("ROOM", deliver)
+        await mock_broker.subscribe("OTHER_ROOM", other_deliver)
+        await mock_broker._reader
+
+        # Then
+        deliver.assert_called_once_with("ROOM", b'{"m": 1}')
+        other_deliver.assert_called_once_with("OTHER_ROOM", b'{"m": 2}')
+
+    async def test_keeps_reading_after_losing_the_pubsub_connection(
+        self, mock_broker, caplog
+    ):
+        # Given - a pubsub whose connection drops twice before it can be read from again
+        mock_broker.RECONNECT_DELAY = 0
+        deliver = Mock()
+        listens = 0
+
+        async def mock_listen():
+            nonlocal listens
+            listens += 1
+
+            if listens < 3:
+                raise ConnectionError("Connection lost")
+
+            yield {"type": "message", "channel": b"ROOM", "data": b'{"m": 1}'}
+
+        mock_broker._pubsub.listen = mock_listen
+
+        # When
+        await mock_broker.subscribe("ROOM", deliver)
+        await mock_broker._reader
+
+        # Then - it's listened to again, and delivers what it's sent
+        deliver.assert_called_once_with("ROOM", b'{"m": 1}')
+        assert [record.message for record in caplog.records] == [
+            "Lost the pubsub connection"
+        ] * 2
+
+    async def test_keeps_reading_after_failing_to_deliver_a_message(
+        self, mock_broker, caplog
+    ):
+        # Given - a room sent something that isn't a frame, then a message
+        deliver = Mock(side_effect=[ValueError("Not a frame"), None])
+
+        async def mock_listen():
+            yield {"type": "message", "channel": b"ROOM", "data": b"not a frame"}
+            yield {"type": "message", "channel": b"ROOM", "data": b'{"m": 1}'}
+
+        mock_broker._pubsub.listen = mock_listen
+
+        # When
+        await mock_broker.subscribe("ROOM", deliver)
+        await mock_broker._reader
+
+        # Then - the failure's logged, and the message after it delivered
+        deliver.assert_called_with("ROOM", b'{"m": 1}')
+        assert [record.message for record in caplog.records] == [
+            "Failed to deliver a message"
+        ]
+
+    async def test_publishes_through_the_publisher(self, mock_broker):
+        # Given
+        mock_broker._publisher = AsyncMock(Publisher, pending=3)
+
+        # When
+        await mock_broker.publish("ROOM", "DATA")
+
+        # Then
+        mock_broker._publisher.publish.assert_awaited_once_with("ROOM", "DATA")
+        assert mock_broker.pending == 3
+
+    async def test_admits_every_message_without_a_room_rate_limit(self, mock_broker):
+        # When & Then
+        assert await mock_broker.admit("ROOM") is True
+
+    @patch("server.lib.redis_broker.redis.Redis")
+    async def test_admits_messages_within_the_room_rate_limit(self, _):
+        # Given
+        broker = RedisBroker(room_rate_limit=RateLimit(rate=5, burst=20))
+        broker._room_limiter = AsyncMock(RoomRateLimiter)
+        broker._room_limiter.take.return_value = False
+
+        # When
+        admitted = await broker.admit("ROOM")
+
+        # Then
+        broker._room_limiter.take.assert_awaited_once_with("ROOM")
+        assert admitted is False
+
+    async def test_history_returns_recent_frames_oldest_first(self, mock_broker):
+        # Given
+        mock_broker.history_length = 2
+        mock_broker._redis.xrevrange = AsyncMock(
+            return_value=[
+                (b"2-0", {b"frame": b'{"message": "Message2"}'}),
+                (b"1-0", {b"frame": b'{"message": "Message1"}'}),
+            ]
+        )
+
+        # When
+        frames = await mock_broker.history("ROOM")
+
+        # Then
+        mock_broker._redis.xrevrange.assert_awaited_once_with(
+            "history:{ROOM}", min="-", count=2
+        )
+        assert frames == [
+            b'{"id": "1-0", "message": "Message1"}',
+            b'{"id": "2-0", "message": "Message2"}',
+        ]
+
+    async def test_history_after_an_id_returns_only_later_frames(self, mock_broker):
+        # Given
+        mock_broker.history_length = 2
+        mock_broker._redis.xrevrange = AsyncMock(
+            return_value=[
+                (b"5-0", {b"frame": b'{"message": "Message5"}'}),
+                (b"4-0", {b"frame": b'{"message": "Message4"}'}),
+            ]
+        )
+
+        # When
+        frames = await mock_broker.history("ROOM", after="2-0")
+
+        # Then - the range excludes the message the client has already seen, and ends with the
+        # newest message, however many have been missed
+        mock_broker._redis.xrevrange.assert_awaited_once_with(
+            "history:{ROOM}", min="(2-0", count=2
+        )
+        assert frames == [
+            b'{"id": "4-0", "message": "Message4"}',
+            b'{"id": "5-0", "message": "Message5"}',
+        ]
+
+    async def test_history_is_empty_without_a_history_length(self, mock_broker):
+        # Given
+        mock_broker._redis.xrevrange = AsyncMock()
+
+        # When
+        frames = await mock_broker.history("ROOM")
+
+        # Then
+        assert frames == []
+        mock_broker._redis.xrevrange.assert_not_awaited()
+
+    async def test_aclose_stops_reader_and_closes_connections(self, mock_broker):
+        # Given
+        async def mock_listen():
+            await asyncio.Future()
+            yield
+
+        mock_broker._pubsub.listen = mock_listen
+        await mock_broker.subscribe("ROOM", Mock())
+        reader = mock_broker._reader
+
+        # When
+        await mock_broker.aclose()
+
+        # Then
+        with pytest.raises(asyncio.CancelledError):
+            await reader
+
+        mock_broker._pubsub.aclose.assert_awaited_once()
+        mock_broker._redis.aclose.assert_awaited_once()
+
+    @patch("server.lib.redis_broker.ShardedPubSub")
+    @patch("server.lib.redis_broker.redis.RedisCluster")
+    async def test_uses_a_shard_channel_per_room_in_a_cluster(self, _, mock_pubsub):
+        # Given
+        async def mock_listen():
+            yield {"channel": b"{ROOM}", "data": b'{"m": 1}'}
+
+        mock_pubsub.return_value = AsyncMock(listen=mock_listen)
+        broker = RedisBroker(cluster=True)
+        deliver = Mock()
+
+        # When
+        await broker.subscribe("ROOM", deliver)
+        await broker._reader
+        await broker.unsubscribe("ROOM")
+
+        # Then
+        broker._pubsub.subscribe.assert_awaited_once_with("{ROOM}")
+        broker._pubsub.unsubscribe.assert_awaited_once_with("{ROOM}")
+        deliver.assert_called_once_with("ROOM", b'{"m": 1}')
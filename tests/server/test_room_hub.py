@@ -0,0 +1,283 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from protocol import CODECS, JSON, Chat, decode, encode, transcode
+from server.lib import Broker, ChatClient, OutboundQueue, RedisBroker, RoomHub
+
+
+@pytest.mark.asyncio(scope="class")
+class TestRoomHub:
+    @pytest.fixture
+    def mock_hub(self):
+        return RoomHub(AsyncMock(Broker))
+
+    async def test_subscribes_to_each_room_once(self, mock_hub):
+        # Given
+        client1 = Mock(ChatClient)
+        client2 = Mock(ChatClient)
+
+        # When
+        await mock_hub.subscribe("ROOM", client1)
+        await mock_hub.subscribe("ROOM", client2)
+
+        # Then - the broker delivers the room's messages to the hub
+        mock_hub.broker.subscribe.assert_awaited_once_with("ROOM", mock_hub._fan_out)
+        assert mock_hub.members("ROOM") == {client1, client2}
+
+    async def test_every_joiner_waits_for_the_rooms_subscription(self, mock_hub):
+        # Given - a subscription that takes a while
+        subscribed = asyncio.Event()
+
+        async def subscribe(*_):
+            await subscribed.wait()
+
+        mock_hub.broker.subscribe.side_effect = subscribe
+        client1 = Mock(ChatClient)
+        client2 = Mock(ChatClient)
+
+        # When
+        joins = [
+            asyncio.create_task(mock_hub.subscribe("ROOM", client))
+            for client in (client1, client2)
+        ]
+        await asyncio.sleep(0)
+
+        # Then - neither has joined until it's been made
+        assert not any(join.done() for join in joins)
+
+        subscribed.set()
+        await asyncio.gather(*joins)
+        mock_hub.broker.subscribe.assert_awaited_once()
+        assert mock_hub.members("ROOM") == {client1, client2}
+
+    async def test_forgets_a_room_whose_subscription_failed(self, mock_hub):
+        # Given - a broker that can't reach Redis the first time
+        mock_hub.broker.subscribe.side_effect = [ConnectionError(), None]
+        client1 = Mock(ChatClient)
+        client2 = Mock(ChatClient)
+
+        # When
+        results = await asyncio.gather(
+            mock_hub.subscribe("ROOM", client1),
+            mock_hub.subscribe("ROOM", client2),
+            return_exceptions=True,
+        )
+
+        # Then - both joiners are told, and neither is left in the room
+        assert [type(result) for result in results] == [ConnectionError] * 2
+        assert mock_hub.rooms == {}
+
+        # And the next join subscribes again
+        await mock_hub.subscribe("ROOM", client1)
+        assert mock_hub.broker.subscribe.await_count == 2
+        assert mock_hub.members("ROOM") == {client1}
+
+    async def test_exposes_rooms_and_broker(self, mock_hub):
+        # Given
+        client = Mock(ChatClient)
+        mock_hub.broker.subscriptions = 1
+
+        # When
+        await mock_hub.subscribe("ROOM", client)
+
+        # Then
+        assert mock_hub.rooms == {"ROOM": {client}}
+        assert mock_hub.subscriptions == 1
+
+    @patch("server.lib.redis_broker.redis.Redis")
+    async def test_uses_redis_unless_given_a_broker(self, _):
+        assert isinstance(RoomHub().broker, RedisBroker)
+
+    async def test_unsubscribes_from_room_once_it_has_no_local_members(self, mock_hub):
+        # Given
+        client1 = Mock(ChatClient)
+        client2 = Mock(ChatClient)
+        await mock_hub.subscribe("ROOM", client1)
+        await mock_hub.subscribe("ROOM", client2)
+
+        # When
+        await mock_hub.unsubscribe("ROOM", client1)
+
+        # Then
+        mock_hub.broker.unsubscribe.assert_not_awaited()
+        assert mock_hub.members("ROOM") == {client2}
+
+        # When
+        await mock_hub.unsubscribe("ROOM", client2)
+        await mock_hub.unsubscribe("ROOM", client2)
+
+        # Then
+        mock_hub.broker.unsubscribe.assert_awaited_once_with("ROOM")
+        assert mock_hub.members("ROOM") == set()
+
+    async def test_leaves_every_room_even_if_unsubscribing_fails(
+        self, mock_hub, caplog
+    ):
+        # Given - a client in three rooms, and a broker that can't reach Redis
+        client = Mock(ChatClient)
+
+        for roomid in ["ROOM1", "ROOM2", "ROOM3"]:
+            await mock_hub.subscribe(roomid, client)
+
+        mock_hub.broker.unsubscribe.side_effect = ConnectionError()
+
+        # When
+        await mock_hub.leave(["ROOM1", "ROOM2", "ROOM3"], client)
+
+        # Then - every unsubscribe is tried, and each failure logged
+        assert mock_hub.rooms == {}
+        assert mock_hub.broker.unsubscribe.await_count == 3
+        assert [record.message for record in caplog.records] == [
+            "Failed to unsubscribe from a room"
+        ] * 3
+
+    async def test_publishes_through_the_broker(self, mock_hub):
+        # When
+        await mock_hub.publish("ROOM", "DATA")
+
+        # Then
+        mock_hub.broker.publish.assert_awaited_once_with("ROOM", "DATA")
+
+    async def test_admits_messages_within_the_brokers_room_rate_limit(self, mock_hub):
+        # Given
+        mock_hub.broker.admit.return_value = False
+
+        # When
+        admitted = await mock_hub.admit("ROOM")
+
+        # Then
+        mock_hub.broker.admit.assert_awaited_once_with("ROOM")
+        assert admitted is False
+
+    async def test_reads_history_from_the_broker(self, mock_hub):
+        # Given
+        mock_hub.broker.history.return_value = [b'{"id": "2-0", "message": "Message2"}']
+
+        # When
+        frames = await mock_hub.history("ROOM", after="1-0")
+
+        # Then
+        mock_hub.broker.history.assert_awaited_once_with("ROOM", after="1-0")
+        assert frames == [b'{"id": "2-0", "message": "Message2"}']
+
+    async def test_aclose_closes_the_broker(self, mock_hub):
+        # Given - a subscription still being made
+        async def subscribe(*_):
+            await asyncio.Event().wait()
+
+        mock_hub.broker.subscribe.side_effect = subscribe
+        join = asyncio.create_task(mock_hub.subscribe("ROOM", Mock(ChatClient)))
+        await asyncio.sleep(0)
+
+        # When
+        await mock_hub.aclose()
+
+        # Then
+        mock_hub.broker.aclose.assert_awaited_once()
+
+        with pytest.raises(asyncio.CancelledError):
+            await join
+
+        assert mock_hub.rooms == {}
+
+    @patch("server.lib.room_hub.websockets.broadcast")
+    async def test_broadcasts_messages_to_local_members_of_the_room(
+        self, mock_broadcast, mock_hub
+    ):
+        # Given
+        client1 = Mock(ChatClient)
+        client2 = Mock(ChatClient)
+        other_room_client = Mock(ChatClient)
+
+        for client in (client1, client2, other_room_client):
+            client.websocket = Mock()
+            client.outbox = Mock(OutboundQueue, backlogged=False)
+            client.codec = JSON
+
+        broadcasts = []
+        mock_broadcast.side_effect = lambda sockets, frame: broadcasts.append(
+            (set(sockets), frame)
+        )
+
+        await mock_hub.subscribe("ROOM", client1)
+        await mock_hub.subscribe("ROOM", client2)
+        await mock_hub.subscribe("OTHER_ROOM", other_room_client)
+
+        # When - the broker delivers a message for each room
+        mock_hub._fan_out("ROOM", b'{"m": 1}')
+        mock_hub._fan_out("OTHER_ROOM", b'{"m": 2}')
+        mock_hub._fan_out("UNKNOWN_ROOM", b'{"m": 3}')
+
+        # Then - each frame is handed over once for all of the room's sockets, as text
+        assert broadcasts == [
+            ({client1.websocket, client2.websocket}, '{"m": 1}'),
+            ({other_room_client.websocket}, '{"m": 2}'),
+        ]
+
+    @patch("server.lib.room_hub.websockets.broadcast")
+    async def test_queues_messages_for_members_that_have_fallen_behind(
+        self, mock_broadcast, mock_hub
+    ):
+        # Given
+        fast_client = Mock(ChatClient)
+        slow_client = Mock(ChatClient)
+
+        for client, backlogged in ((fast_client, False), (slow_client, True)):
+            client.websocket = Mock()
+            client.outbox = Mock(OutboundQueue, backlogged=backlogged)
+            client.codec = JSON
+
+        await mock_hub.subscribe("ROOM", fast_client)
+        await mock_hub.subscribe("ROOM", slow_client)
+
+        # When
+        mock_hub._fan_out("ROOM", b'{"m": 1}')
+
+        # Then
+        mock_broadcast.assert_called_once_with([fast_client.websocket], '{"m": 1}')
+        slow_client.outbox.put.assert_called_once_with('{"m": 1}')
+        fast_client.outbox.put.assert_not_called()
+
+    @patch("server.lib.room_hub.transcode", wraps=transcode)
+    @patch("server.lib.room_hub.websockets.broadcast")
+    async def test_transcodes_each_message_once_per_codec_in_the_room(
+        self, mock_broadcast, mock_transcode, mock_hub
+    ):
+        # Given - a room with clients using each codec, one of them behind
+        msgpack, cbor = CODECS["msgpack"], CODECS["cbor"]
+        clients = []
+
+        for codec, backlogged in (
+            (JSON, False),
+            (JSON, False),
+            (msgpack, False),
+            (msgpack, True),
+            (cbor, False),
+        ):
+            client = Mock(ChatClient, codec=codec)
+            client.websocket = Mock()
+            client.outbox = Mock(OutboundQueue, backlogged=backlogged)
+            clients.append(client)
+            await mock_hub.subscribe("ROOM", client)
+
+        chat = Chat(message="Hello!", user="USER")
+
+        # When - a message published by a MessagePack client arrives
+        mock_hub._fan_out("ROOM", encode(chat, msgpack))
+
+        # Then - it's encoded once for each codec, and each client gets it in its own
+        assert mock_transcode.call_count == 3
+
+        for client in clients:
+            if client.outbox.backlogged:
+                [frame] = client.outbox.put.call_args.args
+            else:
+                [frame] = [
+                    frame
+                    for sockets, frame in (
+                        c.args for c in mock_broadcast.call_args_list
+                    )
+                    if client.websocket in sockets
+                ]
+
+            assert decode(frame, codec=client.codec) == chat
@@ -1,47 +1,282 @@
+import asyncio
+import dataclasses
+import json
 import pytest
+from collections import deque
 from unittest.mock import AsyncMock, Mock, patch
+from redis.asyncio.client import PubSub
+from websockets import ConnectionClosedError, WebSocketServerProtocol
+from protocol import CODECS, JSON, PROTOCOL_VERSION
 from server import __main__ as server_module
-from server.lib import ChatClient
+from server.lib import (
+    BrokerKind,
+    ChatClient,
+    ConnectionRegistry,
+    MemoryBroker,
+    OutboundLimits,
+    RateLimit,
+    RedisBroker,
+    RoomHub,
+    ServerConfig,
+    SlowConsumerPolicy,
+)
 
 
 @pytest.mark.asyncio(scope="class")
 class TestServerModule:
+    @patch("server.__main__.configure_logging")
     @patch("server.__main__.asyncio.run")
     async def test_main_starts_server_in_event_loop(
-        self, mock_asyncio_run, monkeypatch
+        self, mock_asyncio_run, mock_configure_logging, monkeypatch
     ):
         # Given
         coro_func = AsyncMock()
         coro = coro_func()
 
-        monkeypatch.setattr(server_module, "start_server", lambda: coro)
+        monkeypatch.setattr(server_module, "start_server", lambda *_, **__: coro)
 
         # When
-        server_module.main()
+        server_module.main([])
 
         # Then
         mock_asyncio_run.assert_called_once_with(server_module.start_server())
 
+        # Logging is set up for the server's lifetime and flushed once it stops
+        mock_configure_logging.assert_called_once_with("INFO", 0.0)
+        mock_configure_logging.return_value.stop.assert_called_once()
+
+    @patch("server.__main__.serve")
+    async def test_main_builds_server_config_from_arguments(self, mock_serve):
+        # When
+        server_module.main(
+            [
+                "--max-outbound-messages",
+                "10",
+                "--max-outbound-bytes",
+                "2048",
+                "--slow-consumer-policy",
+                "disconnect",
+                "--metrics-port",
+                "9000",
+                "--log-level",
+                "DEBUG",
+                "--message-log-sample-rate",
+                "0.01",
+                "--history",
+                "100",
+                "--broker",
+                "memory",
+                "--connection-rate-limit",
+                "2.5",
+                "--room-rate-limit",
+                "50",
+                "--room-burst",
+                "200",
+                "--max-rooms",
+                "20",
+            ]
+        )
+
+        # Then
+        mock_serve.assert_called_once_with(
+            ServerConfig(
+                outbound_limits=OutboundLimits(
+                    max_messages=10,
+                    max_bytes=2048,
+                    policy=SlowConsumerPolicy.DISCONNECT,
+                ),
+                metrics_port=9000,
+                log_level="DEBUG",
+                message_log_sample_rate=0.01,
+                history_length=100,
+                broker=BrokerKind.MEMORY,
+                connection_rate_limit=RateLimit(rate=2.5, burst=10),
+                room_rate_limit=RateLimit(rate=50, burst=200),
+                max_rooms=20,
+            )
+        )
+
+    @patch("server.__main__.create_broker")
+    @patch("server.__main__.RoomHub")
     @patch("server.__main__.asyncio.Future", new_callable=AsyncMock)
     @patch("server.__main__.websockets.serve")
     async def test_start_server_starts_ws_server_and_awaits_indefinitely(
-        self, mock_websockets_serve, mock_asyncio_future
+        self, mock_websockets_serve, mock_asyncio_future, mock_room_hub, mock_broker
     ):
+        # Given
+        mock_room_hub.return_value.aclose = AsyncMock()
+
         # When
         await server_module.start_server()
 
         # Then
-        mock_websockets_serve.assert_called_once_with(
-            server_module.handler, server_module.HOST, server_module.PORT
-        )
+        mock_broker.assert_called_once_with(ServerConfig())
+        mock_room_hub.assert_called_once_with(mock_broker.return_value)
+        mock_websockets_serve.assert_called_once()
+        ws_handler, host, port = mock_websockets_serve.call_args.args
+        assert (host, port) == (server_module.HOST, server_module.PORT)
+        assert mock_websockets_serve.call_args.kwargs == {"reuse_port": False}
+
+        # Every connection is handled with the same, process-wide room hub and registry
+        assert ws_handler.func == server_module.handler
+        connections = ws_handler.keywords.pop("connections")
+        assert ws_handler.keywords == {
+            "hub": mock_room_hub.return_value,
+            "outbound_limits": OutboundLimits(),
+            "rate_limit": None,
+            "max_rooms": None,
+        }
+        assert isinstance(connections, ConnectionRegistry)
+
         assert mock_websockets_serve.return_value.__aenter__.called
         assert mock_asyncio_future.called
+        mock_room_hub.return_value.aclose.assert_awaited_once()
+
+    @patch("server.lib.redis_broker.redis.RedisCluster")
+    @patch("server.lib.redis_broker.redis.Redis")
+    async def test_creates_the_configured_broker(self, *_):
+        # Given
+        limit = RateLimit(rate=5, burst=20)
+        config = ServerConfig(history_length=10, room_rate_limit=limit)
+
+        # When
+        redis_broker = server_module.create_broker(config)
+        cluster_broker = server_module.create_broker(
+            dataclasses.replace(config, broker=BrokerKind.REDIS_CLUSTER)
+        )
+        memory_broker = server_module.create_broker(
+            dataclasses.replace(config, broker=BrokerKind.MEMORY)
+        )
+
+        # Then
+        assert isinstance(redis_broker, RedisBroker)
+        assert redis_broker.history_length == 10
+        assert redis_broker._room_limiter.limit == limit
+        assert redis_broker.cluster is False
+
+        assert isinstance(cluster_broker, RedisBroker)
+        assert cluster_broker.cluster is True
+
+        assert isinstance(memory_broker, MemoryBroker)
+        assert memory_broker.history_length == 10
+        assert memory_broker.room_rate_limit == limit
+
+    @patch("server.__main__.metrics")
+    @patch("server.__main__.RoomHub")
+    @patch("server.__main__.asyncio.Future", new_callable=AsyncMock)
+    @patch("server.__main__.websockets.serve")
+    async def test_start_server_serves_metrics_when_given_a_port(
+        self, mock_websockets_serve, mock_asyncio_future, mock_room_hub, mock_metrics
+    ):
+        # Given
+        mock_room_hub.return_value.aclose = AsyncMock()
+        mock_metrics.serve_metrics = AsyncMock()
+        mock_metrics.monitor_event_loop_lag = AsyncMock()
+
+        # When
+        await server_module.start_server(ServerConfig(metrics_port=9000))
+
+        # Then
+        mock_metrics.track_hub.assert_called_once_with(mock_room_hub.return_value)
+        mock_metrics.track_connections.assert_called_once()
+        mock_metrics.serve_metrics.assert_awaited_once_with(server_module.HOST, 9000)
+        metrics_server = mock_metrics.serve_metrics.return_value
+        assert metrics_server.__aenter__.called
+        assert metrics_server.__aexit__.called
+        mock_metrics.monitor_event_loop_lag.assert_called_once()
+
+    @patch("server.__main__.run_workers")
+    @patch("server.__main__.serve")
+    async def test_main_starts_worker_processes_when_asked_for_more_than_one(
+        self, mock_serve, mock_run_workers
+    ):
+        # When
+        server_module.main(["--workers", "4"])
+
+        # Then
+        mock_run_workers.assert_called_once_with(4, ServerConfig())
+        mock_serve.assert_not_called()
+
+    @pytest.mark.parametrize("workers", ["0", "-1", "many"])
+    async def test_main_rejects_invalid_worker_counts(self, workers):
+        # When & Then
+        with pytest.raises(SystemExit):
+            server_module.main(["--workers", workers])
+
+    async def test_main_refuses_workers_without_a_shared_broker(self):
+        # When & Then
+        with pytest.raises(SystemExit):
+            server_module.main(["--workers", "2", "--broker", "memory"])
+
+    @pytest.mark.parametrize("length", ["-1", "lots"])
+    async def test_main_rejects_invalid_history_lengths(self, length):
+        # When & Then
+        with pytest.raises(SystemExit):
+            server_module.main(["--history", length])
+
+    @pytest.mark.parametrize("rate", ["0", "-1", "nan", "often"])
+    async def test_main_rejects_invalid_rate_limits(self, rate):
+        # When & Then
+        with pytest.raises(SystemExit):
+            server_module.main(["--room-rate-limit", rate])
+
+    @patch("server.__main__.multiprocessing.Process")
+    async def test_run_workers_starts_and_joins_each_worker(self, mock_process):
+        # Given
+        mock_process.return_value.is_alive.return_value = False
+        config = ServerConfig(metrics_port=9000)
+
+        # When
+        server_module.run_workers(3, config)
+
+        # Then
+        assert mock_process.call_count == 3
+        for i, c in enumerate(mock_process.call_args_list):
+            assert c.kwargs == {
+                "target": server_module.run_worker,
+                "args": (config, i),
+                "name": f"chat-worker-{i}",
+            }
+
+        assert mock_process.return_value.start.call_count == 3
+        assert mock_process.return_value.join.call_count == 3
+        mock_process.return_value.terminate.assert_not_called()
+
+    @patch("server.__main__.multiprocessing.Process")
+    async def test_run_workers_terminates_workers_on_interrupt(self, mock_process):
+        # Given
+        mock_process.return_value.join.side_effect = KeyboardInterrupt
+        mock_process.return_value.is_alive.return_value = True
+
+        # When
+        with pytest.raises(KeyboardInterrupt):
+            server_module.run_workers(2, ServerConfig())
+
+        # Then
+        assert mock_process.return_value.terminate.call_count == 2
+
+    @patch("server.__main__.serve")
+    async def test_run_worker_serves_with_a_shared_port(self, mock_serve):
+        # When
+        server_module.run_worker(ServerConfig(), 2)
+
+        # Then
+        mock_serve.assert_called_once_with(ServerConfig(), reuse_port=True)
+
+    @patch("server.__main__.serve")
+    async def test_run_worker_serves_metrics_on_its_own_port(self, mock_serve):
+        # When
+        server_module.run_worker(ServerConfig(metrics_port=9000), 2)
+
+        # Then
+        mock_serve.assert_called_once_with(
+            ServerConfig(metrics_port=9002), reuse_port=True
+        )
 
     @patch("server.__main__.ChatClient")
     @patch("server.__main__.websockets.WebSocketServerProtocol")
-    @patch("server.__main__.asyncio.gather", new_callable=AsyncMock)
-    async def test_handler_subcribes_to_channel_and_awaits_sending_receiving_messages(
-        self, mock_asyncio_gather, mock_ws, mock_chat_client
+    async def test_handler_subcribes_to_channel_and_awaits_publishing_messages(
+        self, mock_ws, mock_chat_client
     ):
         # Given
         roomid = "MOCK_ROOMID"
@@ -49,47 +284,308 @@ class TestServerModule:
         join_client_event = (
             f'{{"type": "join", "roomid": "{roomid}", "username": "{username}"}}'
         )
-        join_server_event = f'{{"type": "server_msg", "message": "Joined {roomid}"}}'
 
-        # Let's replace the default client mock's websocket so we can assert on it in a
-        # straightforward way.
-        mock_chat_client.return_value.websocket = mock_ws
+        mock_chat_client.return_value.join = AsyncMock()
+        mock_chat_client.return_value.unsubscribe = AsyncMock()
+        mock_chat_client.return_value.publish_messages = AsyncMock()
+        mock_chat_client.return_value.outbox.drain = AsyncMock()
+        mock_hub = Mock(RoomHub)
 
         mock_ws.recv = AsyncMock(return_value=join_client_event)
         mock_ws.send = AsyncMock()
 
         # When
-        await server_module.handler(mock_ws)
+        await server_module.handler(mock_ws, mock_hub, ConnectionRegistry(mock_hub))
 
-        # Then
+        # Then - a client that doesn't say which version it speaks is spoken to in version 1
         assert mock_ws.recv.called
-        mock_chat_client.assert_called_once_with(username, mock_ws)
-        mock_ws.send.assert_called_once_with(join_server_event)
-        mock_asyncio_gather.assert_called_once_with(
-            mock_chat_client.return_value.publish_messages(),
-            mock_chat_client.return_value.poll_messages(),
+        mock_chat_client.assert_called_once_with(
+            username, mock_ws, mock_hub, OutboundLimits(), JSON, None, 1, None
         )
-        assert mock_chat_client.return_value.unsubscribe.called
+        mock_chat_client.return_value.join.assert_awaited_once_with(
+            roomid, None, handshake=True
+        )
+        mock_chat_client.return_value.publish_messages.assert_awaited_once()
+        mock_chat_client.return_value.outbox.drain.assert_called_once()
+        mock_chat_client.return_value.unsubscribe.assert_awaited_once()
 
+    @patch("server.__main__.ChatClient")
     @patch("server.__main__.websockets.WebSocketServerProtocol")
-    async def test_subscribe_to_channel_calls_client_subscribe_and_sends_ws_event(
-        self, mock_ws
+    async def test_handler_resumes_from_the_last_id_the_client_saw(
+        self, mock_ws, mock_chat_client
     ):
         # Given
-        roomid = "MOCK_ROOMID"
-        mock_chat_client_instance = Mock(ChatClient).return_value
-        mock_chat_client_instance.username = "MOCK_USER"
-        join_server_event = f'{{"type": "server_msg", "message": "Joined {roomid}"}}'
+        mock_ws.recv = AsyncMock(
+            return_value='{"type": "join", "roomid": "MOCK_ROOMID", '
+            '"username": "MOCK_USERNAME", "last_id": "1-0"}'
+        )
+        mock_chat_client.return_value.join = AsyncMock()
+        mock_chat_client.return_value.unsubscribe = AsyncMock()
+        mock_chat_client.return_value.publish_messages = AsyncMock()
+        mock_chat_client.return_value.outbox.drain = AsyncMock()
+        mock_hub = Mock(RoomHub)
 
-        # Let's replace the default client mock's websocket so we can assert on it in a
-        # straightforward way.
-        mock_chat_client_instance.websocket = mock_ws
+        # When
+        await server_module.handler(mock_ws, mock_hub, ConnectionRegistry(mock_hub))
 
+        # Then
+        mock_chat_client.return_value.join.assert_awaited_once_with(
+            "MOCK_ROOMID", "1-0", handshake=True
+        )
+
+    @pytest.mark.parametrize(
+        "frame, code",
+        [
+            ('{"type": "join", "roomid": "MOCK_ROOMID"}', "invalid_field"),
+            ('{"type": "join", "roomid": "", "username": "U"}', "invalid_field"),
+            ('{"type": "chat", "message": "Hi!", "user": "U"}', "unexpected_message"),
+            (
+                '{"type": "join", "roomid": "R", "username": "U", "version": 0}',
+                "unsupported_version",
+            ),
+            ("not json", "invalid_frame"),
+        ],
+    )
+    @patch("server.__main__.ChatClient")
+    @patch("server.__main__.websockets.WebSocketServerProtocol")
+    async def test_handler_refuses_connections_that_dont_start_with_a_valid_join(
+        self, mock_ws, mock_chat_client, frame, code
+    ):
+        # Given
+        mock_ws.recv = AsyncMock(return_value=frame)
         mock_ws.send = AsyncMock()
+        mock_hub = Mock(RoomHub)
 
         # When
-        await server_module.subscribe_to_channel(mock_chat_client_instance, roomid)
+        await server_module.handler(mock_ws, mock_hub, ConnectionRegistry(mock_hub))
+
+        # Then - the client is told why, and never joins a room
+        [reply] = mock_ws.send.await_args_list
+        assert json.loads(reply.args[0])["type"] == "error"
+        assert json.loads(reply.args[0])["code"] == code
+        mock_chat_client.assert_not_called()
+
+    @patch("server.__main__.websockets.WebSocketServerProtocol")
+    async def test_handler_uses_the_codec_the_client_prefers(self, mock_ws):
+        # Given
+        mock_ws.recv = AsyncMock(
+            return_value='{"type": "join", "roomid": "MOCK_ROOMID", '
+            '"username": "MOCK_USERNAME", "codecs": ["unknown", "msgpack"]}'
+        )
+        mock_ws.send = AsyncMock()
+
+        # The client leaves straight after joining
+        async def mock_aiter(self):
+            return
+            yield
+
+        mock_ws.__aiter__ = mock_aiter
+        mock_hub = AsyncMock(RoomHub)
+        mock_hub.history.return_value = []
+
+        # When
+        await server_module.handler(mock_ws, mock_hub, ConnectionRegistry(mock_hub))
+
+        # Then - the reply to the join, in JSON, names the codec
+        [reply] = [c.args[0] for c in mock_ws.send.await_args_list]
+        assert json.loads(reply)["codec"] == "msgpack"
+
+        [roomid, chat_client] = mock_hub.subscribe.await_args.args
+        assert chat_client.codec is CODECS["msgpack"]
+
+    @patch("server.__main__.ChatClient")
+    @patch("server.__main__.websockets.WebSocketServerProtocol")
+    async def test_handler_speaks_the_newest_version_both_sides_understand(
+        self, mock_ws, mock_chat_client
+    ):
+        # Given - a client newer than the server
+        mock_ws.recv = AsyncMock(
+            return_value='{"type": "join", "roomid": "MOCK_ROOMID", '
+            '"username": "MOCK_USERNAME", "version": 99}'
+        )
+        mock_chat_client.return_value.join = AsyncMock()
+        mock_chat_client.return_value.unsubscribe = AsyncMock()
+        mock_chat_client.return_value.publish_messages = AsyncMock()
+        mock_chat_client.return_value.outbox.drain = AsyncMock()
+        mock_hub = Mock(RoomHub)
+
+        # When
+        await server_module.handler(mock_ws, mock_hub, ConnectionRegistry(mock_hub))
 
         # Then
-        mock_chat_client_instance.subscribe.assert_called_once_with(roomid)
-        mock_ws.send.assert_called_once_with(join_server_event)
+        [*_, version, _] = mock_chat_client.call_args.args
+        assert version == PROTOCOL_VERSION
+
+
+@pytest.mark.asyncio(scope="class")
+class TestConnectionTeardown:
+    JOIN = '{"type": "join", "roomid": "ROOM", "username": "USER"}'
+
+    @pytest.fixture
+    @patch("server.lib.redis_broker.redis.Redis")
+    def hub(self, mock_redis):
+        mock_redis.return_value.aclose = AsyncMock()
+        mock_redis.return_value.pubsub.return_value = AsyncMock(PubSub)
+        mock_redis.return_value.pubsub.return_value.unsubscribe = AsyncMock()
+
+        hub = RoomHub()
+
+        async def mock_listen():
+            await asyncio.Future()
+            yield
+
+        hub.broker._pubsub.listen = mock_listen
+
+        return hub
+
+    def websocket(self, frames=(), until=None, error=None):
+        """A client that joins ROOM, sends `frames`, and then leaves once `until` is set, or at once.
+        It leaves without a closing handshake if given an `error` to raise."""
+        websocket = Mock(WebSocketServerProtocol)
+        websocket.recv = AsyncMock(return_value=self.JOIN)
+        websocket.send = AsyncMock()
+        websocket.messages = deque(frames)
+
+        async def mock_aiter(self):
+            while len(self.messages):
+                yield self.messages.popleft()
+
+            if until is not None:
+                await until.wait()
+
+            if error is not None:
+                raise error
+
+        websocket.__aiter__ = mock_aiter
+
+        return websocket
+
+    @pytest.mark.parametrize(
+        "error", [None, ConnectionClosedError(None, None)], ids=["clean", "abnormal"]
+    )
+    async def test_departed_clients_leave_nothing_behind(self, hub, error):
+        # Given - many clients in a room at once
+        connections = ConnectionRegistry(hub)
+        leave = asyncio.Event()
+        chat = '{"type": "chat", "message": "Hello!", "user": "USER"}'
+
+        handlers = [
+            asyncio.create_task(
+                server_module.handler(
+                    self.websocket([chat], until=leave, error=error), hub, connections
+                )
+            )
+            for _ in range(100)
+        ]
+        await asyncio.sleep(0.01)
+
+        assert len(connections) == 100
+        assert len(hub.members("ROOM")) == 100
+
+        # When they all leave, however they go
+        leave.set()
+        await asyncio.gather(*handlers)
+
+        # Then - the server holds nothing for them, and has left the room in Redis
+        assert len(connections) == 0
+        assert connections.leaked == 0
+        assert hub.rooms == {}
+        hub.broker._pubsub.unsubscribe.assert_awaited_once_with("ROOM")
+
+        await hub.aclose()
+
+    @patch(
+        "server.lib.outbound_queue.OutboundQueue.drain",
+        new_callable=AsyncMock,
+        side_effect=ConnectionClosedError(None, None),
+    )
+    async def test_a_client_that_cannot_be_sent_to_stops_being_read(self, _, hub):
+        # Given - a client that never leaves, but whose socket fails
+        connections = ConnectionRegistry(hub)
+        websocket = self.websocket(until=asyncio.Event())
+
+        # When
+        await asyncio.wait_for(
+            server_module.handler(websocket, hub, connections), timeout=1
+        )
+
+        # Then
+        assert len(connections) == 0
+        assert hub.rooms == {}
+
+        await hub.aclose()
+
+    async def test_clients_that_drop_while_joining_leave_the_room(self, hub):
+        # Given
+        connections = ConnectionRegistry(hub)
+        websocket = self.websocket()
+        websocket.send = AsyncMock(side_effect=ConnectionClosedError(None, None))
+
+        # When
+        await server_module.handler(websocket, hub, connections)
+
+        # Then
+        assert len(connections) == 0
+        assert hub.rooms == {}
+
+        await hub.aclose()
+
+    async def test_clients_in_several_rooms_leave_every_one(self, hub):
+        # Given - a client that joins two more rooms over its connection, then leaves one of them
+        connections = ConnectionRegistry(hub)
+        leave = asyncio.Event()
+        websocket = self.websocket(
+            [
+                '{"type": "join", "roomid": "ROOM2", "username": "USER"}',
+                '{"type": "join", "roomid": "ROOM3", "username": "USER"}',
+                '{"type": "leave", "roomid": "ROOM3"}',
+            ],
+            until=leave,
+        )
+        websocket.recv.return_value = (
+            '{"type": "join", "roomid": "ROOM", "username": "USER", "version": 2}'
+        )
+        handler = asyncio.create_task(
+            server_module.handler(websocket, hub, connections)
+        )
+        await asyncio.sleep(0.01)
+
+        assert len(connections) == 1
+        assert set(hub.rooms) == {"ROOM", "ROOM2"}
+
+        # When
+        leave.set()
+        await handler
+
+        # Then
+        assert hub.rooms == {}
+        assert {c.args[0] for c in hub.broker._pubsub.unsubscribe.await_args_list} == {
+            "ROOM",
+            "ROOM2",
+            "ROOM3",
+        }
+
+        await hub.aclose()
+
+    async def test_cancelled_handlers_leave_the_room(self, hub):
+        # Given
+        connections = ConnectionRegistry(hub)
+        handler = asyncio.create_task(
+            server_module.handler(
+                self.websocket(until=asyncio.Event()), hub, connections
+            )
+        )
+        await asyncio.sleep(0.01)
+        assert len(connections) == 1
+
+        # When
+        handler.cancel()
+
+        # Then
+        with pytest.raises(asyncio.CancelledError):
+            await handler
+
+        assert len(connections) == 0
+        assert hub.rooms == {}
+
+        await hub.aclose()
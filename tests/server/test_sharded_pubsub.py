@@ -0,0 +1,299 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, Mock, call, patch
+from redis import ConnectionError, ResponseError
+from server.lib import sharded_pubsub
+from server.lib.sharded_pubsub import ShardedPubSub
+
+
+def mock_node(name, **connection_kwargs):
+    node = Mock(host=name, port=6379)
+    # A Mock's own name is given to its constructor, not set as an attribute
+    node.name = name
+    node.connection_kwargs = {"host": name, "port": 6379, **connection_kwargs}
+    # Connects with whatever Connection is patched to when it does
+    node.connection_class = lambda **kwargs: sharded_pubsub.Connection(**kwargs)
+
+    return node
+
+
+@pytest.fixture
+def mock_cluster():
+    mock_cluster = MagicMock()
+    mock_cluster.initialize = AsyncMock()
+    mock_cluster.nodes_manager.initialize = AsyncMock()
+    mock_cluster.get_node_from_key.return_value = mock_node("NODE1")
+
+    return mock_cluster
+
+
+@pytest.fixture
+def mock_connection():
+    with patch("server.lib.sharded_pubsub.Connection") as mock_connection:
+        # Every connection made is a new one, that pushes nothing until told to
+        def connect(**_):
+            connection = AsyncMock()
+            connection.pushes = asyncio.Queue()
+
+            async def read_response(**_):
+                push = await connection.pushes.get()
+
+                if isinstance(push, Exception):
+                    raise push
+
+                return push
+
+            connection.read_response = read_response
+            return connection
+
+        mock_connection.side_effect = connect
+        yield mock_connection
+
+
+@pytest.mark.asyncio(scope="class")
+class TestShardedPubSub:
+    async def test_subscribes_to_each_channel_on_the_node_owning_it(
+        self, mock_cluster, mock_connection
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        mock_cluster.get_node_from_key.side_effect = [
+            mock_node("NODE1"),
+            mock_node("NODE2"),
+            mock_node("NODE1"),
+        ]
+
+        # When
+        await pubsub.subscribe("{ROOM1}")
+        await pubsub.subscribe("{ROOM2}")
+        await pubsub.subscribe("{ROOM3}")
+
+        # Then - one connection per node
+        assert mock_connection.call_args_list == [
+            call(host="NODE1", port=6379),
+            call(host="NODE2", port=6379),
+        ]
+        assert len(pubsub.channels) == 3
+
+        node1 = pubsub.channels["{ROOM1}"].connection
+        assert node1.send_command.await_args_list == [
+            call("SSUBSCRIBE", "{ROOM1}", check_health=False),
+            call("SSUBSCRIBE", "{ROOM3}", check_health=False),
+        ]
+
+        await pubsub.aclose()
+
+    async def test_connects_to_a_node_with_the_clusters_credentials(
+        self, mock_cluster, mock_connection
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        mock_cluster.get_node_from_key.return_value = mock_node(
+            "NODE1", username="USER", password="PASSWORD"
+        )
+
+        # When
+        await pubsub.subscribe("{ROOM}")
+
+        # Then
+        mock_connection.assert_called_once_with(
+            host="NODE1", port=6379, username="USER", password="PASSWORD"
+        )
+
+        await pubsub.aclose()
+
+    async def test_unsubscribes_and_closes_connections_left_idle(
+        self, mock_cluster, mock_connection
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        await pubsub.subscribe("{ROOM1}")
+        await pubsub.subscribe("{ROOM2}")
+        connection = pubsub.channels["{ROOM1}"].connection
+
+        # When
+        await pubsub.unsubscribe("{ROOM1}")
+        await pubsub.unsubscribe("{ROOM2}")
+        await pubsub.unsubscribe("{ROOM2}")
+
+        # Then - the last channel is left by closing the connection
+        connection.send_command.assert_awaited_with(
+            "SUNSUBSCRIBE", "{ROOM1}", check_health=False
+        )
+        connection.disconnect.assert_awaited_once()
+        assert pubsub.channels == {}
+
+    async def test_listen_yields_messages_from_every_node(
+        self, mock_cluster, mock_connection
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        mock_cluster.get_node_from_key.side_effect = [
+            mock_node("NODE1"),
+            mock_node("NODE2"),
+        ]
+        await pubsub.subscribe("{ROOM1}")
+        await pubsub.subscribe("{ROOM2}")
+
+        # When
+        for channel, push in [
+            ("{ROOM1}", [b"ssubscribe", b"{ROOM1}", 1]),
+            ("{ROOM1}", [b"smessage", b"{ROOM1}", b'{"m": 1}']),
+            ("{ROOM2}", [b"smessage", b"{ROOM2}", b'{"m": 2}']),
+        ]:
+            pubsub.channels[channel].connection.pushes.put_nowait(push)
+
+        messages = pubsub.listen()
+
+        # Then
+        assert await anext(messages) == {"channel": b"{ROOM1}", "data": b'{"m": 1}'}
+        assert await anext(messages) == {"channel": b"{ROOM2}", "data": b'{"m": 2}'}
+
+        await pubsub.aclose()
+
+    async def test_resubscribes_to_a_channel_whose_slot_has_moved(
+        self, mock_cluster, mock_connection
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        await pubsub.subscribe("{ROOM}")
+        old_connection = pubsub.channels["{ROOM}"].connection
+        mock_cluster.get_node_from_key.return_value = mock_node("NODE2")
+
+        # When - the old owner unsubscribes us without being asked to
+        old_connection.pushes.put_nowait([b"sunsubscribe", b"{ROOM}", 0])
+        await asyncio.sleep(0)
+        await asyncio.gather(*pubsub._resubscribing)
+
+        # Then - it's subscribed to on the new owner, and the old connection is closed
+        mock_cluster.nodes_manager.initialize.assert_awaited_once()
+        new_connection = pubsub.channels["{ROOM}"].connection
+        assert new_connection is not old_connection
+        new_connection.send_command.assert_awaited_once_with(
+            "SSUBSCRIBE", "{ROOM}", check_health=False
+        )
+        old_connection.disconnect.assert_awaited_once()
+
+        await pubsub.aclose()
+
+    async def test_resubscribes_every_channel_of_a_lost_connection(
+        self, mock_cluster, mock_connection, caplog
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        pubsub.RESUBSCRIBE_DELAY = 0
+        await pubsub.subscribe("{ROOM1}")
+        await pubsub.subscribe("{ROOM2}")
+        lost_connection = pubsub.channels["{ROOM1}"].connection
+
+        # The cluster can't be reached at first
+        mock_cluster.nodes_manager.initialize.side_effect = [
+            ConnectionError("Boom"),
+            None,
+        ]
+
+        # When
+        lost_connection.pushes.put_nowait(ConnectionError("Connection lost"))
+        await asyncio.sleep(0)
+        await asyncio.gather(*pubsub._resubscribing)
+
+        # Then
+        new_connection = pubsub.channels["{ROOM1}"].connection
+        assert pubsub.channels["{ROOM2}"].connection is new_connection
+        assert new_connection.send_command.await_count == 2
+        assert [record.message for record in caplog.records] == [
+            "Lost a shard's pubsub connection",
+            "Failed to resubscribe to shards",
+        ]
+
+        await pubsub.aclose()
+
+    async def test_retries_subscriptions_a_node_refused(
+        self, mock_cluster, mock_connection
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        pubsub.RESUBSCRIBE_DELAY = 0
+        await pubsub.subscribe("{ROOM}")
+        connection = pubsub.channels["{ROOM}"].connection
+
+        # When
+        connection.pushes.put_nowait(ResponseError("MOVED 1234 NODE2:6379"))
+        await asyncio.sleep(0)
+        await asyncio.gather(*pubsub._resubscribing)
+
+        # Then - the node still owns the slot, so it's asked again
+        assert connection.send_command.await_count == 2
+        assert pubsub.channels["{ROOM}"].connection is connection
+
+        await pubsub.aclose()
+
+    async def test_backs_off_while_a_node_keeps_refusing_subscriptions(
+        self, mock_cluster, mock_connection, caplog
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        pubsub.RESUBSCRIBE_DELAY = 0.001
+        await pubsub.subscribe("{ROOM}")
+        connection = pubsub.channels["{ROOM}"].connection
+
+        # When - it's refused twice, then accepted, then refused again
+        for push in [
+            ResponseError("MOVED 1234 NODE2:6379"),
+            ResponseError("TRYAGAIN Multiple keys request during rehashing of slot"),
+            [b"ssubscribe", b"{ROOM}", 1],
+            ResponseError("ASK 1234 NODE2:6379"),
+        ]:
+            connection.pushes.put_nowait(push)
+            await asyncio.sleep(0)
+            await asyncio.gather(*pubsub._resubscribing)
+
+        # Then - the delay doubles until a subscription's accepted
+        assert [record.retry_in for record in caplog.records] == [0.001, 0.002, 0.001]
+        assert connection.send_command.await_count == 4
+
+        await pubsub.aclose()
+
+    async def test_doesnt_retry_subscriptions_refused_for_other_reasons(
+        self, mock_cluster, mock_connection, caplog
+    ):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        pubsub.RESUBSCRIBE_DELAY = 0
+        await pubsub.subscribe("{ROOM}")
+        connection = pubsub.channels["{ROOM}"].connection
+
+        # When - the node is too old to know SSUBSCRIBE
+        connection.pushes.put_nowait(ResponseError("ERR unknown command 'SSUBSCRIBE'"))
+        await asyncio.sleep(0)
+
+        # Then
+        assert pubsub._resubscribing == set()
+        connection.send_command.assert_awaited_once()
+        assert [(record.levelname, record.message) for record in caplog.records] == [
+            ("ERROR", "A shard refused a subscription")
+        ]
+
+        await pubsub.aclose()
+
+    async def test_aclose_closes_every_connection(self, mock_cluster, mock_connection):
+        # Given
+        pubsub = ShardedPubSub(mock_cluster)
+        mock_cluster.get_node_from_key.side_effect = [
+            mock_node("NODE1"),
+            mock_node("NODE2"),
+        ]
+        await pubsub.subscribe("{ROOM1}")
+        await pubsub.subscribe("{ROOM2}")
+        shards = list(pubsub.channels.values())
+
+        # When
+        await pubsub.aclose()
+        await asyncio.sleep(0)
+
+        # Then
+        for shard in shards:
+            shard.connection.disconnect.assert_awaited_once()
+            assert shard.reader.cancelled()
+
+        assert pubsub.channels == {}